@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar benchmarks
+
+    python -m benchmarks parser              # parser micro benchmarks
+    python -m benchmarks search --rows 100000  # end to end searches
+    python -m benchmarks all --output report.json --compare baseline.json
+
+The standalone scripts `benchmarks/tokenizer.py` and
+`benchmarks/fulltext.py` compare single features with their predecessors.
+"""
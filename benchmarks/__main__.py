@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Run the djolar benchmarks, optionally write a JSON report and compare it
+with the report of another commit
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+
+from . import parser as parserBenchmarks
+from . import search as searchBenchmarks
+from .environment import get_environment, setup_django
+
+
+# Compared metrics and whether higher is better
+METRICS = (
+    ('queries_per_second', True),
+    ('p50_ms', False),
+    ('p99_ms', False),
+    ('sql_queries', False),
+    ('peak_kib', False),
+)
+
+
+def compare(results, baseline):
+    '''
+    Format the change of each metric from a baseline report
+    '''
+    previous = dict(
+        ((result['group'], result['name']), result)
+        for result in baseline['results']
+    )
+    lines = ['{:<10} {:<20} {:<20} {:>12} {:>12} {:>8}'.format(
+        'group', 'name', 'metric', 'baseline', 'current', 'change'
+    )]
+    for result in results:
+        old = previous.get((result['group'], result['name']))
+        if old is None:
+            continue
+        for metric, higherIsBetter in METRICS:
+            if metric not in result or metric not in old or not old[metric]:
+                continue
+            ratio = result[metric] / old[metric]
+            change = (ratio - 1) * 100
+            flag = ''
+            if abs(change) >= 10 and (change > 0) != higherIsBetter:
+                flag = ' worse'
+            lines.append(
+                '{:<10} {:<20} {:<20} {:>12.2f} {:>12.2f} {:>+7.1f}%{}'.format(
+                    result['group'], result['name'], metric, old[metric],
+                    result[metric], change, flag
+                )
+            )
+    return '\n'.join(lines)
+
+
+def main():
+    argParser = argparse.ArgumentParser(
+        prog='python -m benchmarks', description=__doc__.splitlines()[1]
+    )
+    argParser.add_argument(
+        'suite', nargs='?', default='all', choices=('parser', 'search', 'all')
+    )
+    argParser.add_argument(
+        '--rows', type=int, default=100000,
+        help='books seeded for the search benchmarks'
+    )
+    argParser.add_argument(
+        '--database', help='SQLite file of the search benchmarks, reused '
+        'across runs, by default benchmarks/data/books-<rows>.sqlite3'
+    )
+    argParser.add_argument(
+        '--number', type=int, default=None,
+        help='runs per measure, 2000 parses or 20 searches by default'
+    )
+    argParser.add_argument('--output', help='write the JSON report here')
+    argParser.add_argument('--compare', help='JSON report to compare with')
+    args = argParser.parse_args()
+
+    database = None
+    if args.suite in ('search', 'all'):
+        database = args.database or \
+            searchBenchmarks.get_default_database(args.rows)
+    # The search database must be configured before anything uses Django
+    setup_django(database)
+
+    results = []
+    if args.suite in ('parser', 'all'):
+        parserResults = parserBenchmarks.run(number=args.number or 2000)
+        print(parserBenchmarks.format_results(parserResults))
+        results.extend(parserResults)
+    if args.suite in ('search', 'all'):
+        searchResults = searchBenchmarks.run(
+            database, rows=args.rows, number=args.number or 20
+        )
+        print(searchBenchmarks.format_results(searchResults))
+        results.extend(searchResults)
+
+    report = {
+        'environment': dict(get_environment(), rows=args.rows),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            print(compare(results, json.load(baseline)))
+
+
+if __name__ == '__main__':
+    main()
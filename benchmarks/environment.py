@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Django setup and seeded data of the benchmarks, the example app models on
+SQLite
+"""
+from __future__ import unicode_literals
+
+import datetime
+import os
+import random
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = (
+    'python', 'django', 'search', 'query', 'index', 'database', 'language',
+    'programming', 'cooking', 'history', 'garden', 'travel', 'music',
+    'design', 'network', 'security', 'science', 'poetry', 'finance', 'art',
+)
+SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'ta', 'vo', 'zen', 'bri', 'sol')
+# Rare words, about one row in 500 contains each of them
+RARE_WORDS = tuple(
+    a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES
+)
+STATUSES = ('draft', 'review', 'published', 'archived')
+
+
+def setup_django(path=None):
+    '''
+    Configure Django with the example app
+    :param  path, The SQLite database file, in memory by default
+    '''
+    from django.conf import settings
+
+    if settings.configured:
+        return
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.join(ROOT, 'example'))
+
+    import django
+
+    settings.configure(
+        INSTALLED_APPS=['app'],
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': path or ':memory:',
+        }},
+        USE_TZ=True,
+    )
+    django.setup()
+
+
+def migrate():
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+
+
+def seed_books(rows, seed=0):
+    '''
+    Create `rows` books of `rows // 100` authors, names are two common and
+    two rare words
+    :param  rows, The number of books
+    :param  seed, The random seed, the data only depends on it and `rows`
+    '''
+    from app.models import Author, Book
+    from django.db import transaction
+
+    rand = random.Random(seed)
+    publishAt = datetime.datetime(2016, 1, 1, tzinfo=datetime.timezone.utc)
+    with transaction.atomic():
+        authors = Author.objects.bulk_create(
+            Author(name='author%05d' % i, age=rand.randint(20, 80))
+            for i in range(max(rows // 100, 1))
+        )
+        batch = []
+        for _ in range(rows):
+            batch.append(Book(
+                name=' '.join(
+                    rand.sample(WORDS, 2) + rand.sample(RARE_WORDS, 2)
+                ).title(),
+                publish_at=publishAt + datetime.timedelta(
+                    minutes=rand.randrange(3 * 365 * 24 * 60)
+                ),
+                author=rand.choice(authors),
+                status=rand.choice(STATUSES),
+            ))
+            if len(batch) == 5000:
+                Book.objects.bulk_create(batch)
+                batch = []
+        Book.objects.bulk_create(batch)
+
+
+def get_environment():
+    '''
+    Describe the benchmark environment for the report
+    '''
+    import django
+    import platform
+    import sqlite3
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.machine(),
+        'timestamp': datetime.datetime.now(
+            datetime.timezone.utc
+        ).isoformat(),
+    }
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: `fts` operator versus `co` (icontains) on `Book.name`
+
+Seeds the example app models into a temporary SQLite database, the `fts`
+clauses use the FTS5 table of the example migrations.
+
+Usage:
+    python benchmarks/fulltext.py [--rows N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.environment import (  # noqa: E402
+    migrate,
+    seed_books,
+    setup_django,
+)
+
+TERMS = ('python', 'kalomi', 'rutavo')
+
+
+def run(number):
+    from app.models import Book
+    from django.http.request import QueryDict
+    from djolar.fulltext import FullText
+    from djolar.parser import DjangoSearchParser
+
+    class BookSearcher(DjangoSearchParser):
+        model = Book
+        query_mapping = {'name': 'name'}
+        fulltext_search = {
+            'name': FullText('english', sqlite_table='app_book_fts'),
+        }
+
+    searcher = BookSearcher()
+    results = []
+    for term in TERMS:
+        timings = []
+        for operator in ('co', 'fts'):
+            queryset = Book.objects.filter(searcher.get_query_fields(
+                QueryDict('q=name__{}__{}'.format(operator, term))
+            ))
+            count = queryset.count()
+            seconds = min(timeit.repeat(
+                lambda: (queryset.count(), list(queryset[:20])),
+                number=number, repeat=3
+            )) / number
+            timings.append((count, seconds))
+        results.append((term, timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'fulltext.sqlite3'))
+        migrate()
+        seed_books(args.rows)
+
+        print('{:<10} {:>8} {:>12} {:>12} {:>8}'.format(
+            'term', 'rows', 'co ms', 'fts ms', 'speedup'
+        ))
+        for term, ((count, co), (_, fts)) in run(args.number):
+            print('{:<10} {:>8} {:>12.2f} {:>12.2f} {:>7.2f}x'.format(
+                term, count, co * 1000, fts * 1000, co / fts
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: `in` lists of 10, 1k and 100k ids, plain `IN (...)` versus the
+`large_in` lookup
+
+Parses `id__in__[...]` and counts the matching books of the example app
+seeded into a temporary SQLite database.
+
+Usage:
+    python benchmarks/inlist.py [--rows N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.environment import (  # noqa: E402
+    migrate,
+    seed_books,
+    setup_django,
+)
+
+SIZES = (10, 1000, 100000)
+
+
+def run(rows, number):
+    from app.models import Book
+    from django.db import DatabaseError
+    from django.http.request import QueryDict
+    from djolar.parser import DjangoSearchParser
+
+    class PlainSearcher(DjangoSearchParser):
+        model = Book
+        query_mapping = {'id': 'pk'}
+        large_list_threshold = None
+
+    class LargeListSearcher(PlainSearcher):
+        large_list_threshold = 1000
+
+    rand = random.Random(0)
+    results = []
+    for size in SIZES:
+        # Pasted selections, with duplicates and in no order
+        ids = [rand.randint(1, rows * 2) for _ in range(size)]
+        params = QueryDict('q=id__in__[{}]'.format(','.join(map(str, ids))))
+        timings = []
+        for searcherClass in (PlainSearcher, LargeListSearcher):
+            searcher = searcherClass()
+
+            def search():
+                return Book.objects.filter(
+                    searcher.get_query_fields(params)
+                ).count()
+
+            try:
+                count = search()
+                seconds = min(timeit.repeat(
+                    search, number=number, repeat=3
+                )) / number
+            except DatabaseError as e:
+                count, seconds = str(e), None
+            timings.append((count, seconds))
+        results.append((size, timings))
+    return results
+
+
+def format_time(seconds):
+    return 'error' if seconds is None else '{:.2f}'.format(seconds * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'inlist.sqlite3'))
+        migrate()
+        seed_books(args.rows)
+
+        print('{:>8} {:>8} {:>12} {:>12}'.format(
+            'values', 'rows', 'in ms', 'large_in ms'
+        ))
+        for size, ((_, plain), (count, large)) in run(args.rows, args.number):
+            print('{:>8} {:>8} {:>12} {:>12}'.format(
+                size, count, format_time(plain), format_time(large)
+            ))
+
+
+if __name__ == '__main__':
+    main()
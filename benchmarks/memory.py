@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: searches sent to the database versus evaluated in memory by
+`djolar.memory.MemorySearch`
+
+Counts and fetches the first page of a set of searches on the example app
+seeded into a temporary SQLite database. Requires NumPy.
+
+Usage:
+    python benchmarks/memory.py [--rows N] [--page N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.environment import (  # noqa: E402
+    migrate,
+    seed_books,
+    setup_django,
+)
+
+QUERIES = [
+    's=-date',
+    'q=name__co__python&s=-date',
+    'q=st__eq__published|age__gte__40&s=name',
+    'q=st__in__[draft,review]|date__lt__2015-01-01&s=-date',
+]
+
+
+def run(page, number):
+    from app.models import Book
+    from django.http import QueryDict
+    from django.test import RequestFactory
+    from djolar.memory import MemorySearch
+    from djolar.mixins import DjangoSearchMixin
+    from djolar.parser import DjangoSearchParser
+
+    class BookSearcher(DjangoSearchParser):
+        query_mapping = {
+            'name': 'name',
+            'st': 'status',
+            'author': 'author__name',
+            'age': 'author__age',
+            'date': 'publish_at',
+        }
+        cache_size = 1024
+
+    class BookView(DjangoSearchMixin):
+        searcher_class = BookSearcher
+        queryset = Book.objects.all()
+
+    memory = MemorySearch(BookSearcher, Book.objects.all())
+    loading = timeit.timeit(memory.refresh, number=1)
+
+    def database():
+        for query in QUERIES:
+            view = BookView()
+            view.request = RequestFactory().get('/?' + query)
+            view.get_search_results(0, page)
+
+    def in_memory():
+        for query in QUERIES:
+            memory.search(QueryDict(query), 0, page)
+
+    results = []
+    for name, search in (('database', database), ('memory', in_memory)):
+        seconds = min(timeit.repeat(search, number=number, repeat=3))
+        results.append((name, seconds / number / len(QUERIES)))
+    return loading, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--page', type=int, default=20)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'memory.sqlite3'))
+        migrate()
+        seed_books(args.rows)
+
+        loading, results = run(args.page, args.number)
+        print('snapshot loaded in {:.1f} ms'.format(loading * 1000))
+        database = results[0][1]
+        print('{:<10} {:>12} {:>8}'.format('backend', 'ms/search', 'speedup'))
+        for name, seconds in results:
+            print('{:<10} {:>12.3f} {:>7.2f}x'.format(
+                name, seconds * 1000, database / seconds
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Parser micro benchmarks: `get_query_fields` throughput per operator, for
+long `in` lists, many clause queries and fan out mappings
+"""
+from __future__ import unicode_literals
+
+import timeit
+
+from .environment import setup_django
+
+
+FANOUT_FIELDS = tuple('field%d' % i for i in range(8))
+
+
+def get_scenarios():
+    '''
+    Return (group, name, query, searcher class, clauses per query) tuples
+    '''
+    from app.models import Book
+    from djolar.parser import DjangoSearchParser
+
+    class BookSearcher(DjangoSearchParser):
+        query_mapping = {
+            'name': 'name',
+            'st': 'status',
+            'age': 'author__age',
+            'date': 'publish_at',
+        }
+
+    class TypedSearcher(BookSearcher):
+        model = Book
+
+    class CachedSearcher(TypedSearcher):
+        cache_size = 1024
+
+    class FanoutSearcher(DjangoSearchParser):
+        query_mapping = dict(
+            ('f%d' % size, FANOUT_FIELDS[:size]) for size in (1, 2, 4, 8)
+        )
+
+    scenarios = []
+    for operator, value in (
+            ('co', 'programming'), ('eq', 'published'), ('lt', '30'),
+            ('gte', '30'), ('in', '[draft,published]'),
+            ('ni', '[draft,published]')):
+        key = 'age' if operator in ('lt', 'gte') else 'st'
+        scenarios.append((
+            'operator', operator,
+            'q={}__{}__{}'.format(key, operator, value), BookSearcher, 1
+        ))
+    scenarios.append((
+        'operator', 'lt typed', 'q=age__lt__30', TypedSearcher, 1
+    ))
+    scenarios.append((
+        'operator', 'lte typed datetime', 'q=date__lte__2017-06-01',
+        TypedSearcher, 1
+    ))
+    scenarios.append((
+        'operator', 'lt cached', 'q=age__lt__30', CachedSearcher, 1
+    ))
+
+    for size in (10, 100, 1000):
+        scenarios.append((
+            'in_list', str(size),
+            'q=age__in__[{}]'.format(','.join(str(i) for i in range(size))),
+            TypedSearcher, 1
+        ))
+
+    for size in (1, 5, 20, 50):
+        clauses = ['st__co__word%d' % i for i in range(size)]
+        scenarios.append((
+            'clauses', str(size), 'q=' + '|'.join(clauses), BookSearcher, size
+        ))
+
+    for size in (1, 2, 4, 8):
+        scenarios.append((
+            'fanout', str(size), 'q=f{}__co__python'.format(size),
+            FanoutSearcher, 1
+        ))
+    return scenarios
+
+
+def run(number=2000, repeat=3):
+    '''
+    Run the parser benchmarks
+    :param  number, The number of queries parsed per timing
+    :param  repeat, The number of timings, the best one is kept
+    :return List of result dicts
+    '''
+    setup_django()
+    from django.http.request import QueryDict
+
+    results = []
+    for group, name, query, searcherClass, clauses in get_scenarios():
+        searcher = searcherClass()
+        params = QueryDict(query)
+        seconds = min(timeit.repeat(
+            lambda: searcher.get_query_fields(params),
+            number=number, repeat=repeat
+        ))
+        results.append({
+            'group': group,
+            'name': name,
+            'queries_per_second': number / seconds,
+            'clauses_per_second': number * clauses / seconds,
+            'us_per_query': seconds / number * 1e6,
+        })
+    return results
+
+
+def format_results(results):
+    lines = ['{:<10} {:<20} {:>14} {:>14} {:>10}'.format(
+        'group', 'name', 'queries/s', 'clauses/s', 'us/query'
+    )]
+    for result in results:
+        lines.append('{:<10} {:<20} {:>14,.0f} {:>14,.0f} {:>10.2f}'.format(
+            result['group'], result['name'], result['queries_per_second'],
+            result['clauses_per_second'], result['us_per_query']
+        ))
+    return '\n'.join(lines)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: fetching full model instances versus the `f` projection param
+in the `only` and `values` modes
+
+Fetches pages of books with their author name from the example app seeded
+into a temporary SQLite database.
+
+Usage:
+    python benchmarks/projection.py [--rows N] [--page N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.environment import (  # noqa: E402
+    migrate,
+    seed_books,
+    setup_django,
+)
+
+
+def run(page, number):
+    from app.models import Book
+    from django.test import RequestFactory
+    from djolar.mixins import DjangoSearchMixin
+    from djolar.parser import DjangoSearchParser
+
+    class BookSearcher(DjangoSearchParser):
+        query_mapping = {
+            'name': 'name',
+            'st': 'status',
+            'author': 'author__name',
+            'date': 'publish_at',
+        }
+        projection_keys = ['name', 'author', 'date']
+
+    class BookView(DjangoSearchMixin):
+        searcher_class = BookSearcher
+        queryset = Book.objects.all()
+
+    def render(row):
+        if isinstance(row, dict):
+            return row['name'], row['author__name']
+        return row.name, row.author.name
+
+    results = []
+    for name, query, mode in (
+            ('full', 's=-date', 'only'),
+            ('only', 's=-date&f=name,author', 'only'),
+            ('values', 's=-date&f=name,author', 'values')):
+        request = RequestFactory().get('/?' + query)
+
+        def search():
+            view = BookView()
+            view.request = request
+            view.projection_mode = mode
+            return [render(row) for row in view.get_queryset()[:page]]
+
+        seconds = min(timeit.repeat(search, number=number, repeat=3))
+        results.append((name, seconds / number))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--page', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'projection.sqlite3'))
+        migrate()
+        seed_books(args.rows)
+
+        results = run(args.page, args.number)
+        full = results[0][1]
+        print('{:<8} {:>12} {:>8}'.format('mode', 'ms/page', 'speedup'))
+        for name, seconds in results:
+            print('{:<8} {:>12.2f} {:>7.2f}x'.format(
+                name, seconds * 1000, full / seconds
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+End to end search benchmarks: a `DjangoSearchMixin` view on the example
+`Book`/`Author` app seeded in SQLite, the count and the first page of each
+search are fetched. SQL query counts, latency percentiles and the peak
+memory allocated per search are reported.
+"""
+from __future__ import unicode_literals
+
+import os
+import time
+import tracemalloc
+
+from .environment import migrate, seed_books, setup_django
+
+
+SCENARIOS = (
+    ('all', ''),
+    ('eq', 'q=st__eq__published'),
+    ('co', 'q=name__co__kalomi'),
+    ('fts', 'q=name__fts__kalomi'),
+    ('in', 'q=st__in__[draft,review]'),
+    ('range', 'q=date__gte__2017-01-01|date__lte__2017-02-01'),
+    ('join', 'q=age__gte__70&s=-date'),
+    ('order', 'q=st__eq__draft&s=-date,name'),
+    ('clauses', 'q=st__ni__[archived]|age__lt__60|date__gt__2016-06-01'
+                '|name__co__python&s=name'),
+)
+
+
+def get_view_class():
+    from app.models import Book
+    from djolar.fulltext import FullText
+    from djolar.mixins import DjangoSearchMixin
+    from djolar.parser import DjangoSearchParser
+
+    class BookSearcher(DjangoSearchParser):
+        query_mapping = {
+            'name': 'name',
+            'st': 'status',
+            'author': 'author__name',
+            'age': 'author__age',
+            'date': 'publish_at',
+        }
+        fulltext_search = {
+            'name': FullText('english', sqlite_table='app_book_fts'),
+        }
+
+    class BookView(DjangoSearchMixin):
+        searcher_class = BookSearcher
+        queryset = Book.objects.all()
+
+    return BookView
+
+
+def prepare_database(path, rows):
+    '''
+    Configure Django on the database file, migrate and seed it unless it
+    already holds `rows` books, so runs across commits share the data
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    setup_django(path)
+    migrate()
+
+    from app.models import Book
+
+    count = Book.objects.count()
+    if count == 0:
+        seed_books(rows)
+    elif count != rows:
+        raise ValueError('{} holds {} books, expected {}'.format(
+            path, count, rows
+        ))
+
+
+def percentile(values, fraction):
+    # Nearest rank
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_search(viewClass, query, limit):
+    from django.test import RequestFactory
+
+    view = viewClass()
+    view.request = RequestFactory().get('/?' + query)
+    count, rows = view.get_search_results(offset=0, limit=limit)
+    # Touch the joined relations like a serializer would
+    for row in rows:
+        row.author.name
+    return count
+
+
+def run(path, rows=100000, number=20, limit=20):
+    '''
+    Run the end to end benchmarks
+    :param  path, The SQLite database file, created if missing
+    :param  rows, The number of books seeded
+    :param  number, The number of runs of each search
+    :param  limit, The page size
+    :return List of result dicts
+    '''
+    prepare_database(path, rows)
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    viewClass = get_view_class()
+    results = []
+    for name, query in SCENARIOS:
+        # Warm up, the SQLite page cache and the searcher plan
+        with CaptureQueriesContext(connection) as queries:
+            count = run_search(viewClass, query, limit)
+
+        timings = []
+        for _ in range(number):
+            start = time.perf_counter()
+            run_search(viewClass, query, limit)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            run_search(viewClass, query, limit)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        results.append({
+            'group': 'search',
+            'name': name,
+            'query': query,
+            'rows': count.count,
+            'sql_queries': len(queries),
+            'p50_ms': percentile(timings, 0.5) * 1000,
+            'p90_ms': percentile(timings, 0.9) * 1000,
+            'p99_ms': percentile(timings, 0.99) * 1000,
+            'peak_kib': peak / 1024,
+        })
+    return results
+
+
+def format_results(results):
+    lines = ['{:<10} {:>8} {:>6} {:>10} {:>10} {:>10} {:>10}'.format(
+        'search', 'rows', 'sql', 'p50 ms', 'p90 ms', 'p99 ms', 'peak KiB'
+    )]
+    for result in results:
+        lines.append(
+            '{:<10} {:>8} {:>6} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.1f}'
+            .format(
+                result['name'], result['rows'], result['sql_queries'],
+                result['p50_ms'], result['p90_ms'], result['p99_ms'],
+                result['peak_kib']
+            )
+        )
+    return '\n'.join(lines)
+
+
+def get_default_database(rows):
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        'data', 'books-{}.sqlite3'.format(rows)
+    )
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: searches built and compiled by Django versus SQL templates
+reused by query shape
+
+Runs searches of one shape with varying values on the example app seeded
+into a temporary SQLite database, with the parse cache enabled in both
+runs.
+
+Usage:
+    python benchmarks/templates.py [--rows N] [--page N] [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.environment import (  # noqa: E402
+    migrate,
+    seed_books,
+    setup_django,
+)
+
+
+def run(page, number):
+    from app.models import Book
+    from django.test import RequestFactory
+    from djolar.mixins import DjangoSearchMixin
+    from djolar.parser import DjangoSearchParser
+    from djolar.templates import SQLTemplateCache
+
+    class BookSearcher(DjangoSearchParser):
+        query_mapping = {
+            'name': 'name',
+            'st': 'status',
+            'author': 'author__name',
+            'age': 'author__age',
+            'date': 'publish_at',
+        }
+        cache_size = 1024
+
+    class BookView(DjangoSearchMixin):
+        searcher_class = BookSearcher
+        queryset = Book.objects.all()
+
+    requests = [
+        RequestFactory().get(
+            '/?q=name__co__{}|age__gt__{}|st__in__[draft,{}]&s=-date'.format(
+                idx % 10, idx % 50, idx
+            )
+        )
+        for idx in range(100)
+    ]
+
+    results = []
+    for name, templates in (
+            ('django', None), ('template', SQLTemplateCache())):
+        def search():
+            for request in requests:
+                view = BookView()
+                view.request = request
+                view.sql_templates = templates
+                view.get_search_results(0, page)
+
+        seconds = min(timeit.repeat(search, number=number, repeat=3))
+        results.append((name, seconds / number / len(requests)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--page', type=int, default=20)
+    parser.add_argument('--number', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'templates.sqlite3'))
+        migrate()
+        seed_books(args.rows)
+
+        results = run(args.page, args.number)
+        django = results[0][1]
+        print('{:<10} {:>12} {:>8}'.format('mode', 'ms/search', 'speedup'))
+        for name, seconds in results:
+            print('{:<10} {:>12.3f} {:>7.2f}x'.format(
+                name, seconds * 1000, django / seconds
+            ))
+
+
+if __name__ == '__main__':
+    main()
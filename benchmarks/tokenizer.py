@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Micro benchmark: clause tokenizer versus the legacy regex cascade
+
+Usage:
+    python benchmarks/tokenizer.py [--number N]
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from djolar.tokenizer import tokenize  # noqa: E402
+
+
+# The regex cascade used by `get_query_fields` before the tokenizer
+LEGACY_PATTERNS = (
+    r'(\w+)__co__(\S+)',
+    r'(\w+)__lt__(\S+)',
+    r'(\w+)__gt__(\S+)',
+    r'(\w+)__lte__(\S+)',
+    r'(\w+)__gte__(\S+)',
+    r'(\w+)__eq__(\S+)',
+    r'(\w+)__in__\[(\S+)\]',
+    r'(\w+)__ni__\[(\S+)\]',
+)
+
+CLAUSES = (
+    'name__co__Programming',
+    'age__lt__18',
+    'age__gt__18',
+    'age__lte__18',
+    'age__gte__18',
+    'status__eq__published',
+    'status__in__[draft,published,archived]',
+    'status__ni__[draft,published,archived]',
+)
+
+
+def legacy_tokenize(clause):
+    for pattern in LEGACY_PATTERNS:
+        match = re.match(pattern, clause)
+        if match:
+            return match.groups()
+
+
+def run(number):
+    results = []
+    for clause in CLAUSES:
+        legacy = min(timeit.repeat(
+            lambda: legacy_tokenize(clause), number=number, repeat=3
+        ))
+        current = min(timeit.repeat(
+            lambda: tokenize(clause), number=number, repeat=3
+        ))
+        results.append((clause, number / legacy, number / current))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=100000)
+    args = parser.parse_args()
+
+    print('{:<42} {:>14} {:>14} {:>8}'.format(
+        'clause', 'legacy/s', 'tokenizer/s', 'speedup'
+    ))
+    for clause, legacy, current in run(args.number):
+        print('{:<42} {:>14,.0f} {:>14,.0f} {:>7.2f}x'.format(
+            clause, legacy, current, current / legacy
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar parse result cache
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+import threading
+import time
+
+
+class SearchCache(object):
+    '''
+    Bounded LRU cache with an optional time to live, safe to share between
+    threads. Hit, miss and eviction counters are kept for monitoring.
+    '''
+    def __init__(self, maxsize, ttl=None):
+        assert isinstance(maxsize, int) and maxsize > 0, \
+            'cache_size should be a positive integer'
+        assert ttl is None or ttl > 0, \
+            'cache_ttl should be a positive number of seconds'
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Get a cached value
+        :param  key, The cache key
+        :return The cached value, or None if missing or expired
+        '''
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''
+        Cache a value, evict the least recently used one if full
+        :param  key, The cache key
+        :param  value, The value to cache, should not be None
+        '''
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = time.monotonic() + self.ttl
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        '''
+        Remove all cached values and reset the counters
+        '''
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        '''
+        Return the cache counters
+        '''
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar query canonicalization
+
+Equivalent queries are rewritten into the same list of clauses: duplicates
+are dropped, clauses on a key are merged, clauses implied by stronger ones
+are dropped and the rest is sorted. Values are compared as Python values,
+bounds are only compared when the values are typed (not strings), since
+the database may order strings differently.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from .fulltext import FullTextQuery
+from .tokenizer import OPERATOR_PRIORITY, OPERATORS, Operator
+
+
+Clause = namedtuple('Clause', ['key', 'operator', 'value'])
+
+# Internal operator for a merged `gte` and `lte` pair
+RANGE = Operator('range', '{}__range', '{}__range', False, False)
+
+_ORDER = dict(
+    (name, idx) for idx, name in enumerate(OPERATOR_PRIORITY + ('range', ))
+)
+
+
+def _is_comparable(value):
+    return not isinstance(value, str)
+
+
+def _stronger_bound(current, clause, lower):
+    '''
+    Return the stronger of two bounds, or None if they can not be compared
+    '''
+    if current.value == clause.value:
+        # `gt` is stronger than `gte`, `lt` than `lte`
+        return clause if len(clause.operator.name) == 2 else current
+    if not (_is_comparable(current.value) and _is_comparable(clause.value)):
+        return None
+    try:
+        if lower:
+            return clause if clause.value > current.value else current
+        return clause if clause.value < current.value else current
+    except TypeError:
+        return None
+
+
+def _reduce_bounds(clauses, lower):
+    kept = []
+    for clause in clauses:
+        for idx, current in enumerate(kept):
+            stronger = _stronger_bound(current, clause, lower)
+            if stronger is not None:
+                kept[idx] = stronger
+                break
+        else:
+            kept.append(clause)
+    return kept
+
+
+def _satisfies(value, bound):
+    '''
+    Whether `value` satisfies the bound clause, None if unknown
+    '''
+    if value == bound.value:
+        return bound.operator.name in ('gte', 'lte')
+    if not (_is_comparable(value) and _is_comparable(bound.value)):
+        return None
+    try:
+        return {
+            'gt': value > bound.value,
+            'gte': value >= bound.value,
+            'lt': value < bound.value,
+            'lte': value <= bound.value,
+        }[bound.operator.name]
+    except TypeError:
+        return None
+
+
+def _sorted_values(values):
+    try:
+        return tuple(sorted(set(values)))
+    except TypeError:
+        return tuple(sorted(set(values), key=repr))
+
+
+def _canonicalize_key(key, clauses, singleField):
+    byOperator = {}
+    for clause in clauses:
+        byOperator.setdefault(clause.operator.name, []).append(clause)
+
+    result = []
+
+    equals = [clause.value for clause in byOperator.pop('eq', [])]
+    for value in _sorted_values(equals):
+        result.append(Clause(key, OPERATORS['eq'], value))
+
+    lists = byOperator.pop('in', [])
+    if lists:
+        if singleField:
+            # Intersect the lists of a single field
+            values = set(lists[0].value)
+            for clause in lists[1:]:
+                values &= set(clause.value)
+            lists = [values]
+        else:
+            lists = set(_sorted_values(clause.value) for clause in lists)
+        for values in sorted(lists, key=repr):
+            if any(value in values for value in equals):
+                # Implied by an `eq` clause
+                continue
+            result.append(Clause(key, OPERATORS['in'], _sorted_values(values)))
+
+    excludes = byOperator.pop('ni', [])
+    if excludes:
+        # Union of the excluded values, for any field mapping
+        values = set()
+        for clause in excludes:
+            values.update(clause.value)
+        result.append(Clause(key, OPERATORS['ni'], _sorted_values(values)))
+
+    contains = set(clause.value for clause in byOperator.pop('co', []))
+    for value in sorted(contains):
+        if any(value != other and value in other for other in contains):
+            # Implied by a longer term
+            continue
+        result.append(Clause(key, OPERATORS['co'], value))
+
+    # Every term must match, their order does not matter
+    texts = set(
+        clause.value._replace(terms=tuple(sorted(set(clause.value.terms))))
+        for clause in byOperator.pop('fts', [])
+    )
+    for value in sorted(texts, key=repr):
+        result.append(Clause(key, OPERATORS['fts'], value))
+
+    lowers = _reduce_bounds(
+        byOperator.pop('gt', []) + byOperator.pop('gte', []), True
+    )
+    uppers = _reduce_bounds(
+        byOperator.pop('lt', []) + byOperator.pop('lte', []), False
+    )
+    bounds = []
+    for bound in lowers + uppers:
+        if any(_satisfies(value, bound) for value in equals):
+            # Implied by an `eq` clause
+            continue
+        bounds.append(bound)
+
+    if singleField and len(bounds) == 2 and \
+            [bound.operator.name for bound in bounds] == ['gte', 'lte']:
+        result.append(Clause(key, RANGE, (bounds[0].value, bounds[1].value)))
+    else:
+        result.extend(bounds)
+
+    return result
+
+
+def canonicalize(plan, clauses):
+    '''
+    Rewrite the clauses into their canonical form
+    :param  plan, The compiled `SearchPlan`
+    :param  clauses, List of `Clause`, list values as tuples
+    :return List of `Clause` in canonical order
+    '''
+    byKey = {}
+    for clause in clauses:
+        byKey.setdefault(clause.key, []).append(clause)
+
+    result = []
+    for key in sorted(byKey):
+        singleField = len(plan.lookups[key]['eq']) == 1
+        result.extend(_canonicalize_key(key, byKey[key], singleField))
+
+    result.sort(key=lambda clause: (
+        clause.key, _ORDER[clause.operator.name], repr(clause.value)
+    ))
+    return result
+
+
+def _format_value(value):
+    if isinstance(value, tuple) and not isinstance(value, FullTextQuery):
+        return '[{}]'.format(','.join(str(i) for i in value))
+    return str(value)
+
+
+def format_clauses(clauses):
+    '''
+    Render the clauses as a `q` query param value, a merged range is
+    rendered as its `gte` and `lte` clauses
+    :param  clauses, List of `Clause`
+    :return The query string
+    '''
+    parts = []
+    for clause in clauses:
+        if clause.operator is RANGE:
+            lower, upper = clause.value
+            parts.append(
+                '{}__gte__{}'.format(clause.key, _format_value(lower))
+            )
+            parts.append(
+                '{}__lte__{}'.format(clause.key, _format_value(upper))
+            )
+        else:
+            parts.append('{}__{}__{}'.format(
+                clause.key, clause.operator.name, _format_value(clause.value)
+            ))
+    return '|'.join(parts)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar typed value coercion
+"""
+from __future__ import unicode_literals
+
+from functools import lru_cache
+
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from .exceptions import InvalidSearchValue
+from .relations import resolve_path
+
+
+# Lookups that compare the value with the field itself
+_COMPARISON_LOOKUPS = frozenset(['exact', 'gt', 'gte', 'lt', 'lte'])
+
+
+class FieldConverter(object):
+    '''
+    Convert query string values to the Python type of a model field
+    '''
+    def __init__(self, field):
+        self.field = field
+        self.internal_type = field.get_internal_type()
+
+    def __call__(self, value):
+        value = self.field.to_python(value)
+        if isinstance(value, datetime.datetime) and settings.USE_TZ and \
+                timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+
+def _get_target_field(model, path):
+    fields, lookups = resolve_path(model, path)
+    if not fields or not _COMPARISON_LOOKUPS.issuperset(lookups):
+        return None
+
+    field = fields[-1]
+    if field.is_relation:
+        if not (field.many_to_one or field.one_to_one) or not field.concrete:
+            return None
+        # Foreign keys take the value of the target field
+        field = field.target_field
+    return field
+
+
+@lru_cache(maxsize=None)
+def get_key_converter(model, paths):
+    '''
+    Get the converter of a query key
+    :param  model, The model class being searched
+    :param  paths, Tuple of the model field paths mapped to the key
+    :return FieldConverter, or None if the values are left as strings
+    '''
+    fields = [_get_target_field(model, path) for path in paths]
+    if not fields or None in fields:
+        return None
+
+    converters = [FieldConverter(field) for field in fields]
+    if len(set(converter.internal_type for converter in converters)) != 1:
+        # A fan out over fields of different types
+        return None
+    if converters[0].internal_type in ('CharField', 'TextField'):
+        return None
+    return converters[0]
+
+
+def coerce_value(converter, key, operator, value):
+    '''
+    Convert a clause value, raise `InvalidSearchValue` if it is not valid
+    :param  converter, The `FieldConverter` of the key
+    :param  key, The query key
+    :param  operator, The clause `Operator`
+    :param  value, The raw clause value, a tuple for list operators
+    :return The converted value
+    '''
+    try:
+        if operator.is_list:
+            return tuple(converter(i) for i in value)
+        return converter(value)
+    except ValidationError as e:
+        raise InvalidSearchValue(
+            'Invalid search value',
+            key=key, value=list(value) if operator.is_list else value,
+            errors=list(e.messages)
+        )
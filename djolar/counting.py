@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar count strategies for paginated searches
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db import connections
+
+from .guard import estimate_query_cost
+
+
+class SearchCount(namedtuple('SearchCount', ['count', 'exact', 'has_next'])):
+    '''
+    Result of a count strategy, `exact` tells whether `count` is the exact
+    number of rows, `has_next` is only known to the `HasNextCount` strategy
+    '''
+    __slots__ = ()
+
+    def as_dict(self):
+        return {'count': self.count, 'count_exact': self.exact}
+
+
+class ExactCount(object):
+    '''
+    Run `COUNT(*)` on the search queryset
+    '''
+    def get_count(self, queryset, offset=0, limit=None):
+        '''
+        Count the search results
+        :param  queryset, The search queryset
+        :param  offset, The index of the first row of the page
+        :param  limit, The page size
+        :return SearchCount
+        '''
+        return SearchCount(queryset.count(), True, None)
+
+    async def aget_count(self, queryset, offset=0, limit=None):
+        '''
+        Async version of `get_count`
+        '''
+        if type(self).get_count is ExactCount.get_count:
+            return SearchCount(await queryset.acount(), True, None)
+        return await sync_to_async(self.get_count)(queryset, offset, limit)
+
+
+class CachedCount(ExactCount):
+    '''
+    Keep exact counts in the Django cache, keyed by the compiled SQL so
+    filters added by the view are part of the key
+    '''
+    def __init__(self, timeout=60, cache_alias='default',
+                 key_prefix='djolar:count'):
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+
+    def get_cache_key(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.sha1(
+            '{}|{}|{!r}'.format(queryset.db, sql, params).encode('utf-8')
+        ).hexdigest()
+        return '{}:{}'.format(self.key_prefix, digest)
+
+    def get_count(self, queryset, offset=0, limit=None):
+        cache = caches[self.cache_alias]
+        key = self.get_cache_key(queryset)
+        count = cache.get(key)
+        if count is not None:
+            # The rows may have changed since it was cached
+            return SearchCount(count, False, None)
+
+        count = queryset.count()
+        cache.set(key, count, self.timeout)
+        return SearchCount(count, True, None)
+
+
+class EstimatedCount(ExactCount):
+    '''
+    Use the PostgreSQL planner estimates: `reltuples` when the search has no
+    filter, the `EXPLAIN` row estimate otherwise. Small estimates, and other
+    databases, fall back to an exact count.
+    '''
+    def __init__(self, exact_below=1000):
+        self.exact_below = exact_below
+
+    def get_estimate(self, queryset):
+        '''
+        Return the estimated row count, or None if the database can not tell
+        '''
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        if not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            # -1 if the table was never analyzed
+            if row and row[0] >= 0:
+                return row[0]
+            return None
+
+        return estimate_query_cost(queryset)[1]
+
+    def get_count(self, queryset, offset=0, limit=None):
+        estimate = self.get_estimate(queryset)
+        if estimate is None or estimate < self.exact_below:
+            return super(EstimatedCount, self).get_count(
+                queryset, offset, limit
+            )
+        return SearchCount(int(estimate), False, None)
+
+
+class HasNextCount(ExactCount):
+    '''
+    Skip the count, fetch `limit + 1` rows of the page to know whether there
+    is a next page. The count is exact on the last page only.
+    `DjangoSearchMixin.get_search_results` fetches the extra row with the
+    page, `get_count` runs a query on the keys.
+    '''
+    def get_count(self, queryset, offset=0, limit=None):
+        if limit is None:
+            return super(HasNextCount, self).get_count(queryset, offset, limit)
+
+        fetched = len(queryset.prefetch_related(None).values_list(
+            'pk', flat=True
+        )[offset:offset + limit + 1])
+        return self.get_page_count(offset, limit, fetched)
+
+    def get_page_count(self, offset, limit, fetched):
+        '''
+        Count the search results from the page
+        :param  offset, The index of the first row of the page
+        :param  limit, The page size
+        :param  fetched, The number of rows fetched from `offset`, at most
+                `limit + 1`
+        :return SearchCount
+        '''
+        hasNext = fetched > limit
+        # Past the last page the count is unknown
+        exact = not hasNext and (fetched > 0 or offset == 0)
+        return SearchCount(offset + min(fetched, limit), exact, hasNext)
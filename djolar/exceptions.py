@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar search errors
+"""
+from __future__ import unicode_literals
+
+
+class SearchError(Exception):
+    '''
+    Base class of the search errors, `code` and `detail` let the view
+    build a structured response for the client
+    '''
+    code = 'search_error'
+
+    def __init__(self, message, **detail):
+        super(SearchError, self).__init__(message)
+        self.message = message
+        self.detail = detail
+
+    def as_dict(self):
+        '''
+        Return the error as a dict for the response body
+        '''
+        error = {'code': self.code, 'message': self.message}
+        error.update(self.detail)
+        return error
+
+
+class InvalidCursor(SearchError):
+    '''
+    The pagination cursor is malformed or does not match the ordering
+    '''
+    code = 'invalid_cursor'
+
+
+class SearchRejected(SearchError):
+    '''
+    The query is over the limits of the searcher, `detail` tells which one
+    '''
+    code = 'search_rejected'
+
+
+class InvalidSearchValue(SearchError):
+    '''
+    A clause value can not be converted to the type of its model field
+    '''
+    code = 'invalid_value'
+
+
+class InvalidSearchExpression(SearchError):
+    '''
+    The boolean `q` expression is malformed, eg. unbalanced parentheses,
+    `detail` holds the token position
+    '''
+    code = 'invalid_expression'
+
+
+class SearchTimeout(SearchError):
+    '''
+    The search ran over its time budget, `detail` holds the timeout in
+    seconds and the step which was running
+    '''
+    code = 'search_timeout'
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar streaming export
+"""
+from __future__ import unicode_literals
+
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .relations import resolve_path
+
+
+class _Echo(object):
+    '''
+    File like object returning what is written, lets `csv.writer` produce
+    lines for a streaming response
+    '''
+    def write(self, value):
+        return value
+
+
+def get_export_fields(model, queryMapping, keys=None):
+    '''
+    Get the query keys and model field paths to export
+    :param  model, The model class being searched
+    :param  queryMapping, The searcher query mapping
+    :param  keys, The query keys to export, by default every key mapped to
+            a single valued field
+    :return List of (key, path) tuples
+    '''
+    fields = []
+    for key, path in queryMapping.items():
+        if keys is not None and key not in keys:
+            continue
+        if not isinstance(path, str):
+            continue
+        resolved, lookups = resolve_path(model, path)
+        if lookups or any(
+                field.many_to_many or field.one_to_many
+                for field in resolved):
+            # Lookups can not be projected, and multi valued relations
+            # would repeat the row
+            continue
+        fields.append((key, path))
+
+    if keys is not None:
+        # Keep the requested order
+        fields.sort(key=lambda item: list(keys).index(item[0]))
+    return fields
+
+
+def iter_csv(rows, keys):
+    '''
+    Generate CSV lines, the header line first
+    :param  rows, Iterable of value tuples
+    :param  keys, The column names
+    '''
+    writer = csv.writer(_Echo())
+    yield writer.writerow(keys)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_jsonl(rows, keys):
+    '''
+    Generate JSON Lines, one object per row
+    :param  rows, Iterable of value tuples
+    :param  keys, The object keys
+    '''
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for row in rows:
+        yield encoder.encode(dict(zip(keys, row))) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8'),
+}
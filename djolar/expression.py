@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar boolean search expressions
+
+    q=(st__eq__draft OR st__eq__review) AND NOT age__lt__30
+
+Clauses are combined with `AND`, `OR`, `NOT` and parentheses, `|` and
+juxtaposition are `AND`, `NOT` binds tighter than `AND`, which binds tighter
+than `OR`. A `q` value without keywords or parentheses keeps the flat
+`|` syntax.
+
+The expression is parsed into a tree of `Node` and `Clause`, optimized and
+compiled into a `Q` object:
+
+* nested connectors of the same kind are flattened, double negations and
+  constant branches are removed
+* `eq`/`in` clauses on one key under an `OR` become one `in` clause
+* the clauses under an `AND` are canonicalized like a flat query, and a
+  contradiction on a single field key (eg. `age__lt__1 AND age__gt__5`
+  with typed values) or `x AND NOT x` makes the `AND` match nothing,
+  compiled into `Q(pk__in=[])` which the ORM answers without SQL
+
+The `in` merge and the contradictions only apply to the keys mapped to
+model fields, a key mapped to a lookup like `publish_at__gte` is kept as
+is.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+import re
+
+from django.db.models import Q
+
+from .canonical import (
+    RANGE,
+    Clause,
+    canonicalize,
+    format_clauses,
+    _satisfies,
+    _sorted_values,
+)
+from .exceptions import InvalidSearchExpression
+from .tokenizer import OPERATORS
+
+
+Node = namedtuple('Node', ['connector', 'children'])
+
+# An empty `AND` matches every row, an empty `OR` none
+TRUE = Node('AND', ())
+FALSE = Node('OR', ())
+
+KEYWORDS = frozenset(['AND', 'OR', 'NOT'])
+
+# Nesting limit of the parentheses and `NOT`
+MAX_DEPTH = 32
+
+_EXPRESSION_RE = re.compile(r'(?:^|\s)(?:AND|OR|NOT)(?=\s|$)|(?:^|[\s|])\(')
+
+_LPAREN = '('
+_RPAREN = ')'
+
+
+def is_expression(keys):
+    '''
+    Whether the `q` value uses the boolean grammar, a keyword or an opening
+    parenthesis, rather than the flat `|` syntax
+    '''
+    return _EXPRESSION_RE.search(keys) is not None
+
+
+def tokenize_expression(keys):
+    '''
+    Split an expression into `(`, `)`, keywords and clause strings. `(` are
+    read at the start of a word, `)` at its end while a parenthesis is
+    open, so values may contain parentheses.
+    :param  keys, The `q` query param value
+    :return List of tokens
+    '''
+    tokens = []
+    depth = 0
+    for word in keys.split():
+        for part in word.split('|'):
+            if not part:
+                continue
+            while part.startswith(_LPAREN):
+                tokens.append(_LPAREN)
+                depth += 1
+                part = part[1:]
+            closing = 0
+            while closing < depth and part.endswith(_RPAREN):
+                part = part[:-1]
+                closing += 1
+            if part:
+                tokens.append(part)
+            tokens.extend([_RPAREN] * closing)
+            depth -= closing
+    return tokens
+
+
+def count_clauses(tokens):
+    return sum(
+        1 for token in tokens
+        if token not in KEYWORDS and token not in (_LPAREN, _RPAREN)
+    )
+
+
+class _Parser(object):
+
+    def __init__(self, tokens, parseClause):
+        self.tokens = tokens
+        self.pos = 0
+        self.parseClause = parseClause
+
+    def error(self, message):
+        return InvalidSearchExpression(message, position=self.pos)
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            return TRUE
+        node = self.expr(0)
+        if self.peek() is not None:
+            raise self.error('Unexpected `{}`'.format(self.peek()))
+        return TRUE if node is None else node
+
+    @staticmethod
+    def combine(connector, children):
+        # Ignored clauses are None, they are removed from their parent and
+        # a parent left without children is ignored too
+        children = [child for child in children if child is not None]
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else Node(connector, children)
+
+    def expr(self, depth):
+        children = [self.term(depth)]
+        while self.peek() == 'OR':
+            self.next()
+            children.append(self.term(depth))
+        return self.combine('OR', children)
+
+    def term(self, depth):
+        children = [self.factor(depth)]
+        while self.peek() not in (None, 'OR', _RPAREN):
+            if self.peek() == 'AND':
+                self.next()
+            children.append(self.factor(depth))
+        return self.combine('AND', children)
+
+    def factor(self, depth):
+        if depth > MAX_DEPTH:
+            raise self.error('The expression is nested too deep')
+        token = self.next()
+        if token is None:
+            raise self.error('Unexpected end of the expression')
+        if token == 'NOT':
+            child = self.factor(depth + 1)
+            return None if child is None else Node('NOT', (child, ))
+        if token == _LPAREN:
+            node = self.expr(depth + 1)
+            if self.next() != _RPAREN:
+                raise self.error('Missing `)`')
+            return node
+        if token in KEYWORDS or token == _RPAREN:
+            raise self.error('Unexpected `{}`'.format(token))
+        # Invalid clauses and unmapped keys are ignored like in flat queries
+        return self.parseClause(token)
+
+
+def parse_expression(tokens, parseClause):
+    '''
+    Parse the tokens into a tree, raise `InvalidSearchExpression` if the
+    expression is malformed
+    :param  tokens, The tokens from `tokenize_expression`
+    :param  parseClause, Function reading a clause string into a `Clause`,
+            or None to ignore it
+    :return The root `Node` or `Clause`
+    '''
+    return _Parser(tokens, parseClause).parse()
+
+
+def _bounds(clause):
+    if clause.operator is RANGE:
+        lower, upper = clause.value
+        return [
+            Clause(clause.key, OPERATORS['gte'], lower),
+            Clause(clause.key, OPERATORS['lte'], upper),
+        ]
+    return [clause]
+
+
+def _empty_interval(lower, upper):
+    '''
+    Whether no value satisfies both bounds, False if unknown
+    '''
+    if lower.value == upper.value:
+        return lower.operator.name == 'gt' or upper.operator.name == 'lt'
+    return _satisfies(lower.value, upper) is False
+
+
+def _contradicts(clauses):
+    '''
+    Whether the clauses of a single field key can not all match
+    '''
+    equals = set()
+    lists = []
+    excludes = set()
+    lowers = []
+    uppers = []
+    for clause in clauses:
+        name = clause.operator.name
+        if name == 'eq':
+            equals.add(clause.value)
+        elif name == 'in':
+            lists.append(set(clause.value))
+        elif name == 'ni':
+            excludes.update(clause.value)
+        elif name in ('gt', 'gte', 'range'):
+            for bound in _bounds(clause):
+                if bound.operator.name in ('gt', 'gte'):
+                    lowers.append(bound)
+                else:
+                    uppers.append(bound)
+        elif name in ('lt', 'lte'):
+            uppers.append(clause)
+
+    if len(equals) > 1 or equals & excludes:
+        return True
+    for values in lists:
+        if not values or values <= excludes or \
+                any(value not in values for value in equals):
+            return True
+    for bound in lowers + uppers:
+        if any(_satisfies(value, bound) is False for value in equals):
+            return True
+    return any(
+        _empty_interval(lower, upper) for lower in lowers for upper in uppers
+    )
+
+
+def _optimize_and(plan, children, fieldKeys):
+    leaves = [child for child in children if isinstance(child, Clause)]
+    others = [child for child in children if not isinstance(child, Clause)]
+    if plan.canonicalize_query:
+        leaves = canonicalize(plan, leaves)
+
+    byKey = {}
+    for clause in leaves:
+        byKey.setdefault(clause.key, []).append(clause)
+    for key, clauses in byKey.items():
+        if key in fieldKeys and len(plan.lookups[key]['eq']) == 1 and \
+                _contradicts(clauses):
+            return None
+    return leaves + others
+
+
+def _merge_equals(children, fieldKeys):
+    '''
+    Merge the `eq` and `in` clauses on one field key into one `in` clause
+    '''
+    values = {}
+    for child in children:
+        if isinstance(child, Clause) and child.key in fieldKeys and \
+                child.operator.name in ('eq', 'in'):
+            values.setdefault(child.key, []).append(child)
+
+    merged = []
+    for child in children:
+        clauses = values.get(getattr(child, 'key', None)) \
+            if isinstance(child, Clause) else None
+        if not clauses or len(clauses) == 1 or child not in clauses:
+            merged.append(child)
+            continue
+        if child is not clauses[0]:
+            continue
+        items = []
+        for clause in clauses:
+            if clause.operator.name == 'eq':
+                items.append(clause.value)
+            else:
+                items.extend(clause.value)
+        items = _sorted_values(items)
+        if len(items) == 1:
+            merged.append(Clause(child.key, OPERATORS['eq'], items[0]))
+        else:
+            merged.append(Clause(child.key, OPERATORS['in'], items))
+    return merged
+
+
+def _sort_key(node):
+    return (not isinstance(node, Clause), format_expression(node))
+
+
+def optimize(plan, node, fieldKeys=frozenset()):
+    '''
+    Simplify the expression tree
+    :param  plan, The compiled `SearchPlan`
+    :param  node, The root `Node` or `Clause`
+    :param  fieldKeys, The keys mapped to model fields, see
+            `djolar.relations.get_field_keys`
+    :return The optimized tree, `TRUE` or `FALSE` if it is constant
+    '''
+    if isinstance(node, Clause):
+        return node
+
+    if node.connector == 'NOT':
+        child = optimize(plan, node.children[0], fieldKeys)
+        if child == TRUE:
+            return FALSE
+        if child == FALSE:
+            return TRUE
+        if isinstance(child, Node) and child.connector == 'NOT':
+            return child.children[0]
+        return Node('NOT', (child, ))
+
+    # The constant of the connector is dropped, the other one wins
+    identity, absorbing = (TRUE, FALSE) if node.connector == 'AND' \
+        else (FALSE, TRUE)
+    children = []
+    for child in node.children:
+        child = optimize(plan, child, fieldKeys)
+        if child == absorbing:
+            return absorbing
+        if child == identity:
+            continue
+        if isinstance(child, Node) and child.connector == node.connector:
+            children.extend(child.children)
+        else:
+            children.append(child)
+
+    # `x AND NOT x` can not match, `x OR NOT x` always does
+    for child in children:
+        if isinstance(child, Node) and child.connector == 'NOT' and \
+                child.children[0] in children:
+            return absorbing
+
+    if node.connector == 'AND':
+        children = _optimize_and(plan, children, fieldKeys)
+        if children is None:
+            return FALSE
+    else:
+        children = _merge_equals(children, fieldKeys)
+
+    unique = []
+    for child in children:
+        if child not in unique:
+            unique.append(child)
+    if len(unique) == 1:
+        return unique[0]
+    return Node(node.connector, tuple(sorted(unique, key=_sort_key)))
+
+
+def without_key(node, key):
+    '''
+    Drop the clauses on a key with the `NOT` around them, so they do not
+    filter the results either way, an `OR` holding one matches every row.
+    Optimize the result again.
+    :return The tree, `TRUE` if nothing is left
+    '''
+    node = _without_key(node, key)
+    return TRUE if node is None else node
+
+
+def _without_key(node, key):
+    # None stands for a dropped subtree
+    if isinstance(node, Clause):
+        return None if node.key == key else node
+    children = [_without_key(child, key) for child in node.children]
+    if node.connector == 'AND':
+        children = [child for child in children if child is not None]
+        return Node('AND', tuple(children)) if children else None
+    if any(child is None for child in children):
+        return None
+    return Node(node.connector, tuple(children))
+
+
+def get_leaves(node):
+    '''
+    Return the clauses of the tree, in order
+    '''
+    if isinstance(node, Clause):
+        return [node]
+    leaves = []
+    for child in node.children:
+        leaves.extend(get_leaves(child))
+    return leaves
+
+
+def format_expression(node):
+    '''
+    Render the tree as a `q` query param value, `FALSE` renders as `FALSE`
+    '''
+    if isinstance(node, Clause):
+        return format_clauses([node])
+    if node == FALSE:
+        return 'FALSE'
+    if node.connector == 'NOT':
+        child = node.children[0]
+        if isinstance(child, Clause):
+            return 'NOT ' + format_expression(child)
+        return 'NOT ({})'.format(format_expression(child))
+
+    parts = []
+    for child in node.children:
+        text = format_expression(child)
+        if isinstance(child, Node) and child.connector == 'OR' and \
+                node.connector == 'AND':
+            text = '({})'.format(text)
+        parts.append(text)
+    return ' {} '.format(node.connector).join(parts)
+
+
+def compile_expression(node, buildClause):
+    '''
+    Compile the tree into a Q object
+    :param  node, The optimized tree
+    :param  buildClause, Function building the Q object of a `Clause`
+    :return Q object, `Q(pk__in=[])` if the tree is `FALSE`
+    '''
+    if isinstance(node, Clause):
+        return buildClause(node) or Q()
+    if node == FALSE:
+        return Q(pk__in=[])
+    if node.connector == 'NOT':
+        return ~compile_expression(node.children[0], buildClause)
+
+    queryObj = None
+    for child in node.children:
+        childQ = compile_expression(child, buildClause)
+        if queryObj is None:
+            queryObj = childQ
+        elif node.connector == 'AND':
+            queryObj &= childQ
+        else:
+            queryObj |= childQ
+    return Q() if queryObj is None else queryObj
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar full text search
+
+The `fts` operator is a custom lookup registered on `CharField` and
+`TextField`. The searcher declares which keys support it in
+`fulltext_search`, and how each database matches it:
+
+* PostgreSQL: `to_tsvector(config, field) @@ plainto_tsquery(config, terms)`,
+  which uses a GIN index on the `to_tsvector(config, field)` expression
+* SQLite: the rowid of an FTS5 shadow table (external content table) of
+  the model, one column per indexed field
+* other databases, or SQLite without a shadow table: every term is
+  matched with `icontains`
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+import re
+
+from django.db.models import CharField, FloatField, Func, Lookup, TextField
+from django.db.models.expressions import Col
+from django.db.models.lookups import IContains
+
+
+_CONFIG_RE = re.compile(r'^\w+$')
+
+
+class FullText(namedtuple('FullText', ['config', 'sqlite_table'])):
+    '''
+    Full text search declaration of a query key
+    :param  config, The PostgreSQL text search configuration
+    :param  sqlite_table, The SQLite FTS5 table indexing the fields
+    '''
+    __slots__ = ()
+
+    def __new__(cls, config='simple', sqlite_table=None):
+        assert _CONFIG_RE.match(config), \
+            'config should be a text search configuration name'
+        return super(FullText, cls).__new__(cls, config, sqlite_table)
+
+
+class FullTextQuery(namedtuple('FullTextQuery', ['terms', 'fulltext'])):
+    '''
+    The value of a `fts` clause, the search terms and the declaration of
+    the key. Every term must match.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, value, fulltext):
+        '''
+        Split a clause value on commas into terms
+        :param  value, The clause value, eg. `python,programming`
+        :param  fulltext, The `FullText` declaration of the key
+        :return FullTextQuery, without terms if the value has none
+        '''
+        terms = tuple(
+            term for term in (i.strip() for i in value.split(',')) if term
+        )
+        return cls(terms, fulltext)
+
+    def __str__(self):
+        return ','.join(self.terms)
+
+    def get_match_expression(self, column):
+        '''
+        Build the FTS5 MATCH expression on a column, terms are quoted as
+        strings so they are never read as FTS5 syntax
+        '''
+        return '{} : ({})'.format(column, ' AND '.join(
+            '"{}"'.format(term.replace('"', '""')) for term in self.terms
+        ))
+
+
+def _get_query(value):
+    if isinstance(value, FullTextQuery):
+        return value
+    return FullTextQuery.parse(str(value), FullText())
+
+
+def _get_sqlite_source(lhs, query):
+    '''
+    Return the (table alias, pk column, field column) of the column matched
+    in the FTS5 table, or None if the FTS5 table can not be used
+    '''
+    if query.fulltext.sqlite_table is None or not isinstance(lhs, Col):
+        return None
+    return lhs.alias, lhs.target.model._meta.pk.column, lhs.target.column
+
+
+class FullTextLookup(Lookup):
+    '''
+    `field__fts=FullTextQuery(...)`, a plain string is searched with the
+    `simple` configuration and no FTS5 table
+    '''
+    lookup_name = 'fts'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        sqls = []
+        params = []
+        for term in _get_query(self.rhs).terms:
+            sql, termParams = compiler.compile(IContains(self.lhs, term))
+            sqls.append(sql)
+            params.extend(termParams)
+        if not sqls:
+            return '1 = 0', []
+        return '({})'.format(' AND '.join(sqls)), params
+
+    def as_postgresql(self, compiler, connection):
+        query = _get_query(self.rhs)
+        lhs, params = self.process_lhs(compiler, connection)
+        return (
+            "to_tsvector('{0}', {1}) @@ plainto_tsquery('{0}', %s)".format(
+                query.fulltext.config, lhs
+            ),
+            list(params) + [' '.join(query.terms)]
+        )
+
+    def as_sqlite(self, compiler, connection):
+        query = _get_query(self.rhs)
+        source = _get_sqlite_source(self.lhs, query)
+        if source is None:
+            return self.as_sql(compiler, connection)
+
+        alias, pkColumn, column = source
+        qn = compiler.quote_name_unless_alias
+        table = qn(query.fulltext.sqlite_table)
+        return (
+            '{}.{} IN (SELECT rowid FROM {} WHERE {} MATCH %s)'.format(
+                qn(alias), qn(pkColumn), table, table
+            ),
+            [query.get_match_expression(column)]
+        )
+
+
+CharField.register_lookup(FullTextLookup)
+TextField.register_lookup(FullTextLookup)
+
+
+class FullTextRank(Func):
+    '''
+    Relevance of a field for a `FullTextQuery`, higher is better. Databases
+    without a full text index rank every row 0.
+    '''
+    output_field = FloatField()
+
+    def __init__(self, expression, query, **extra):
+        super(FullTextRank, self).__init__(expression, **extra)
+        self.query = query
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return '0', []
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return (
+            "ts_rank(to_tsvector('{0}', {1}), "
+            "plainto_tsquery('{0}', %s))".format(
+                self.query.fulltext.config, lhs
+            ),
+            list(params) + [' '.join(self.query.terms)]
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        source = _get_sqlite_source(self.source_expressions[0], self.query)
+        if source is None:
+            return self.as_sql(compiler, connection)
+
+        alias, pkColumn, column = source
+        qn = compiler.quote_name_unless_alias
+        table = qn(self.query.fulltext.sqlite_table)
+        # bm25() is lower for better matches, rows not matched rank 0
+        return (
+            'COALESCE((SELECT -bm25({0}) FROM {0} WHERE {0} MATCH %s '
+            'AND {0}.rowid = {1}.{2}), 0)'.format(
+                table, qn(alias), qn(pkColumn)
+            ),
+            [self.query.get_match_expression(column)]
+        )
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar query cost guard
+"""
+from __future__ import unicode_literals
+
+import json
+
+from django.db import connections
+
+from .exceptions import SearchRejected
+
+
+def check_clause_count(plan, count):
+    '''
+    Reject queries with more clauses than `max_clauses`
+    :param  plan, The compiled `SearchPlan`
+    :param  count, The number of clauses in the query
+    '''
+    if plan.max_clauses is not None and count > plan.max_clauses:
+        raise SearchRejected(
+            'Too many search clauses',
+            reason='max_clauses', limit=plan.max_clauses, value=count
+        )
+
+
+def check_clause(plan, key, operator, value):
+    '''
+    Reject clauses over the static limits of the searcher
+    :param  plan, The compiled `SearchPlan`
+    :param  key, The query key
+    :param  operator, The clause `Operator`
+    :param  value, The clause value
+    '''
+    if operator.is_list:
+        if plan.max_in_values is not None and \
+                len(value) > plan.max_in_values:
+            raise SearchRejected(
+                'Too many values in the search list',
+                reason='max_in_values', key=key,
+                limit=plan.max_in_values, value=len(value)
+            )
+    elif operator.name == 'co':
+        if plan.min_contains_length is not None and \
+                len(value) < plan.min_contains_length:
+            raise SearchRejected(
+                'Search term is too short',
+                reason='min_contains_length', key=key,
+                limit=plan.min_contains_length, value=len(value)
+            )
+
+
+def parse_postgresql_explain(output):
+    '''
+    Read the planner estimates from a PostgreSQL `EXPLAIN (FORMAT JSON)`
+    :param  output, The explain output
+    :return (total cost, rows) tuple
+    '''
+    plan = json.loads(output)[0]['Plan']
+    return plan['Total Cost'], plan['Plan Rows']
+
+
+def estimate_query_cost(queryset):
+    '''
+    Ask the database planner for the estimated cost of the queryset
+    :param  queryset, The queryset to estimate
+    :return (total cost, rows) tuple, or None if the database can not tell
+    '''
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    return parse_postgresql_explain(queryset.explain(format='json'))
+
+
+async def aestimate_query_cost(queryset):
+    '''
+    Async version of `estimate_query_cost`
+    '''
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    return parse_postgresql_explain(await queryset.aexplain(format='json'))
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar large `in` lists
+
+`in`/`ni` clauses with more values than the searcher
+`large_list_threshold` use the `large_in` lookup instead of `in`. The
+values are deduplicated and sorted, and sent as a single parameter where
+the database can read a list from one:
+
+* PostgreSQL: `field = ANY(%s::type[])`
+* SQLite with JSON1: `field IN (SELECT value FROM json_each(%s))`
+* other databases: `IN` lists of `CHUNK_SIZE` values OR-ed together
+"""
+from __future__ import unicode_literals
+
+import json
+
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Field, ForeignObject, Lookup
+
+from .tokenizer import Operator
+
+
+# Internal operator of the lists over `large_list_threshold`, negated by
+# the parser for `ni` clauses
+LARGE_IN = Operator('large_in', '{}__large_in', '{}__large_in', True, False)
+
+CHUNK_SIZE = 1000
+
+
+def unique_sorted(values):
+    '''
+    Deduplicate and sort the values, values that can not be ordered keep
+    their first position
+    '''
+    try:
+        return sorted(set(values))
+    except TypeError:
+        seen = set()
+        return [i for i in values if not (i in seen or seen.add(i))]
+
+
+class LargeInLookup(Lookup):
+    '''
+    `field__large_in=[...]`, the same rows as `field__in=[...]`
+    '''
+    lookup_name = 'large_in'
+    prepare_rhs = False
+
+    def get_db_values(self, connection):
+        field = self.lhs.output_field
+        values = unique_sorted(
+            field.get_db_prep_value(value, connection, prepared=False)
+            for value in self.rhs
+        )
+        if not values:
+            raise EmptyResultSet
+        return values
+
+    def as_sql(self, compiler, connection):
+        lhs, lhsParams = self.process_lhs(compiler, connection)
+        values = self.get_db_values(connection)
+        sqls = []
+        params = []
+        for start in range(0, len(values), CHUNK_SIZE):
+            chunk = values[start:start + CHUNK_SIZE]
+            sqls.append('{} IN ({})'.format(
+                lhs, ', '.join(['%s'] * len(chunk))
+            ))
+            params.extend(lhsParams)
+            params.extend(chunk)
+        if len(sqls) == 1:
+            return sqls[0], params
+        return '({})'.format(' OR '.join(sqls)), params
+
+    def as_postgresql(self, compiler, connection):
+        dbType = self.lhs.output_field.db_type(connection)
+        if dbType is None:
+            return self.as_sql(compiler, connection)
+        lhs, lhsParams = self.process_lhs(compiler, connection)
+        return (
+            '{} = ANY(%s::{}[])'.format(lhs, dbType),
+            list(lhsParams) + [self.get_db_values(connection)]
+        )
+
+    def as_sqlite(self, compiler, connection):
+        if not connection.features.supports_json_field:
+            return self.as_sql(compiler, connection)
+        values = self.get_db_values(connection)
+        try:
+            values = json.dumps(values)
+        except TypeError:
+            # eg. Decimal values
+            return self.as_sql(compiler, connection)
+        lhs, lhsParams = self.process_lhs(compiler, connection)
+        return (
+            '{} IN (SELECT value FROM json_each(%s))'.format(lhs),
+            list(lhsParams) + [values]
+        )
+
+
+Field.register_lookup(LargeInLookup)
+# Related fields only look up their own class lookups
+ForeignObject.register_lookup(LargeInLookup)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar search instrumentation
+
+A view with `search_collectors` measures each search into a `SearchStats`
+and hands it to every collector once the results are fetched. Without
+collectors nothing is measured.
+"""
+from __future__ import unicode_literals
+
+from collections import Counter
+from contextlib import contextmanager
+
+import logging
+import time
+
+from django.dispatch import Signal
+
+from .canonical import format_clauses
+
+
+# Sent by `SignalCollector` with the `stats` keyword argument, the sender is
+# the view class
+search_completed = Signal()
+
+
+class SearchStats(object):
+    '''
+    Measures of a single search: `timings` in seconds (`parse`, `order`,
+    `build`, `sql`, `fetch` and any name measured by the view), the clause
+    count, the operator histogram, the normalized query, the SQL run and
+    the number of rows fetched
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.timings = {}
+        self.query = ''
+        self.order_by = ()
+        self.clause_count = 0
+        self.operators = {}
+        self.queries = []
+        self.rows = None
+
+    @contextmanager
+    def measure(self, name):
+        '''
+        Add the time spent in the block to `timings[name]`
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + \
+                time.perf_counter() - start
+
+    def set_clauses(self, clauses):
+        self.clause_count = len(clauses)
+        self.operators = dict(Counter(
+            clause.operator.name for clause in clauses
+        ))
+        self.query = format_clauses(clauses)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        '''
+        Database execute wrapper timing the SQL of the search
+        '''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.timings['sql'] = self.timings.get('sql', 0.0) + duration
+            self.queries.append({
+                'sql': sql, 'params': params, 'time': duration,
+            })
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'duration': self.duration,
+            'timings': dict(self.timings),
+            'query': self.query,
+            'order_by': list(self.order_by),
+            'clause_count': self.clause_count,
+            'operators': dict(self.operators),
+            'sql_count': len(self.queries),
+            'rows': self.rows,
+        }
+
+
+class SearchCollector(object):
+    '''
+    Base class of the collectors, `record` gets the `SearchStats` of every
+    completed search
+    '''
+    def record(self, stats):
+        raise NotImplementedError
+
+
+class SignalCollector(SearchCollector):
+    '''
+    Send the `search_completed` signal
+    '''
+    def __init__(self, sender=None):
+        self.sender = sender
+
+    def record(self, stats):
+        search_completed.send(sender=self.sender, stats=stats)
+
+
+class SlowSearchLog(SearchCollector):
+    '''
+    Log the searches slower than `threshold` seconds with their SQL
+    :param  threshold, The duration of a slow search in seconds
+    :param  logger, The logger name
+    :param  level, The log level
+    '''
+    def __init__(self, threshold=1.0, logger='djolar.search',
+                 level=logging.WARNING):
+        self.threshold = threshold
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def record(self, stats):
+        if stats.duration is None or stats.duration < self.threshold:
+            return
+        self.logger.log(
+            self.level,
+            'Slow search %s: %.3fs q=%s timings=%s rows=%s\n%s',
+            stats.name, stats.duration, stats.query,
+            ', '.join(
+                '{}={:.3f}s'.format(name, seconds)
+                for name, seconds in sorted(stats.timings.items())
+            ),
+            stats.rows,
+            '\n'.join(
+                '{:.3f}s {} {!r}'.format(query['time'], query['sql'],
+                                         query['params'])
+                for query in stats.queries
+            ),
+            extra={'search_stats': stats.as_dict()}
+        )
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar in-memory search
+
+Small reference tables can be searched in process instead of the database.
+`MemorySearch` loads the fields a searcher reads into a columnar NumPy
+snapshot and evaluates the `Q` object of each search as boolean masks, one
+vectorized comparison by lookup, then sorts the matching rows with
+`lexsort`. It takes the `q`/`s` syntax of the searcher, boolean
+expressions included, and gives the rows the ORM would:
+
+* NULL never matches a lookup, and matches its negation like the `NOT`
+  Django builds for nullable fields
+* on SQLite `contains` ignores the case like `LIKE`, and only for ASCII
+  letters, like `icontains`
+* strings are ordered by code point, like SQLite and the `C` collation,
+  NULL is the smallest value
+
+NumPy is an optional dependency, `pip install djolar[numpy]`.
+"""
+from __future__ import unicode_literals
+
+import copy
+import datetime
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .relations import resolve_path
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+# Lookups evaluated in memory
+LOOKUPS = frozenset([
+    'exact', 'iexact', 'contains', 'icontains', 'in', 'large_in', 'gt',
+    'gte', 'lt', 'lte', 'range', 'isnull',
+])
+
+_ASCII_LOWER = dict(
+    (code, code + 32) for code in range(ord('A'), ord('Z') + 1)
+)
+
+
+def _to_datetime64(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, 'us')
+
+
+class Column(object):
+    '''
+    The values of a field path, as a NumPy array of the narrowest kind
+    with a mask of the non NULL rows
+    :param  values, The values, None for NULL
+    :param  asciiCase, Fold only the ASCII letters when ignoring case
+    '''
+    def __init__(self, values, asciiCase=False):
+        self.asciiCase = asciiCase
+        self.notnull = np.array([value is not None for value in values], bool)
+        sample = next((value for value in values if value is not None), None)
+
+        self.kind = 'object'
+        if isinstance(sample, bool):
+            self.kind = 'bool'
+            data = np.array([bool(value) for value in values], bool)
+        elif isinstance(sample, int):
+            try:
+                data = np.array(
+                    [0 if value is None else value for value in values],
+                    np.int64
+                )
+                self.kind = 'int'
+            except OverflowError:
+                data = None
+        elif isinstance(sample, float):
+            self.kind = 'float'
+            data = np.array(
+                [np.nan if value is None else value for value in values],
+                np.float64
+            )
+        elif isinstance(sample, str):
+            self.kind = 'str'
+            data = np.array(
+                [value or '' for value in values], np.str_
+            ) if values else np.array([], np.str_)
+        elif isinstance(sample, datetime.datetime):
+            self.kind = 'datetime'
+            data = np.array([
+                np.datetime64('NaT') if value is None
+                else _to_datetime64(value) for value in values
+            ], 'datetime64[us]')
+        elif isinstance(sample, datetime.date):
+            self.kind = 'date'
+            data = np.array([
+                np.datetime64('NaT') if value is None
+                else np.datetime64(value, 'D') for value in values
+            ], 'datetime64[D]')
+        if self.kind == 'object':
+            data = np.empty(len(values), object)
+            data[:] = values
+        self.data = data
+        self._folded = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def take(self, indices):
+        '''
+        Return the column of a subset of the rows
+        '''
+        column = copy.copy(self)
+        column.data = self.data[indices]
+        column.notnull = self.notnull[indices]
+        if self._folded is not None:
+            column._folded = self._folded[indices]
+        return column
+
+    @property
+    def folded(self):
+        '''
+        The strings with the case folded, computed once
+        '''
+        if self._folded is None:
+            self._folded = self.fold(self.data)
+        return self._folded
+
+    def fold(self, value):
+        if self.asciiCase:
+            return np.char.translate(value, _ASCII_LOWER) \
+                if isinstance(value, np.ndarray) \
+                else value.translate(_ASCII_LOWER)
+        return np.char.lower(value) if isinstance(value, np.ndarray) \
+            else value.lower()
+
+    def convert(self, value):
+        '''
+        Convert a lookup value to the kind of the column
+        '''
+        if self.kind == 'datetime' and isinstance(value, datetime.datetime):
+            return _to_datetime64(value)
+        if self.kind == 'date' and isinstance(value, datetime.date) and \
+                not isinstance(value, datetime.datetime):
+            return np.datetime64(value, 'D')
+        return value
+
+    def compare(self, op, value):
+        '''
+        Compare the non NULL values with a lookup value
+        :param  op, Function of the array and the value returning a mask
+        :return Boolean mask
+        '''
+        if self.kind != 'object':
+            return op(self.data, self.convert(value)) & self.notnull
+        mask = np.zeros(len(self.data), bool)
+        mask[self.notnull] = np.asarray(
+            op(self.data[self.notnull], value), bool
+        )
+        return mask
+
+    def isin(self, values):
+        values = [self.convert(value) for value in values]
+        if not values:
+            return np.zeros(len(self.data), bool)
+        if self.kind != 'object':
+            return np.isin(self.data, values) & self.notnull
+        members = set(values)
+        return np.fromiter(
+            (value in members for value in self.data), bool, len(self.data)
+        ) & self.notnull
+
+    def contains(self, value, ignoreCase):
+        if self.kind != 'str':
+            raise ValueError('contains lookups need a string field')
+        if ignoreCase:
+            found = np.char.find(self.folded, self.fold(value))
+        else:
+            found = np.char.find(self.data, value)
+        return (found >= 0) & self.notnull
+
+    def get_sort_keys(self, descending):
+        '''
+        Get the `lexsort` keys ordering the column, least significant first
+        '''
+        if self.kind in ('int', 'float', 'bool'):
+            values = self.data.astype(np.float64) \
+                if self.kind != 'int' else self.data
+        elif self.kind in ('datetime', 'date'):
+            values = self.data.view(np.int64)
+        else:
+            # Rank of each value among the sorted distinct values
+            data = self.data
+            if self.kind == 'object':
+                # NULL takes any value, the NULL key orders it
+                data = data.copy()
+                data[~self.notnull] = data[self.notnull][0] \
+                    if self.notnull.any() else 0
+            values = np.unique(data, return_inverse=True)[1].reshape(-1)
+        if descending:
+            values = -values
+        # NULL sorts first, last when descending
+        nulls = ~self.notnull if descending else self.notnull
+        return [values, nulls]
+
+
+_COMPARISONS = {
+    'exact': lambda data, value: data == value,
+    'gt': lambda data, value: data > value,
+    'gte': lambda data, value: data >= value,
+    'lt': lambda data, value: data < value,
+    'lte': lambda data, value: data <= value,
+}
+
+
+class _Snapshot(object):
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.columns = columns
+        self.size = len(rows)
+
+
+class MemorySearch(object):
+    '''
+    Evaluate the searches of a searcher class against an in-memory snapshot
+    :param  searcher_class, The `DjangoSearchParser` class
+    :param  source, The queryset to load, or a function returning the rows,
+            dicts keyed by field path with a `pk` key
+    :param  model, The model of the rows, the queryset model by default
+    :param  fields, Other field paths to load, eg. to display
+    :param  vendor, The database vendor the results follow, the one of the
+            queryset by default
+    '''
+    def __init__(self, searcher_class, source, model=None, fields=(),
+                 vendor=None):
+        if np is None:
+            raise ImproperlyConfigured(
+                'MemorySearch requires NumPy, pip install djolar[numpy]'
+            )
+        self.searcher_class = searcher_class
+        self.source = source
+        self.model = model if model is not None else source.model
+        if vendor is None:
+            vendor = getattr(source, 'db', None) and \
+                connections[source.db].vendor
+        self.vendor = vendor
+        self._lookups = {}
+        self._snapshot = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+        plan = searcher_class().get_search_plan()
+        paths = ['pk'] + list(fields)
+        lookups = list(plan.field_paths) + list(plan.force_search) + \
+            list(plan.default_search or ()) + [
+                path.lstrip('-') for path in plan.default_order_by
+            ]
+        for lookup in lookups:
+            path = self._split_lookup(lookup)[0]
+            if path not in paths:
+                paths.append(path)
+        self.fields = tuple(paths)
+
+    def _split_lookup(self, lookup):
+        '''
+        Split a lookup string into its field path and lookup name
+        '''
+        result = self._lookups.get(lookup)
+        if result is None:
+            parts = lookup.split('__')
+            fields, lookups = resolve_path(self.model, lookup)
+            if not fields or len(lookups) > 1 or \
+                    (lookups and lookups[0] not in LOOKUPS):
+                raise ValueError(
+                    'lookup {} is not supported in memory'.format(lookup)
+                )
+            path = '__'.join(parts[:len(fields)])
+            result = (path, lookups[0] if lookups else 'exact')
+            self._lookups[lookup] = result
+        return result
+
+    def load_rows(self):
+        '''
+        Load the rows of the snapshot
+        '''
+        if callable(self.source):
+            return list(self.source())
+        return list(self.source.values(*self.fields))
+
+    def refresh(self):
+        '''
+        Reload the snapshot now
+        '''
+        rows = self.load_rows()
+        asciiCase = self.vendor == 'sqlite'
+        columns = dict(
+            (path, Column([row[path] for row in rows], asciiCase))
+            for path in self.fields
+        )
+        if len(np.unique(columns['pk'].data)) != len(rows):
+            raise ImproperlyConfigured(
+                'MemorySearch rows should have distinct primary keys'
+            )
+        with self._lock:
+            self._snapshot = _Snapshot(rows, columns)
+            self._stale = False
+
+    def _on_change(self, sender, **kwargs):
+        if kwargs.get('action', 'post_').startswith('post_'):
+            self._stale = True
+
+    def watch(self, models=None):
+        '''
+        Reload the snapshot on the next search after a `post_save`,
+        `post_delete` or `m2m_changed` signal of the models. The receivers
+        are weak, they are disconnected when the search is garbage collected.
+        :param  models, Iterable of model classes, the model by default
+        '''
+        for model in models or (self.model, ):
+            for signal in (post_save, post_delete, m2m_changed):
+                signal.connect(self._on_change, sender=model)
+
+    def get_snapshot(self):
+        '''
+        Return the snapshot, loaded first if it is stale
+        '''
+        if self._stale:
+            self.refresh()
+        return self._snapshot
+
+    def get_searcher(self):
+        searcher = self.searcher_class()
+        searcher.model = self.model
+        return searcher
+
+    def _get_column(self, snapshot, path):
+        try:
+            return snapshot.columns[path]
+        except KeyError:
+            raise ValueError('field {} is not loaded in memory'.format(path))
+
+    def _eval_lookup(self, snapshot, lookup, value):
+        path, name = self._split_lookup(lookup)
+        column = self._get_column(snapshot, path)
+        if name in _COMPARISONS:
+            return column.compare(_COMPARISONS[name], value)
+        if name in ('in', 'large_in'):
+            return column.isin(value)
+        if name == 'range':
+            lower, upper = value
+            return column.compare(_COMPARISONS['gte'], lower) & \
+                column.compare(_COMPARISONS['lte'], upper)
+        if name == 'isnull':
+            return ~column.notnull if value else column.notnull.copy()
+        if name == 'iexact':
+            return (column.folded == column.fold(value)) & column.notnull
+        return column.contains(
+            value, name == 'icontains' or self.vendor == 'sqlite'
+        )
+
+    def get_mask(self, snapshot, queryObj):
+        '''
+        Evaluate a Q object
+        :return Boolean mask of the matching rows
+        '''
+        mask = None
+        for child in queryObj.children:
+            if isinstance(child, Q):
+                childMask = self.get_mask(snapshot, child)
+            else:
+                childMask = self._eval_lookup(snapshot, *child)
+            if mask is None:
+                mask = childMask
+            elif queryObj.connector == Q.OR:
+                mask = mask | childMask
+            else:
+                mask = mask & childMask
+        if mask is None:
+            mask = np.ones(snapshot.size, bool)
+        return ~mask if queryObj.negated else mask
+
+    def get_indices(self, requestParams):
+        '''
+        Get the ordered indices of the rows matching a search
+        :param  requestParams, The query dict get from request
+        :return NumPy array of row indices
+        '''
+        return self._get_indices(self.get_snapshot(), requestParams)
+
+    def _get_indices(self, snapshot, requestParams):
+        searcher = self.get_searcher()
+        mask = self.get_mask(
+            snapshot, searcher.get_query_fields(requestParams)
+        )
+        indices = np.flatnonzero(mask)
+
+        orderBy = searcher.get_order_fields(requestParams)
+        if 'pk' not in orderBy and '-pk' not in orderBy:
+            # The primary key breaks the ties
+            orderBy = list(orderBy) + ['pk']
+        keys = []
+        for field in reversed(orderBy):
+            descending = field.startswith('-')
+            path = self._split_lookup(field.lstrip('-'))[0]
+            column = self._get_column(snapshot, path).take(indices)
+            keys.extend(column.get_sort_keys(descending))
+        return indices[np.lexsort(keys)] if len(indices) else indices
+
+    def search(self, requestParams, offset=0, limit=None):
+        '''
+        Search the snapshot
+        :param  requestParams, The query dict get from request
+        :param  offset, The index of the first row returned
+        :param  limit, The maximum number of rows returned
+        :return (count, rows) tuple, rows are the loaded dicts
+        '''
+        snapshot = self.get_snapshot()
+        indices = self._get_indices(snapshot, requestParams)
+        end = None if limit is None else offset + limit
+        return len(indices), [
+            snapshot.rows[idx] for idx in indices[offset:end]
+        ]
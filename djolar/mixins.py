@@ -2,6 +2,37 @@
 """
 Djolar searcher mixins
 """
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.db import connections, router
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+
+from .counting import ExactCount, HasNextCount, SearchCount
+from .exceptions import SearchRejected, SearchTimeout
+from .export import EXPORT_FORMATS, get_export_fields
+from .expression import is_expression
+from .guard import aestimate_query_cost, estimate_query_cost
+from .instrumentation import SearchStats
+from .pagination import (
+    decode_cursor,
+    encode_cursor,
+    get_cursor_ordering,
+    get_ordering_values,
+    get_seek_q,
+)
+from .relations import (
+    get_related_models,
+    infer_related_lookups,
+    is_field_path,
+)
+from .results import get_row_pk
+from .routing import ashould_read_primary, should_read_primary
+from .sharding import merge_pages, search_shards
+from .templates import get_base_state
+from .timeouts import SearchDeadline, statement_timeout
 
 
 class DjangoSearchMixin(object):
@@ -10,6 +41,70 @@ class DjangoSearchMixin(object):
     '''
     searcher_class = None
 
+    # Keyset pagination, the page after the row encoded in the cursor query
+    # param is selected by a seek predicate instead of an OFFSET
+    cursor_pagination = False
+    cursor_query_param = 'cursor'
+    cursor_page_size = 20
+
+    # Streaming export, the query keys to export (by default every key mapped
+    # to a single valued field) and the number of rows fetched at a time
+    export_fields = None
+    export_chunk_size = 2000
+
+    # Admission control on the planner estimates (PostgreSQL), queries over
+    # the limits are rejected or, with `query_cost_action = 'downgrade'`,
+    # capped to the first `max_query_rows` rows
+    max_query_cost = None
+    max_query_rows = None
+    query_cost_action = 'reject'
+
+    # Name of the relevance annotation of full text searches, the results
+    # are ordered by it unless the client sends an order
+    fulltext_rank_field = 'search_rank'
+
+    # Cache the primary keys and count of result pages, a
+    # `djolar.results.ResultCache` shared by the view class
+    result_cache = None
+
+    # Instrumentation, the `djolar.instrumentation` collectors getting the
+    # `SearchStats` of every search. Stats are recorded once the results are
+    # fetched by `get_search_results` or `get_cursor_page`, unless
+    # `record_search_on_fetch` is false and the view calls `record_search`.
+    search_collectors = ()
+    record_search_on_fetch = True
+
+    # Facets, the query keys to count the search results by and the maximum
+    # number of values counted for each key
+    facet_keys = ()
+    facet_size = None
+
+    # How the fields selected by the `f` query param are fetched: `only`
+    # defers the other fields of the model instances, `values` returns dicts
+    # keyed by field path, with `pk` and the ordering fields
+    projection_mode = 'only'
+
+    # Read replicas of the search, count and facet queries, a
+    # `djolar.routing` selector shared by the view class, eg.
+    # `RoundRobinReplicas(['replica1', 'replica2'])`. Requests marked with
+    # `djolar.routing.mark_read_primary` read from the primary.
+    search_replicas = None
+
+    # Reuse the queryset and compiled SQL of searches of the same shape, a
+    # `djolar.templates.SQLTemplateCache` shared by the view class
+    sql_templates = None
+
+    # Sharded search, the database aliases holding the shards of the
+    # searched table and the number of threads searching them, one by
+    # shard by default. See `get_sharded_results`.
+    search_shards = None
+    search_shard_workers = None
+
+    # Evaluate searches adding clauses to a recent small result on its
+    # primary keys, a `djolar.refinement.RefinementCache` shared by the
+    # view class
+    refinement_cache = None
+
     def get_searcher_class(self):
         """
         Return the class to use for the search.
@@ -43,15 +138,712 @@ class DjangoSearchMixin(object):
         return self.queryset
 
     def get_queryset(self, *args, **kwargs):
+        return self.check_query_cost(self.build_search_queryset())
+
+    def get_search_stats(self):
+        '''
+        Return the `SearchStats` of the search, or None if the view has no
+        `search_collectors`
+        '''
+        if not self.search_collectors:
+            return None
+        stats = self.__dict__.get('_search_stats')
+        if stats is None:
+            stats = self._search_stats = SearchStats(type(self).__name__)
+        return stats
+
+    def record_search(self):
+        '''
+        Hand the stats of the search to the collectors, once
+        '''
+        stats = self.__dict__.get('_search_stats')
+        if stats is None or stats.duration is not None:
+            return
+        stats.finish()
+        for collector in self.search_collectors:
+            collector.record(stats)
+
+    def get_search_database(self, model):
+        '''
+        Return the database alias of the search queries, one for the whole
+        request, or None to leave the queryset database as is
+        :param  model, The model class being searched
+        '''
+        if self.search_replicas is None:
+            return None
+        alias = self.__dict__.get('_search_database')
+        if alias is None:
+            alias = self._select_search_database(
+                model, should_read_primary(self.request)
+            )
+        return alias
+
+    def _select_search_database(self, model, readPrimary):
+        if readPrimary:
+            alias = router.db_for_write(model)
+        else:
+            alias = self.search_replicas.select()
+        self._search_database = alias
+        return alias
+
+    def _use_search_database(self, queryset):
+        alias = self.get_search_database(queryset.model)
+        if alias is None:
+            return queryset
+        return queryset.using(alias)
+
+    def _track_database(self, alias):
+        if self.search_replicas is None:
+            return nullcontext()
+        return self.search_replicas.track(alias)
+
+    @contextmanager
+    def _measure_fetch(self, queryset, sql=True):
+        with self._track_database(queryset.db), \
+                self._measure_stats(queryset, sql) as stats:
+            yield stats
+
+    @contextmanager
+    def _measure_stats(self, queryset, sql):
+        stats = self.get_search_stats()
+        if stats is None or stats.duration is not None:
+            # Disabled, or already recorded
+            yield None
+        elif sql:
+            connection = connections[queryset.db]
+            with stats.measure('fetch'), \
+                    connection.execute_wrapper(stats.execute_wrapper):
+                yield stats
+        else:
+            with stats.measure('fetch'):
+                yield stats
+
+    def _record_rows(self, stats, rows):
+        if stats is None:
+            return
+        stats.rows = len(rows)
+        if self.record_search_on_fetch:
+            self.record_search()
+
+    def get_search_deadline(self):
+        '''
+        Return the `SearchDeadline` of the search, started on the first
+        call, or None if the searcher has no `search_timeout`
+        '''
+        seconds = self.get_searcher_class().search_timeout
+        if seconds is None:
+            return None
+        deadline = self.__dict__.get('_search_deadline')
+        if deadline is None:
+            deadline = self._search_deadline = SearchDeadline(seconds)
+        return deadline
+
+    def _limit_time(self, queryset, phase, seconds=None):
+        '''
+        Bound the queries of the block by the time left to the search, or
+        by `seconds` if lower
+        '''
+        deadline = self.get_search_deadline()
+        if deadline is not None:
+            deadline.check(phase)
+            remaining = deadline.remaining()
+            seconds = remaining if seconds is None else min(seconds, remaining)
+        if seconds is None:
+            return nullcontext()
+        return statement_timeout(queryset.db, seconds, phase)
+
+    def _has_time_limit(self):
+        searcherClass = self.get_searcher_class()
+        return searcherClass.search_timeout is not None or \
+            searcherClass.count_timeout is not None
+
+    def build_search_queryset(self):
+        '''
+        Build the search queryset from the request, without touching the
+        database
+        '''
+        deadline = self.get_search_deadline()
+        stats = self.get_search_stats()
+        if stats is None:
+            queryset = self._build_search_queryset(None)
+        else:
+            with stats.measure('build'):
+                queryset = self._build_search_queryset(stats)
+        if deadline is not None:
+            deadline.check('parse')
+        return queryset
+
+    def _build_search_queryset(self, stats):
         searcher = self.get_searcher()
+        if stats is not None:
+            searcher.search_stats = stats
+        queryset = self._use_search_database(self.get_search_queryset())
+        if searcher.model is None:
+            searcher.model = queryset.model
 
         # Build search field
-        queryQ = searcher.get_query_fields(self.request.GET)
+        queryQ, clauses = searcher.get_search_query(self.request.GET)
+
+        # The key of the base queryset, shared by the caches
+        state = None
+        if self.sql_templates is not None or \
+                self.refinement_cache is not None:
+            state = get_base_state(queryset)
+
+        refined = self._refine_search(searcher, clauses, state)
+        if refined is not None:
+            queryQ = refined
 
         # Get order by field
         orderBy = searcher.get_order_fields(self.request.GET)
 
+        rank = None
+        if not self.request.GET.get('s'):
+            rank = searcher.get_fulltext_rank(clauses)
+            if rank is not None:
+                # Annotate before filtering, cursors seek on the rank
+                queryset = queryset.annotate(
+                    **{self.fulltext_rank_field: rank}
+                )
+                orderBy = ['-{}'.format(self.fulltext_rank_field)] + orderBy
+
+        if self.cursor_pagination:
+            orderBy = get_cursor_ordering(orderBy)
+            cursor = self.request.GET.get(self.cursor_query_param)
+            if cursor:
+                queryQ &= get_seek_q(
+                    orderBy, decode_cursor(cursor, orderBy),
+                    connections[queryset.db].features.nulls_order_largest
+                )
+
+        paths = searcher.get_projection_fields(self.request.GET)
+        build = partial(
+            self._filter_search_queryset, searcher, queryset, queryQ, orderBy,
+            paths
+        )
+        if self.sql_templates is None or rank is not None or \
+                refined is not None:
+            return build()
+
+        key = (
+            type(searcher), tuple(orderBy),
+            None if paths is None else tuple(paths), self.projection_mode
+        )
+        return self.sql_templates.get_queryset(
+            queryset, queryQ, key, build, state
+        )
+
+    def _refine_search(self, searcher, clauses, state):
+        '''
+        Return the Q object evaluating the search on the primary keys of a
+        cached result it refines, or None
+        :param  searcher, The searcher
+        :param  clauses, The clauses from `get_search_query`
+        :param  state, The `get_base_state` of the base queryset
+        '''
+        keys = self.request.GET.get('q')
+        if self.refinement_cache is None or not keys or state is None or \
+                is_expression(keys):
+            return None
+
+        # Results of other view filters or databases are not reused
+        scope = (type(searcher), state)
+        self._search_refinement = (scope, clauses)
+
+        refinement = self.refinement_cache.get(scope, clauses)
+        if refinement is None:
+            return None
+        pks, added = refinement
+        return Q(pk__large_in=pks) & searcher.get_clauses_query(added)
+
+    def _store_refinement(self, queryset, count, offset, rows):
+        refinement = self.__dict__.get('_search_refinement')
+        cache = self.refinement_cache
+        # Cursor pages and downgraded searches are not whole results
+        if refinement is None or self.cursor_pagination or \
+                self.query_cost_action == 'downgrade' or \
+                not count.exact or count.count > cache.max_pks:
+            return
+        scope, clauses = refinement
+        if cache.has(scope, clauses):
+            return
+
+        if offset == 0 and len(rows) == count.count:
+            # The page is the whole result
+            pks = [get_row_pk(row) for row in rows]
+        else:
+            with self._limit_time(queryset, 'fetch'):
+                pks = list(queryset.prefetch_related(None).order_by()
+                           .values_list('pk', flat=True))
+        cache.set(scope, clauses, pks, self.get_result_cache_models(queryset))
+
+    def _filter_search_queryset(self, searcher, queryset, queryQ, orderBy,
+                                paths):
         # Make queryset
-        queryset = self.get_search_queryset().filter(queryQ).order_by(*orderBy)
+        queryset = queryset.filter(queryQ).order_by(*orderBy)
+
+        if paths is not None:
+            return self.apply_projection(queryset, paths)
+
+        # Avoid N+1 queries on the relations the searcher traverses
+        selects, prefetches = searcher.get_related_lookups(queryset.model)
+        if selects:
+            queryset = queryset.select_related(*selects)
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
 
         return queryset
+
+    def apply_projection(self, queryset, paths):
+        '''
+        Fetch only the selected fields, and the ordering fields so cursors
+        do not load deferred fields
+        :param  queryset, The ordered search queryset
+        :param  paths, The field paths from `get_projection_fields`
+        :return The queryset, of dicts in the `values` mode
+        '''
+        assert self.projection_mode in ('only', 'values'), \
+            'projection_mode should be only/values'
+        model = queryset.model
+        paths = list(paths)
+        for field in queryset.query.order_by:
+            path = field.lstrip('-')
+            if path not in paths and path != 'pk' and (
+                    path in queryset.query.annotations or
+                    is_field_path(model, path)):
+                paths.append(path)
+
+        selects, prefetches = infer_related_lookups(model, tuple(
+            path for path in paths if path not in queryset.query.annotations
+        ))
+        assert not prefetches, \
+            'projection fields should not traverse multi valued relations'
+
+        if self.projection_mode == 'values':
+            return queryset.select_related(None).prefetch_related(None) \
+                .values('pk', *paths)
+        return queryset.select_related(None).select_related(*selects) \
+            .prefetch_related(None).only(*(
+                path for path in paths
+                if path not in queryset.query.annotations
+            ))
+
+    def check_query_cost(self, queryset):
+        '''
+        Run `EXPLAIN` on the search queryset and apply `max_query_cost` and
+        `max_query_rows`, databases without estimates are not checked
+        :param  queryset, The search queryset
+        :return The queryset, capped if downgraded
+        '''
+        if self.max_query_cost is None and self.max_query_rows is None:
+            return queryset
+        return self._apply_query_cost(queryset, estimate_query_cost(queryset))
+
+    def _apply_query_cost(self, queryset, estimate):
+        if estimate is None:
+            return queryset
+
+        cost, rows = estimate
+        if self.max_query_cost is not None and cost > self.max_query_cost:
+            reason, limit, value = 'max_query_cost', self.max_query_cost, cost
+        elif self.max_query_rows is not None and rows > self.max_query_rows:
+            reason, limit, value = 'max_query_rows', self.max_query_rows, rows
+        else:
+            return queryset
+
+        if self.query_cost_action == 'downgrade' and \
+                self.max_query_rows is not None:
+            return queryset.filter(
+                pk__in=queryset.values('pk')[:self.max_query_rows]
+            )
+        raise SearchRejected(
+            'The search is too expensive',
+            reason=reason, limit=limit, value=value
+        )
+
+    def get_count_strategy(self):
+        '''
+        Return the count strategy of the searcher
+        '''
+        return self.get_searcher_class().count_strategy or ExactCount()
+
+    def get_search_count(self, queryset=None, offset=0, limit=None):
+        '''
+        Count the search results with the searcher count strategy
+        :param  queryset, The queryset from `get_queryset`, by default
+                `get_queryset()` is called
+        :param  offset, The index of the first row of the page
+        :param  limit, The page size
+        :return SearchCount, `as_dict()` tells whether the count is exact
+        '''
+        if queryset is None:
+            queryset = self.get_queryset()
+        return self._get_count(
+            self.get_count_strategy(), queryset, offset, limit
+        )
+
+    def _get_count(self, strategy, queryset, offset, limit):
+        countTimeout = self.get_searcher_class().count_timeout
+        try:
+            with self._limit_time(queryset, 'count', countTimeout):
+                return strategy.get_count(queryset, offset, limit)
+        except SearchTimeout:
+            deadline = self.get_search_deadline()
+            if countTimeout is None or limit is None or (
+                    deadline is not None and deadline.remaining() <= 0):
+                raise
+
+        # Over `count_timeout`, only look for a next page
+        with self._limit_time(queryset, 'count'):
+            return HasNextCount().get_count(queryset, offset, limit)
+
+    def _fetch_rows(self, queryset, offset, limit):
+        with self._limit_time(queryset, 'fetch'):
+            if limit is None:
+                return list(queryset[offset:])
+            return list(queryset[offset:offset + limit])
+
+    def _get_page(self, strategy, queryset, offset, limit):
+        if limit is None or not isinstance(strategy, HasNextCount):
+            count = self._get_count(strategy, queryset, offset, limit)
+            return count, self._fetch_rows(queryset, offset, limit)
+
+        # The extra row tells whether there is a next page
+        rows = self._fetch_rows(queryset, offset, limit + 1)
+        return strategy.get_page_count(offset, limit, len(rows)), rows[:limit]
+
+    def get_result_cache_models(self, queryset):
+        '''
+        Return the models invalidating the cached pages, the searched model
+        and the models traversed by the `query_mapping` paths. Override it
+        when `get_search_queryset` filters on other models.
+        '''
+        return get_related_models(
+            queryset.model, self.get_searcher().get_search_plan().field_paths
+        )
+
+    def get_search_results(self, offset=0, limit=None, queryset=None):
+        '''
+        Count the search results and fetch a slice of them, through
+        `result_cache` if it is set and the slice is not larger than its
+        `max_rows`
+        :param  offset, The index of the first row
+        :param  limit, The maximum number of rows, by default every row
+        :param  queryset, The queryset from `get_queryset`, by default
+                `get_queryset()` is called
+        :return (SearchCount, rows) tuple
+        '''
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        with self._measure_fetch(queryset) as stats:
+            count, rows = self._get_search_results(queryset, offset, limit)
+            if self.refinement_cache is not None:
+                self._store_refinement(queryset, count, offset, rows)
+        self._record_rows(stats, rows)
+        return count, rows
+
+    def _get_search_results(self, queryset, offset, limit):
+        strategy = self.get_count_strategy()
+        cache = self.result_cache
+        if cache is None or limit is None or limit > cache.max_rows:
+            return self._get_page(strategy, queryset, offset, limit)
+
+        models = self.get_result_cache_models(queryset)
+        cache.watch(models)
+        key = cache.get_cache_key(
+            queryset, offset, limit, cache.get_generations(models)
+        )
+        page = cache.get(key)
+        if page is not None:
+            count, pks = page
+            with self._limit_time(queryset, 'fetch'):
+                return SearchCount(*count), cache.get_rows(queryset, pks)
+
+        count, rows = self._get_page(strategy, queryset, offset, limit)
+        cache.set(key, count, [get_row_pk(row) for row in rows])
+        return count, rows
+
+    def get_sharded_results(self, offset=0, limit=None, queryset=None):
+        '''
+        Run the search on every alias of `search_shards` concurrently,
+        fetching the first `offset + limit` rows of each, and merge them
+        into the global page
+        :param  offset, The index of the first row
+        :param  limit, The maximum number of rows, by default every row
+        :param  queryset, The queryset from `get_queryset`, by default
+                `get_queryset()` is called
+        :return (SearchCount, rows) tuple, the count is the sum of the
+                shard counts
+        '''
+        assert self.search_shards, (
+            "'%s' should set `search_shards` to use sharded results"
+            % self.__class__.__name__
+        )
+        if queryset is None:
+            queryset = self.get_queryset()
+        strategy = self.get_count_strategy()
+        end = None if limit is None else offset + limit
+
+        def search(alias):
+            shardQueryset = queryset.using(alias)
+            return self._get_page(strategy, shardQueryset, 0, end)
+
+        # The queries run in other threads, the stats only get the time
+        with self._measure_stats(queryset, sql=False) as stats:
+            results = search_shards(
+                search, self.search_shards, self.search_shard_workers
+            )
+            orderBy = queryset.query.order_by
+            rows = merge_pages(
+                [rows for _, rows in results], orderBy, offset, limit,
+                connections[self.search_shards[0]].features.nulls_order_largest
+            )
+        self._record_rows(stats, rows)
+
+        counts = [count for count, _ in results]
+        return SearchCount(
+            sum(count.count for count in counts),
+            all(count.exact for count in counts), None
+        ), rows
+
+    def _get_facet_querysets(self, keys, size):
+        searcher = self.get_searcher()
+        queryset = self._use_search_database(self.get_search_queryset())
+        if searcher.model is None:
+            searcher.model = queryset.model
+
+        # Rows are counted once per value even if the filters join multi
+        # valued relations
+        _, prefetches = infer_related_lookups(
+            queryset.model, searcher.get_search_plan().field_paths
+        )
+        count = Count('pk', distinct=bool(prefetches))
+
+        facets = []
+        for key in keys:
+            path = searcher.get_facet_path(key)
+            facetQueryset = queryset.filter(
+                searcher.get_facet_query(self.request.GET, key)
+            ).order_by().values_list(path).annotate(
+                facet_count=count
+            ).order_by('-facet_count', path)
+            if size is not None:
+                facetQueryset = facetQueryset[:size]
+            facets.append((key, facetQueryset))
+        return facets
+
+    def get_facet_counts(self, keys=None, size=None):
+        '''
+        Count the search results by the values of each facet key, one
+        grouped query per key. The clauses on a key do not filter its own
+        counts, so every value of a multi-select facet keeps its count.
+        :param  keys, The query keys, mapped to single fields, by default
+                `facet_keys`
+        :param  size, The maximum number of values of a key, the most
+                frequent ones, by default `facet_size`
+        :return {key: [(value, count), ...]} dict, by descending count
+        '''
+        if keys is None:
+            keys = self.facet_keys
+        if size is None:
+            size = self.facet_size
+        facets = {}
+        for key, queryset in self._get_facet_querysets(keys, size):
+            with self._track_database(queryset.db), \
+                    self._limit_time(queryset, 'facets'):
+                facets[key] = list(queryset)
+        return facets
+
+    def get_faceted_results(self, offset=0, limit=None, keys=None):
+        '''
+        Count and fetch a slice of the search results and count the facets
+        :param  offset, The index of the first row
+        :param  limit, The maximum number of rows, by default every row
+        :param  keys, The facet query keys, by default `facet_keys`
+        :return (SearchCount, rows, facets) tuple
+        '''
+        count, rows = self.get_search_results(offset, limit)
+        return count, rows, self.get_facet_counts(keys)
+
+    def get_cursor_page(self, queryset=None):
+        '''
+        Return the rows of the page selected by the cursor query param
+        :param  queryset, The queryset from `get_queryset`, by default
+                `get_queryset()` is called
+        :return (rows, next cursor) tuple, the next cursor is None on the
+                last page
+        '''
+        assert self.cursor_pagination, (
+            "'%s' should set `cursor_pagination` to use cursor pages"
+            % self.__class__.__name__
+        )
+        if queryset is None:
+            queryset = self.get_queryset()
+
+        with self._measure_fetch(queryset) as stats:
+            rows = self._fetch_rows(queryset, 0, self.cursor_page_size + 1)
+        self._record_rows(stats, rows[:self.cursor_page_size])
+        return self._get_cursor_result(queryset, rows)
+
+    def _get_cursor_result(self, queryset, rows):
+        if len(rows) <= self.cursor_page_size:
+            return rows, None
+
+        rows = rows[:self.cursor_page_size]
+        orderBy = queryset.query.order_by
+        return rows, encode_cursor(
+            orderBy, get_ordering_values(rows[-1], orderBy)
+        )
+
+    def get_export_response(self, fmt='csv', filename=None):
+        '''
+        Stream every search result as CSV or JSON Lines. Rows are fetched
+        with `QuerySet.iterator()` (server side cursors where the database
+        supports them), so memory stays constant whatever the result size.
+        :param  fmt, The export format, `csv` or `jsonl`
+        :param  filename, The attachment file name, optional
+        :return StreamingHttpResponse, ValueError is raised for an unknown
+                format or if no field can be exported
+        '''
+        try:
+            writer, contentType = EXPORT_FORMATS[fmt]
+        except KeyError:
+            raise ValueError('Unsupported export format: {}'.format(fmt))
+
+        queryset = self.get_queryset()
+        searcher = self.get_searcher()
+        fields = get_export_fields(
+            queryset.model,
+            searcher.get_search_plan().query_mapping,
+            self.export_fields
+        )
+        if not fields:
+            # `values_list()` without fields would export whole rows
+            raise ValueError('No field to export')
+        keys = [key for key, _ in fields]
+        rows = queryset.prefetch_related(None).values_list(
+            *[path for _, path in fields]
+        ).iterator(chunk_size=self.export_chunk_size)
+
+        response = StreamingHttpResponse(
+            writer(rows, keys), content_type=contentType
+        )
+        if filename:
+            response['Content-Disposition'] = \
+                'attachment; filename="{}"'.format(filename)
+        return response
+
+
+class AsyncDjangoSearchMixin(DjangoSearchMixin):
+    '''
+    Make the async view class searchable. Parsing the query does not touch
+    the database, so it runs in the event loop with the sync searcher, the
+    queries run through the async ORM.
+    '''
+    async def aget_queryset(self):
+        await self.aget_search_database(self.get_search_queryset().model)
+        return await self.acheck_query_cost(self.build_search_queryset())
+
+    async def aget_search_database(self, model):
+        '''
+        Async version of `get_search_database`, the session is read before
+        the sync code building the querysets runs
+        '''
+        if self.search_replicas is None:
+            return None
+        alias = self.__dict__.get('_search_database')
+        if alias is None:
+            alias = self._select_search_database(
+                model, await ashould_read_primary(self.request)
+            )
+        return alias
+
+    async def acheck_query_cost(self, queryset):
+        '''
+        Async version of `check_query_cost`
+        '''
+        if self.max_query_cost is None and self.max_query_rows is None:
+            return queryset
+        return self._apply_query_cost(
+            queryset, await aestimate_query_cost(queryset)
+        )
+
+    async def aget_search_results(self, offset=0, limit=None, queryset=None):
+        '''
+        Count the search results and fetch a slice of them. The SQL runs in
+        other threads, the stats only get the `fetch` time.
+        :param  offset, The index of the first row
+        :param  limit, The maximum number of rows, by default every row
+        :param  queryset, The queryset from `aget_queryset`, by default
+                `aget_queryset()` is called
+        :return (SearchCount, rows) tuple
+        '''
+        if queryset is None:
+            queryset = await self.aget_queryset()
+        # The time limits are set on the connection of the sync ORM
+        if self.result_cache is not None or self._has_time_limit() or \
+                self.refinement_cache is not None:
+            return await sync_to_async(self.get_search_results)(
+                offset, limit, queryset
+            )
+
+        strategy = self.get_count_strategy()
+        with self._measure_fetch(queryset, sql=False) as stats:
+            if limit is not None and isinstance(strategy, HasNextCount):
+                # The extra row tells whether there is a next page
+                page = queryset[offset:offset + limit + 1]
+                rows = [obj async for obj in page]
+                count = strategy.get_page_count(offset, limit, len(rows))
+                rows = rows[:limit]
+            else:
+                count = await strategy.aget_count(queryset, offset, limit)
+                if limit is None:
+                    page = queryset[offset:]
+                else:
+                    page = queryset[offset:offset + limit]
+                rows = [obj async for obj in page]
+        self._record_rows(stats, rows)
+        return count, rows
+
+    async def aget_facet_counts(self, keys=None, size=None):
+        '''
+        Async version of `get_facet_counts`
+        '''
+        if keys is None:
+            keys = self.facet_keys
+        if size is None:
+            size = self.facet_size
+        if self._has_time_limit():
+            return await sync_to_async(self.get_facet_counts)(keys, size)
+        await self.aget_search_database(self.get_search_queryset().model)
+        facets = {}
+        for key, queryset in self._get_facet_querysets(keys, size):
+            with self._track_database(queryset.db):
+                facets[key] = [row async for row in queryset]
+        return facets
+
+    async def aget_faceted_results(self, offset=0, limit=None, keys=None):
+        '''
+        Async version of `get_faceted_results`
+        '''
+        count, rows = await self.aget_search_results(offset, limit)
+        return count, rows, await self.aget_facet_counts(keys)
+
+    async def aget_cursor_page(self, queryset=None):
+        '''
+        Async version of `get_cursor_page`
+        '''
+        assert self.cursor_pagination, (
+            "'%s' should set `cursor_pagination` to use cursor pages"
+            % self.__class__.__name__
+        )
+        if queryset is None:
+            queryset = await self.aget_queryset()
+        if self._has_time_limit():
+            return await sync_to_async(self.get_cursor_page)(queryset)
+
+        with self._measure_fetch(queryset, sql=False) as stats:
+            rows = [obj async for obj in queryset[:self.cursor_page_size + 1]]
+        self._record_rows(stats, rows[:self.cursor_page_size])
+        return self._get_cursor_result(queryset, rows)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar keyset (cursor) pagination
+"""
+from __future__ import unicode_literals
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+
+from django.db.models import Model, Q
+
+from .exceptions import InvalidCursor
+
+
+class CursorEncoder(json.JSONEncoder):
+    '''
+    Encode the sort values without losing precision, the ORM parses the
+    strings back when comparing
+    '''
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, (decimal.Decimal, uuid.UUID)):
+            return str(o)
+        return super(CursorEncoder, self).default(o)
+
+
+def get_cursor_ordering(orderBy):
+    '''
+    Add `pk` as the tiebreaker of the ordering, so the row order is total
+    :param  orderBy, The order by fields from `get_order_fields`
+    :return Order by fields ending with the primary key
+    '''
+    orderBy = list(orderBy)
+    if 'pk' not in orderBy and '-pk' not in orderBy:
+        orderBy.append('pk')
+    return orderBy
+
+
+def get_ordering_values(obj, orderBy):
+    '''
+    Read the sort values of a model instance
+    :param  obj, The model instance, or a dict from `values()`
+    :param  orderBy, The order by fields
+    :return List of values, one for each order by field
+    '''
+    values = []
+    for field in orderBy:
+        if isinstance(obj, dict):
+            values.append(obj[field.lstrip('-')])
+            continue
+        value = obj
+        for attr in field.lstrip('-').split('__'):
+            if value is None:
+                # A NULL relation
+                break
+            value = getattr(value, attr)
+        if isinstance(value, Model):
+            value = value.pk
+        values.append(value)
+    return values
+
+
+def encode_cursor(orderBy, values):
+    '''
+    Encode the ordering and the sort values of the last row into an opaque
+    cursor
+    '''
+    payload = json.dumps(
+        {'o': list(orderBy), 'v': list(values)},
+        cls=CursorEncoder, separators=(',', ':')
+    )
+    return urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, orderBy):
+    '''
+    Decode a cursor created by `encode_cursor`
+    :param  cursor, The cursor string
+    :param  orderBy, The current order by fields
+    :return The sort values of the last row of the previous page
+    '''
+    try:
+        payload = json.loads(
+            urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        )
+        ordering, values = payload['o'], payload['v']
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        raise InvalidCursor('The cursor is malformed')
+
+    if ordering != list(orderBy) or len(values) != len(orderBy):
+        raise InvalidCursor('The cursor does not match the ordering')
+    return values
+
+
+def _get_after_q(field, value, descending, nullsLast):
+    '''
+    Build the predicate selecting the values of a sort field after a value,
+    None if no value comes after
+    '''
+    if value is None:
+        # NULL is the last value, or the first one before every value
+        return None if nullsLast else Q(**{'{}__isnull'.format(field): False})
+
+    lookup = '{}__lt' if descending else '{}__gt'
+    afterQ = Q(**{lookup.format(field): value})
+    if nullsLast:
+        afterQ |= Q(**{'{}__isnull'.format(field): True})
+    return afterQ
+
+
+def get_seek_q(orderBy, values, nullsLargest=False):
+    '''
+    Build the predicate selecting the rows after the given sort values,
+    eg. for [`-a`, `pk`]: Q(a__lt=v1) | Q(a=v1, pk__gt=v2). NULL values are
+    placed like the database sorts them.
+    :param  orderBy, The order by fields, the last one should be unique
+    :param  values, The sort values of the last row of the previous page
+    :param  nullsLargest, Whether the database sorts NULL after the values,
+            see `connection.features.nulls_order_largest`
+    :return Q object
+    '''
+    queryObj = None
+    equals = Q()
+    for field, value in zip(orderBy, values):
+        descending = field.startswith('-')
+        field = field.lstrip('-')
+        seekQ = _get_after_q(
+            field, value, descending, nullsLargest != descending
+        )
+        if seekQ is not None:
+            seekQ = equals & seekQ
+            queryObj = seekQ if queryObj is None else queryObj | seekQ
+
+        if value is None:
+            equals &= Q(**{'{}__isnull'.format(field): True})
+        else:
+            equals &= Q(**{field: value})
+
+    # Only with NULL in every field, no row is after
+    return Q(pk__in=[]) if queryObj is None else queryObj
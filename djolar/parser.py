@@ -1,13 +1,94 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.db.models import Q
+from functools import partial
+
+from django.db.models import F, Q
 from django.http.request import QueryDict
 
+from .cache import SearchCache
+from .canonical import Clause, canonicalize, format_clauses
+from .coercion import coerce_value, get_key_converter
+from .expression import (
+    compile_expression,
+    count_clauses,
+    format_expression,
+    get_leaves,
+    is_expression,
+    optimize,
+    parse_expression,
+    tokenize_expression,
+    without_key,
+)
+from .fulltext import FullTextQuery, FullTextRank
+from .guard import check_clause, check_clause_count
+from .inlist import LARGE_IN, unique_sorted
+from .plan import compile_search_plan
+from .relations import get_field_keys, infer_related_lookups
+from .tokenizer import tokenize
+
 import re
 
 
-class DjangoSearchParser(object):
+_DESC_RE = re.compile(r'(?<=-)\S+')
+
+# Settings compiled into the search plan
+PLAN_OPTIONS = (
+    'query_mapping',
+    'default_search',
+    'force_search',
+    'default_order_by',
+    'ignore_case',
+    'select_related',
+    'prefetch_related',
+    'max_clauses',
+    'max_in_values',
+    'min_contains_length',
+    'canonicalize_query',
+    'fulltext_search',
+    'large_list_threshold',
+    'projection_keys',
+)
+
+
+class SearchParserMetaclass(type):
+    '''
+    Validate and compile the search settings once for every subclass
+    defining `query_mapping`, a misconfigured searcher fails on import
+    '''
+    def __new__(mcs, name, bases, attrs):
+        cls = super(SearchParserMetaclass, mcs).__new__(
+            mcs, name, bases, attrs
+        )
+        if hasattr(cls, 'query_mapping'):
+            cls._search_plan = compile_search_plan(cls)
+        else:
+            cls._search_plan = None
+
+        # Every searcher class owns its cache
+        cacheSize = getattr(cls, 'cache_size', None)
+        if cacheSize:
+            cls._search_cache = SearchCache(
+                cacheSize, getattr(cls, 'cache_ttl', None)
+            )
+        else:
+            cls._search_cache = None
+        return cls
+
+
+def normalize_query(value):
+    '''
+    Normalize the `q` query param value: empty clauses of a flat query are
+    dropped, the whitespace of an expression is collapsed
+    :param  value, The `q` query param value
+    :return Normalized query string
+    '''
+    if is_expression(value):
+        return ' '.join(value.split())
+    return '|'.join(clause for clause in value.split('|') if clause)
+
+
+class DjangoSearchParser(object, metaclass=SearchParserMetaclass):
     '''
     Query string Format:
         q=key1__eq__value1|key2__lt__value2|key3__co__value3&s=order&extrafield=value
@@ -29,200 +110,422 @@ class DjangoSearchParser(object):
                                     * sql equal: `key > value`
         8. great than or equal(lte) => key__gte__value
                                     * sql equal: `key >= value`
+        9. full text search (fts)   =>  key__fts__term1,term2
+                                    * keys declared in `fulltext_search`
+        Clauses may be grouped with AND, OR, NOT and parentheses, eg.
+        q=(st__eq__a OR st__eq__b) AND NOT name__co__x, see
+        `djolar.expression`
     '''
+    # Opt-in LRU cache of the parsed `q` and `s` values, the number of
+    # entries cached for the searcher class and their time to live in seconds
+    cache_size = None
+    cache_ttl = None
+
+    # Relations to join and prefetch for the search results, by default they
+    # are inferred from the `query_mapping` paths
+    select_related = None
+    prefetch_related = None
+
+    # The model searched, clause values are converted to the type of their
+    # model field when it is set. `DjangoSearchMixin` sets it to the model of
+    # the search queryset.
+    model = None
+
+    # How `DjangoSearchMixin` counts the search results, an instance of a
+    # `djolar.counting` strategy, `ExactCount` by default
+    count_strategy = None
+
+    # Time budget of a search in seconds, parse, count and fetch included,
+    # enforced by `DjangoSearchMixin` at the database and between the steps,
+    # a search over it raises `SearchTimeout`. A count over `count_timeout`
+    # falls back to `HasNextCount` instead of raising.
+    search_timeout = None
+    count_timeout = None
+
+    # Static query limits, a query over them raises `SearchRejected`
+    max_clauses = None
+    max_in_values = None
+    min_contains_length = None
+
+    # Dedupe, merge and sort the clauses before building the Q object
+    canonicalize_query = True
+
+    # `in`/`ni` lists with more values are deduplicated, sorted and sent to
+    # the database as a single array or JSON parameter where supported,
+    # see `djolar.inlist`
+    large_list_threshold = 1000
+
+    # Keys the client may select with the `f` query param, eg. `f=name,date`,
+    # to fetch only their fields. The param is ignored when it is None.
+    projection_keys = None
+
+    # Keys supporting the `fts` operator, eg.
+    # {'name': FullText('english', sqlite_table='app_book_fts')}
+    fulltext_search = None
+
+    # The `djolar.instrumentation.SearchStats` of the current search, set by
+    # `DjangoSearchMixin` when the view has collectors
+    search_stats = None
+
     def __init__(self, *args, **kwargs):
-        try:
-            getattr(self, 'query_mapping')
-        except AttributeError:
-            raise AttributeError(
-                'query_mapping is not defined in the subclass'
-            )
+        plan = self.get_search_plan()
+        self.ignoreCase = plan.ignore_case
 
-        try:
-            default = getattr(self, 'default_search')
-            assert isinstance(default, dict), \
-                'default_search should be instance of dict'
-        except AttributeError:
-            pass
-
-        try:
-            force = getattr(self, 'force_search')
-            assert isinstance(force, dict), \
-                'force_search should be instance of dict'
-        except AttributeError:
-            pass
-
-        try:
-            defaultOrderby = getattr(self, 'default_order_by')
-            assert isinstance(defaultOrderby, list) or \
-                isinstance(defaultOrderby, tuple), \
-                'default_order_by should be instance of tuple/list'
-        except AttributeError:
-            pass
-
-        try:
-            self.ignoreCase = getattr(self, 'ignore_case')
-            assert isinstance(self.ignoreCase, bool), \
-                'ignore_case should be true/false'
-        except AttributeError:
-            self.ignoreCase = True
-
-    def _build_q(self, key, field_fmt, value):
-        '''
-        Build a Q object
-        :param  key, The key for the query_mapping to retrieve mapping field
-        :param  field_fmt, The format to build the Q field name
-        :param  value, The value for the Q field
-        :return Q object
+    def get_search_plan(self):
+        '''
+        Return the compiled `SearchPlan` of the searcher. Settings assigned
+        on the instance are compiled once for that instance.
         '''
-        tmpQueryObj = None
-        try:
-            mapField = self.query_mapping[key]
-        except KeyError:
+        plan = self.__dict__.get('_search_plan')
+        if plan is None:
+            plan = type(self)._search_plan
+            if plan is None or any(
+                    option in self.__dict__ for option in PLAN_OPTIONS):
+                plan = compile_search_plan(self)
+            self._search_plan = plan
+        return plan
+
+    @classmethod
+    def get_search_cache(cls):
+        '''
+        Return the `SearchCache` of the searcher class, or None if caching is
+        disabled. Enable it with `cache_size` and optionally `cache_ttl`.
+        '''
+        return cls._search_cache
+
+    def _get_cache(self):
+        # Searchers with instance settings can not share the class cache
+        if self.get_search_plan() is not type(self)._search_plan:
             return None
-        if isinstance(mapField, (list, tuple)):
-            for idx, field in enumerate(mapField):
-                field_dict = {}
-                field_dict[field_fmt.format(field)] = value
-                if idx == 0:
-                    tmpQueryObj = Q(**field_dict)
-                else:
-                    tmpQueryObj = tmpQueryObj | Q(**field_dict)
-        elif isinstance(mapField, str):
-            field_dict = {}
-            field_dict[field_fmt.format(mapField)] = value
-            tmpQueryObj = Q(**field_dict)
-        else:
-            raise ValueError(
-                """the query_maping key value should be type of
-                list/tuple or str"""
-            )
-        return tmpQueryObj
+        return self.get_search_cache()
+
+    def _parse_clause(self, plan, fields):
+        '''
+        Parse a clause string, None if it is invalid or its key or operator
+        is not mapped
+        '''
+        token = tokenize(fields)
+        if token is None:
+            return None
+
+        k, operator, v = token
+        if k not in plan.lookups or operator.name not in plan.lookups[k]:
+            return None
+        check_clause(plan, k, operator, v)
+        if operator.is_list:
+            v = tuple(v)
+        if operator.name == 'fts':
+            v = FullTextQuery.parse(v, plan.fulltext_search[k])
+            if not v.terms:
+                return None
+        elif self.model is not None and operator.name != 'co':
+            converter = get_key_converter(self.model, plan.lookups[k]['eq'])
+            if converter is not None:
+                v = coerce_value(converter, k, operator, v)
+        return Clause(k, operator, v)
+
+    def get_clauses(self, keys):
+        '''
+        Parse the `q` query param value into clauses on mapped keys, checked
+        against the static limits, with values converted to the type of the
+        model field if `model` is set, in canonical form unless
+        `canonicalize_query` is false
+        :param  keys, The `q` query param value
+        :return List of `Clause`, list values as tuples. For a boolean
+                expression, the clauses of its optimized tree.
+        '''
+        if is_expression(keys):
+            return get_leaves(self.get_expression(keys))
+
+        plan = self.get_search_plan()
+
+        fieldsList = [fields for fields in keys.split('|') if fields]
+        check_clause_count(plan, len(fieldsList))
+
+        clauses = []
+        for fields in fieldsList:
+            clause = self._parse_clause(plan, fields)
+            if clause is not None:
+                clauses.append(clause)
+
+        if plan.canonicalize_query:
+            clauses = canonicalize(plan, clauses)
+        if self.search_stats is not None:
+            self.search_stats.set_clauses(clauses)
+        return clauses
+
+    def get_expression(self, keys):
+        '''
+        Parse the `q` query param value as a boolean expression, see
+        `djolar.expression`
+        :param  keys, The `q` query param value
+        :return The optimized tree, `TRUE` if it has no clause or `FALSE` if
+                it can not match
+        '''
+        plan = self.get_search_plan()
+
+        tokens = tokenize_expression(keys)
+        check_clause_count(plan, count_clauses(tokens))
+        node = optimize(plan, parse_expression(
+            tokens, lambda fields: self._parse_clause(plan, fields)
+        ), self._get_field_keys(plan))
+        if self.search_stats is not None:
+            self.search_stats.set_clauses(get_leaves(node))
+        return node
+
+    def _get_field_keys(self, plan):
+        # Unknown without the model, no key is optimized as a field
+        if self.model is None:
+            return frozenset()
+        return get_field_keys(self.model, tuple(
+            (key, tuple(path) if isinstance(path, (list, tuple)) else (path, ))
+            for key, path in sorted(plan.query_mapping.items())
+        ))
+
+    def get_canonical_query(self, requestParams):
+        '''
+        Get the canonical form of the `q` query param, equivalent queries
+        give the same string, eg. for cache keys and logging
+        :param  requestParams, The query dict get from request
+        :return The canonical query string
+        '''
+        keys = requestParams.get('q', '')
+        if is_expression(keys):
+            return format_expression(self.get_expression(keys))
+        return format_clauses(self.get_clauses(keys))
+
+    def _build_clause(self, plan, clause):
+        '''
+        Build the Q object of a clause, None if its key maps to no field
+        '''
+        operator = clause.operator
+        lookupOperator = operator
+        value = clause.value
+        if operator.is_list:
+            threshold = plan.large_list_threshold
+            if threshold is not None and len(value) > threshold:
+                lookupOperator = LARGE_IN
+                value = unique_sorted(value)
+            else:
+                value = list(value)
+        fieldQ = plan.build_q(clause.key, lookupOperator, value)
+        if not fieldQ:
+            return None
+        return ~fieldQ if operator.negated else fieldQ
+
+    def _build_query(self, plan, clauses):
+        '''
+        Build the Q object of the force search and the clauses
+        :param  plan, The compiled `SearchPlan`
+        :param  clauses, List of `Clause`
+        :return Q object
+        '''
+        # Build force search
+        queryObj = Q(**plan.force_search)
+
+        for clause in clauses:
+            fieldQ = self._build_clause(plan, clause)
+            if fieldQ is not None:
+                queryObj &= fieldQ
+
+        return queryObj
+
+    def get_clauses_query(self, clauses):
+        '''
+        Build the Q object of the force search and clauses
+        :param  clauses, List of `Clause` from `get_clauses`
+        :return Q object
+        '''
+        return self._build_query(self.get_search_plan(), clauses)
+
+    def _build_expression(self, plan, node):
+        '''
+        Build the Q object of the force search and the expression tree
+        '''
+        return Q(**plan.force_search) & compile_expression(
+            node, lambda clause: self._build_clause(plan, clause)
+        )
 
     def get_query_fields(self, requestParams):
         '''
         Get model query fields, eg.  Q(aa__contains='123') & Q(bb='123')
         :param   requestParams, The query dict get from request
-        :return  Q query objects combines with `and` operator
+        :return  Q query objects combines with `and` operator. The object
+                 may be shared by the search cache, do not modify it in place.
+        '''
+        return self.get_search_query(requestParams)[0]
+
+    def get_search_query(self, requestParams):
+        '''
+        Get the model query fields and the clauses they were built from
+        :param  requestParams, The query dict get from request
+        :return (Q object, clauses) tuple, the clauses of `get_clauses` or
+                of the expression tree, None for the default search
         '''
         assert isinstance(requestParams, QueryDict), \
             'requestParams should be QueryDict'
 
-        # Build force search
-        try:
-            forceSearch = getattr(self, 'force_search')
-            queryObj = Q(**forceSearch)
-        except AttributeError:
-            queryObj = Q()
+        if self.search_stats is not None:
+            with self.search_stats.measure('parse'):
+                return self._get_search_query(requestParams)
+        return self._get_search_query(requestParams)
+
+    def _get_search_query(self, requestParams):
+        plan = self.get_search_plan()
 
         # Build custom search
         if 'q' in requestParams.keys():
             keys = requestParams['q']
-            for fields in keys.split('|'):
-                if len(fields) == 0:
-                    continue
-
-                match = re.match(r'(\w+)__co__(\S+)', fields)
-                if match:
-                    # Contain
-                    k, v = match.groups()
-                    # Fuzzy match
-                    if self.ignoreCase:
-                        fieldQ = self._build_q(k, '{}__icontains', v)
-                    else:
-                        fieldQ = self._build_q(k, '{}__contains', v)
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__lt__(\S+)', fields)
-                if match:
-                    # less than
-                    k, v = match.groups()
-                    fieldQ = self._build_q(k, '{}__lt', v)
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__gt__(\S+)', fields)
-                if match:
-                    # greater than
-                    k, v = match.groups()
-                    fieldQ = self._build_q(k, '{}__gt', v)
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__lte__(\S+)', fields)
-                if match:
-                    # less than and equal
-                    k, v = match.groups()
-                    fieldQ = self._build_q(k, '{}__lte', v)
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__gte__(\S+)', fields)
-                if match:
-                    # greater than and equal
-                    k, v = match.groups()
-                    fieldQ = self._build_q(k, '{}__gte', v)
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__eq__(\S+)', fields)
-                if match:
-                    # Exactly match
-                    k, v = match.groups()
-                    fieldQ = self._build_q(k, '{}', v)
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__in__\[(\S+)\]', fields)
-                if match:
-                    # `in` operator
-                    k, v = match.groups()
-                    fieldQ = self._build_q(
-                        k,
-                        '{}__in',
-                        [i.strip() for i in v.split(',')]
-                    )
-                    if not fieldQ:
-                        continue
-                    queryObj &= fieldQ
-                    continue
-
-                match = re.match(r'(\w+)__ni__\[(\S+)\]', fields)
-                if match:
-                    # `not` operator
-                    k, v = match.groups()
-                    fieldQ = self._build_q(
-                        k,
-                        '{}__in',
-                        [i.strip() for i in v.split(',')]
-                    )
-                    if not fieldQ:
-                        continue
-                    queryObj &= ~fieldQ
-                    continue
+            cache = self._get_cache()
+            if cache is None:
+                return self._parse_query(plan, keys, None)
+
+            # Repeated queries skip the parsing, the Q object of equivalent
+            # queries is shared by the second level keyed by canonical form
+            rawKey = ('r', self.model, normalize_query(keys))
+            entry = cache.get(rawKey)
+            if entry is None:
+                entry = self._parse_query(plan, keys, cache)
+                cache.set(rawKey, entry)
+            elif self.search_stats is not None:
+                self.search_stats.set_clauses(entry[1])
+            return entry
+
+        # Build default search if custom search provide no value, it is never
+        # cached as it may depend on the current time
+        queryObj = Q(**plan.force_search)
+        if plan.default_search is not None:
+            queryObj &= Q(**plan.default_search)
+
+        return queryObj, None
+
+    def _parse_query(self, plan, keys, cache):
+        if is_expression(keys):
+            node = self.get_expression(keys)
+            clauses = get_leaves(node)
+            cacheKey = ('e', self.model, format_expression(node))
+            build = partial(self._build_expression, plan, node)
         else:
-            # Build default search if custom search provide no value
-            try:
-                defaultSearch = getattr(self, 'default_search')
-                dftQueryObj = Q(**defaultSearch)
-                queryObj &= dftQueryObj
-            except AttributeError:
-                pass
+            clauses = self.get_clauses(keys)
+            cacheKey = ('q', self.model, format_clauses(clauses))
+            build = partial(self._build_query, plan, clauses)
+        if cache is None:
+            return build(), clauses
 
-        return queryObj
+        queryObj = cache.get(cacheKey)
+        if queryObj is None:
+            queryObj = build()
+            cache.set(cacheKey, queryObj)
+        return queryObj, clauses
+
+    def get_projection_fields(self, requestParams):
+        '''
+        Get the model fields selected by the `f` query param
+        :param  requestParams, The query dict get from request
+        :return List of field paths, or None to fetch every field. Keys not
+                in `projection_keys` are ignored.
+        '''
+        plan = self.get_search_plan()
+        value = requestParams.get('f')
+        if not value or plan.projection_keys is None:
+            return None
+
+        paths = []
+        for key in value.split(','):
+            if key in plan.projection_keys:
+                path = plan.query_mapping[key]
+                if path not in paths:
+                    paths.append(path)
+        return paths or None
+
+    def get_facet_query(self, requestParams, key):
+        '''
+        Get the Q object of the search without the clauses on a key, to
+        count the results by the values of the key (multi-select facets)
+        :param  requestParams, The query dict get from request
+        :param  key, The facet query key
+        :return Q object
+        '''
+        if 'q' not in requestParams.keys():
+            return self.get_query_fields(requestParams)
+
+        plan = self.get_search_plan()
+        if is_expression(requestParams['q']):
+            node = self.get_expression(requestParams['q'])
+            return self._build_expression(
+                plan, optimize(
+                    plan, without_key(node, key), self._get_field_keys(plan)
+                )
+            )
+
+        clauses = self.get_clauses(requestParams['q'])
+        return self._build_query(
+            plan, [clause for clause in clauses if clause.key != key]
+        )
+
+    def get_facet_path(self, key):
+        '''
+        Get the model field path to count a facet by
+        :param  key, The facet query key, mapped to a single field
+        :return The field path
+        '''
+        plan = self.get_search_plan()
+        paths = plan.lookups[key]['eq']
+        assert len(paths) == 1, \
+            'facet key {} should be mapped to a single field'.format(key)
+        return paths[0]
+
+    def get_fulltext_rank(self, clauses):
+        '''
+        Get the relevance of the results for the full text clauses, the sum
+        of the rank of every field matched
+        :param  clauses, The clauses returned by `get_search_query`, None for
+                the default search
+        :return Expression to annotate, or None if there is no `fts` clause
+        '''
+        plan = self.get_search_plan()
+        if not plan.fulltext_search or not clauses:
+            return None
+
+        rank = None
+        for clause in clauses:
+            if clause.operator.name != 'fts':
+                continue
+            for path in plan.lookups[clause.key]['eq']:
+                fieldRank = FullTextRank(F(path), clause.value)
+                rank = fieldRank if rank is None else rank + fieldRank
+        return rank
+
+    def get_related_lookups(self, model):
+        '''
+        Get the relations to join and prefetch for the search results
+        :param  model, The model class being searched
+        :return (select_related, prefetch_related) tuple of lookups
+        '''
+        plan = self.get_search_plan()
+        selects = plan.select_related
+        prefetches = plan.prefetch_related
+        if selects is None or prefetches is None:
+            inferSelects, inferPrefetches = infer_related_lookups(
+                model, plan.field_paths
+            )
+            if selects is None:
+                selects = inferSelects
+            if prefetches is None:
+                prefetches = inferPrefetches
+        return selects, prefetches
+
+    def _build_order(self, plan, value):
+        orderby = []
+        for field in value.split(','):
+            m = _DESC_RE.search(field)
+            if m:
+                # Desc
+                orderby.append('-{}'.format(plan.query_mapping[m.group()]))
+            else:
+                # Asc
+                orderby.append(plan.query_mapping[field])
+        return orderby
 
     def get_order_fields(self, requestParams):
         '''
@@ -236,31 +539,34 @@ class DjangoSearchParser(object):
         assert isinstance(requestParams, QueryDict), \
             'requestParams should be QueryDict'
 
+        stats = self.search_stats
+        if stats is not None:
+            with stats.measure('order'):
+                stats.order_by = self._get_order_fields(requestParams)
+            return list(stats.order_by)
+        return self._get_order_fields(requestParams)
+
+    def _get_order_fields(self, requestParams):
+        plan = self.get_search_plan()
+
         if 's' in requestParams.keys():
             value = requestParams['s']
             if value != '':
-                fields = value.split(',')
-                orderby = []
-                for field in fields:
-                    m = re.search('(?<=-)\S+', field)
-                    if m:
-                        # Desc
-                        orderby.append('-{}'.format(self.query_mapping[m.group()]))
-                    else:
-                        # Asc
-                        orderby.append(self.query_mapping[field])
-
-                return orderby
+                cache = self._get_cache()
+                if cache is None:
+                    return self._build_order(plan, value)
+
+                cacheKey = ('s', value)
+                orderby = cache.get(cacheKey)
+                if orderby is None:
+                    orderby = tuple(self._build_order(plan, value))
+                    cache.set(cacheKey, orderby)
+                return list(orderby)
 
         # Default to user setting
-        try:
-            defaultOrderby = getattr(self, 'default_order_by')
-            if len(defaultOrderby) == 0:
-                return ['pk']
-            else:
-                return defaultOrderby
-        except AttributeError:
+        if len(plan.default_order_by) == 0:
             return ['pk']
+        return list(plan.default_order_by)
 
 
 class BaseSearcher(DjangoSearchParser):
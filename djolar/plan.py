@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar compiled search plan
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+from types import MappingProxyType
+
+from django.db.models import Q
+
+from .canonical import RANGE
+from .fulltext import FullText
+from .inlist import LARGE_IN
+from .tokenizer import OPERATORS
+
+
+_NOT_DEFINED = object()
+
+
+class SearchPlan(namedtuple('SearchPlan', [
+    'query_mapping',
+    'field_paths',
+    'lookups',
+    'force_search',
+    'default_search',
+    'default_order_by',
+    'ignore_case',
+    'select_related',
+    'prefetch_related',
+    'max_clauses',
+    'max_in_values',
+    'min_contains_length',
+    'canonicalize_query',
+    'fulltext_search',
+    'large_list_threshold',
+    'projection_keys',
+])):
+    '''
+    Immutable search configuration compiled from a searcher class
+
+    `field_paths` holds every model field path in the query mapping and
+    `lookups` maps each query key to the Q field names of every operator,
+    eg. {'name': {'co': ('name__icontains', ), 'eq': ('name', ), ...}}.
+    The `fts` operator is only mapped for the keys in `fulltext_search`.
+    '''
+    __slots__ = ()
+
+    def build_q(self, key, operator, value):
+        '''
+        Build a Q object for a clause
+        :param  key, The query key, the key for the query_mapping
+        :param  operator, The clause `Operator`
+        :param  value, The value for the Q field
+        :return Q object, or None if the key is not mapped
+        '''
+        try:
+            fields = self.lookups[key][operator.name]
+        except KeyError:
+            return None
+
+        queryObj = None
+        for field in fields:
+            if queryObj is None:
+                queryObj = Q(**{field: value})
+            else:
+                queryObj = queryObj | Q(**{field: value})
+        return queryObj
+
+
+def _get_option(config, name):
+    value = getattr(config, name, _NOT_DEFINED)
+    return None if value is _NOT_DEFINED else value
+
+
+def compile_search_plan(config):
+    '''
+    Validate the searcher settings and compile them into a `SearchPlan`
+    :param  config, The searcher class or instance to read settings from
+    :return SearchPlan
+    '''
+    try:
+        queryMapping = getattr(config, 'query_mapping')
+    except AttributeError:
+        raise AttributeError(
+            'query_mapping is not defined in the subclass'
+        )
+    assert isinstance(queryMapping, dict), \
+        'query_mapping should be instance of dict'
+
+    default = _get_option(config, 'default_search')
+    assert default is None or isinstance(default, dict), \
+        'default_search should be instance of dict'
+
+    force = _get_option(config, 'force_search')
+    assert force is None or isinstance(force, dict), \
+        'force_search should be instance of dict'
+
+    defaultOrderby = _get_option(config, 'default_order_by')
+    assert defaultOrderby is None or \
+        isinstance(defaultOrderby, (list, tuple)), \
+        'default_order_by should be instance of tuple/list'
+
+    ignoreCase = _get_option(config, 'ignore_case')
+    if ignoreCase is None:
+        ignoreCase = True
+    assert isinstance(ignoreCase, bool), \
+        'ignore_case should be true/false'
+
+    related = {}
+    for name in ('select_related', 'prefetch_related'):
+        lookups = _get_option(config, name)
+        assert lookups is None or isinstance(lookups, (list, tuple)), \
+            '{} should be instance of tuple/list'.format(name)
+        related[name] = None if lookups is None else tuple(lookups)
+
+    limits = {}
+    for name in ('max_clauses', 'max_in_values', 'min_contains_length',
+                 'large_list_threshold'):
+        limit = _get_option(config, name)
+        assert limit is None or isinstance(limit, int), \
+            '{} should be an integer'.format(name)
+        limits[name] = limit
+
+    canonicalizeQuery = _get_option(config, 'canonicalize_query')
+    if canonicalizeQuery is None:
+        canonicalizeQuery = True
+    assert isinstance(canonicalizeQuery, bool), \
+        'canonicalize_query should be true/false'
+
+    fulltext = _get_option(config, 'fulltext_search') or {}
+    assert isinstance(fulltext, dict), \
+        'fulltext_search should be instance of dict'
+    for key, declaration in fulltext.items():
+        assert key in queryMapping, \
+            'fulltext_search key {} is not in query_mapping'.format(key)
+        assert isinstance(declaration, FullText), \
+            'fulltext_search values should be instances of FullText'
+
+    projection = _get_option(config, 'projection_keys')
+    assert projection is None or isinstance(projection, (list, tuple)), \
+        'projection_keys should be instance of tuple/list'
+    for key in projection or ():
+        assert isinstance(queryMapping.get(key), str), \
+            'projection key {} should be mapped to a single field'.format(key)
+
+    lookups = {}
+    paths = set()
+    for key, mapField in queryMapping.items():
+        if isinstance(mapField, (list, tuple)):
+            fields = tuple(mapField)
+        elif isinstance(mapField, str):
+            fields = (mapField, )
+        else:
+            raise ValueError(
+                """the query_maping key value should be type of
+                list/tuple or str"""
+            )
+        paths.update(fields)
+
+        operators = {}
+        for operator in list(OPERATORS.values()) + [RANGE, LARGE_IN]:
+            if operator.name == 'fts' and key not in fulltext:
+                continue
+            fmt = operator.ilookup if ignoreCase else operator.lookup
+            operators[operator.name] = tuple(
+                fmt.format(field) for field in fields
+            )
+        lookups[key] = MappingProxyType(operators)
+
+    return SearchPlan(
+        query_mapping=MappingProxyType(dict(queryMapping)),
+        field_paths=tuple(sorted(paths)),
+        lookups=MappingProxyType(lookups),
+        force_search=MappingProxyType(dict(force or {})),
+        default_search=(
+            None if default is None else MappingProxyType(dict(default))
+        ),
+        default_order_by=tuple(defaultOrderby or ()),
+        ignore_case=ignoreCase,
+        canonicalize_query=canonicalizeQuery,
+        fulltext_search=MappingProxyType(dict(fulltext)),
+        projection_keys=None if projection is None else tuple(projection),
+        **dict(related, **limits)
+    )
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar incremental refinement
+
+Type-ahead and filter UIs send series of queries each adding clauses to the
+previous one, eg. `st__eq__x` then `st__eq__x|age__gt__30`. The primary keys
+of every small result are kept in memory with its clauses, a query whose
+clauses contain the clauses of a cached result, or repeats them, is
+evaluated on its primary keys only:
+
+    pk IN (cached keys) AND (added clauses)
+
+instead of scanning the table again. The clauses are compared in canonical
+form, so equivalent queries refine each other whatever their order. Entries
+expire after `timeout` seconds and are dropped on `post_save`,
+`post_delete` and `m2m_changed` of the models they read.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+import threading
+import time
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+class RefinementCache(object):
+    '''
+    LRU cache of the primary keys of small search results, shared by the
+    view class
+    :param  maxsize, The maximum number of results cached
+    :param  max_pks, Results with more rows are not cached
+    :param  timeout, The time to live of the results in seconds
+    '''
+    def __init__(self, maxsize=256, max_pks=1000, timeout=60):
+        self.maxsize = maxsize
+        self.max_pks = max_pks
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._watched = set()
+        self._lock = threading.Lock()
+
+    def get(self, scope, clauses):
+        '''
+        Find the smallest cached result the clauses refine or repeat
+        :param  scope, Hashable key of the search besides its clauses, eg.
+                the searcher class, database and view filters
+        :param  clauses, The canonical clauses of the query
+        :return (primary keys, added clauses) tuple, or None if missing
+        '''
+        clauseSet = frozenset(clauses)
+        now = time.monotonic()
+        found = None
+        with self._lock:
+            for key, (expires, _, pks) in list(self._entries.items()):
+                if expires < now:
+                    del self._entries[key]
+                elif key[0] == scope and key[1] <= clauseSet and (
+                        found is None or len(pks) < len(found[1])):
+                    found = (key, pks)
+
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(found[0])
+
+        cached = found[0][1]
+        return found[1], [clause for clause in clauses if clause not in cached]
+
+    def has(self, scope, clauses):
+        '''
+        Whether the result of the clauses is cached
+        '''
+        entry = self._entries.get((scope, frozenset(clauses)))
+        return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, scope, clauses, pks, models):
+        '''
+        Cache the primary keys of a whole result, if not over `max_pks`
+        :param  scope, Hashable key of the search besides its clauses
+        :param  clauses, The canonical clauses of the query
+        :param  pks, The primary keys of every row of the result
+        :param  models, The models the search reads, changes to them drop
+                the entry
+        '''
+        if len(pks) > self.max_pks:
+            return
+        models = frozenset(models)
+        self.watch(models)
+        key = (scope, frozenset(clauses))
+        with self._lock:
+            self._entries[key] = (
+                time.monotonic() + self.timeout, models, tuple(pks)
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self.stores += 1
+
+    def invalidate(self, model):
+        '''
+        Drop the results reading the model. Call it after changes sending
+        no signal, eg. `QuerySet.update()` or `bulk_create()`.
+        :param  model, The model class changed
+        '''
+        with self._lock:
+            for key, (_, models, _) in list(self._entries.items()):
+                if model in models:
+                    del self._entries[key]
+            self.invalidations += 1
+
+    def _on_change(self, sender, using=None, **kwargs):
+        if not kwargs.get('action', 'post_').startswith('post_'):
+            return
+        self.invalidate(sender)
+        # Results cached by other connections before the commit are dropped
+        transaction.on_commit(lambda: self.invalidate(sender), using=using)
+
+    def watch(self, models):
+        '''
+        Invalidate the models on `post_save`, `post_delete` and
+        `m2m_changed`, the receivers are weak
+        :param  models, Iterable of model classes
+        '''
+        for model in models:
+            if model in self._watched:
+                continue
+            for signal in (post_save, post_delete, m2m_changed):
+                signal.connect(self._on_change, sender=model)
+            with self._lock:
+                self._watched.add(model)
+
+    def stats(self):
+        '''
+        Return the cache counters of this process
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'stores': self.stores,
+                'invalidations': self.invalidations,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.stores = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar model relation helpers
+"""
+from __future__ import unicode_literals
+
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+
+
+def resolve_path(model, path):
+    '''
+    Walk a lookup path, eg. `author__name__icontains`, through the model meta
+    :param  model, The model class the path starts from
+    :param  path, The lookup path
+    :return (fields, lookups) tuple, `fields` are the model fields resolved
+            from the head of the path, `lookups` the remaining parts
+    '''
+    parts = path.split('__')
+    fields = []
+    opts = model._meta
+    for idx, part in enumerate(parts):
+        if opts is None:
+            return fields, parts[idx:]
+        if part == 'pk':
+            field = opts.pk
+        else:
+            try:
+                field = opts.get_field(part)
+            except FieldDoesNotExist:
+                return fields, parts[idx:]
+        fields.append(field)
+        if field.is_relation and field.related_model is not None:
+            opts = field.related_model._meta
+        else:
+            opts = None
+    return fields, []
+
+
+def is_field_path(model, path):
+    '''
+    Whether the path only walks model fields, without lookups
+    '''
+    fields, lookups = resolve_path(model, path)
+    return bool(fields) and not lookups
+
+
+@lru_cache(maxsize=None)
+def get_field_keys(model, mapping):
+    '''
+    Return the query keys mapped to model field paths only, not to lookups
+    like `publish_at__gte`
+    :param  model, The model class the paths start from
+    :param  mapping, Tuple of (key, tuple of paths) items of the mapping
+    :return frozenset of keys
+    '''
+    return frozenset(
+        key for key, paths in mapping
+        if all(is_field_path(model, path) for path in paths)
+    )
+
+
+def _is_single_valued(field):
+    # Forward foreign keys and one to one relations in both directions
+    return field.many_to_one or field.one_to_one
+
+
+def _get_accessor_name(field):
+    if field.auto_created and not field.concrete:
+        # Reverse relation
+        return field.get_accessor_name()
+    return field.name
+
+
+def _drop_prefixes(paths):
+    # `a` is implied by `a__b` for both select_related and prefetch_related
+    return tuple(sorted(
+        path for path in paths
+        if not any(other.startswith(path + '__') for other in paths)
+    ))
+
+
+@lru_cache(maxsize=None)
+def infer_related_lookups(model, paths):
+    '''
+    Classify the relations traversed by the lookup paths
+    :param  model, The model class the paths start from
+    :param  paths, Tuple of lookup paths
+    :return (select_related, prefetch_related) tuple of lookups, forward
+            foreign key and one to one relations are joined, reverse and many
+            to many relations are prefetched
+    '''
+    selects = set()
+    prefetches = set()
+    for path in paths:
+        fields, _ = resolve_path(model, path)
+        relations = []
+        multiValued = False
+        for field in fields:
+            if not field.is_relation or field.related_model is None:
+                break
+            relations.append(_get_accessor_name(field))
+            if not multiValued and _is_single_valued(field):
+                selects.add('__'.join(relations))
+            else:
+                multiValued = True
+        if multiValued:
+            prefetches.add('__'.join(relations))
+
+    return _drop_prefixes(selects), _drop_prefixes(prefetches)
+
+
+@lru_cache(maxsize=None)
+def get_related_models(model, paths):
+    '''
+    Get the models a search depends on
+    :param  model, The model class the paths start from
+    :param  paths, Tuple of lookup paths
+    :return frozenset of the model, the models traversed by the paths and
+            the through models of their many to many relations
+    '''
+    models = set([model])
+    for path in paths:
+        fields, _ = resolve_path(model, path)
+        for field in fields:
+            if not field.is_relation or field.related_model is None:
+                break
+            models.add(field.related_model)
+            if field.many_to_many:
+                # The relation changes are sent by the through model
+                if field.concrete:
+                    models.add(field.remote_field.through)
+                else:
+                    models.add(field.through)
+    return frozenset(models)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar search result cache
+
+The primary keys of a result page and its count are kept in a Django cache,
+keyed by the SQL of the search queryset, the page slice and the generation
+of every model the search depends on. A save, delete or many to many change
+of one of the models replaces its generation, so every cached page reading
+it is missed without scanning keys, the stale entries expire.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import threading
+import uuid
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+
+def get_row_pk(row):
+    '''
+    Primary key of a model instance, or of a dict from `values()`
+    '''
+    if isinstance(row, dict):
+        return row['pk']
+    return row.pk
+
+
+class ResultCache(object):
+    '''
+    Cache the result pages of a search in the Django cache `cache_alias`.
+    The pages are shared by the processes using the cache, so every process
+    writing to the models must send the invalidations: list the models in
+    `models`, or call `watch()` from `AppConfig.ready()`, to connect the
+    signals when the cache is created rather than on its first search.
+    Changes sending no signal, eg. `QuerySet.update()` or `bulk_create()`,
+    need a call to `invalidate()`.
+    :param  timeout, The time to live of the pages in seconds
+    :param  cache_alias, The Django cache to use
+    :param  key_prefix, The prefix of the cache keys
+    :param  max_rows, Pages larger than this are not cached
+    :param  models, Iterable of the model classes the searches depend on,
+            see `DjangoSearchMixin.get_result_cache_models`
+    '''
+    def __init__(self, timeout=300, cache_alias='default',
+                 key_prefix='djolar:results', max_rows=1000, models=()):
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.key_prefix = key_prefix
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._watched = set()
+        self._lock = threading.Lock()
+        self.watch(models)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_generation_key(self, model):
+        return '{}:gen:{}'.format(self.key_prefix, model._meta.label_lower)
+
+    def get_generations(self, models):
+        '''
+        Get the current generation of the models
+        :param  models, Iterable of model classes
+        :return Tuple of generations, in the order of the sorted model labels
+        '''
+        keys = sorted(self.get_generation_key(model) for model in models)
+        generations = self.cache.get_many(keys)
+        for key in keys:
+            if key not in generations:
+                # A new value, the previous one may have been evicted
+                self.cache.add(key, uuid.uuid4().hex, None)
+                generations[key] = self.cache.get(key)
+        return tuple(generations[key] for key in keys)
+
+    def invalidate(self, model):
+        '''
+        Start a new generation of the model, cached pages reading it are
+        missed from now on. Call it after changes sending no signal, eg.
+        `QuerySet.update()` or `bulk_create()`.
+        :param  model, The model class changed
+        '''
+        self.cache.set(self.get_generation_key(model), uuid.uuid4().hex, None)
+        with self._lock:
+            self.invalidations += 1
+
+    def _on_change(self, sender, using=None, **kwargs):
+        if not kwargs.get('action', 'post_').startswith('post_'):
+            return
+        self.invalidate(sender)
+        # Pages cached by other connections before the commit are dropped
+        transaction.on_commit(lambda: self.invalidate(sender), using=using)
+
+    def watch(self, models):
+        '''
+        Invalidate the models on `post_save`, `post_delete` and, for many to
+        many through models, `m2m_changed`. The receivers are weak, they
+        are disconnected when the cache is garbage collected.
+        :param  models, Iterable of model classes
+        '''
+        for model in models:
+            if model in self._watched:
+                continue
+            for signal in (post_save, post_delete, m2m_changed):
+                signal.connect(self._on_change, sender=model)
+            with self._lock:
+                self._watched.add(model)
+
+    def get_cache_key(self, queryset, offset, limit, generations):
+        '''
+        Get the cache key of a page, the SQL holds the filters added by the
+        view and the normalized `q` and `s`
+        '''
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.sha1('{}|{}|{!r}|{}|{}|{}'.format(
+            queryset.db, sql, params, offset, limit, ','.join(generations)
+        ).encode('utf-8')).hexdigest()
+        return '{}:page:{}'.format(self.key_prefix, digest)
+
+    def get(self, key):
+        '''
+        Get a cached page
+        :param  key, The page cache key
+        :return (count tuple, primary keys) tuple, or None if missing
+        '''
+        page = self.cache.get(key)
+        with self._lock:
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return page
+
+    def set(self, key, count, pks):
+        '''
+        Cache a page
+        :param  key, The page cache key
+        :param  count, The `SearchCount` of the search
+        :param  pks, The primary keys of the page rows, in order
+        '''
+        self.cache.set(key, (tuple(count), list(pks)), self.timeout)
+
+    def get_rows(self, queryset, pks):
+        '''
+        Fetch the rows of a cached page, by primary key
+        :param  queryset, The search queryset
+        :param  pks, The primary keys of the page rows, in order
+        :return List of model instances
+        '''
+        if not pks:
+            return []
+        rows = dict(
+            (get_row_pk(row), row)
+            for row in queryset.filter(pk__in=pks).order_by()
+        )
+        return [rows[pk] for pk in pks if pk in rows]
+
+    def stats(self):
+        '''
+        Return the cache counters of this process
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar read replica routing
+
+`DjangoSearchMixin.search_replicas` picks the database alias of each
+search with a selector. Requests marked with `mark_read_primary`, eg. right
+after the client wrote, read from the primary so they see their writes.
+"""
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+
+import itertools
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+
+
+# Session key holding the time until which the client reads the primary
+READ_PRIMARY_SESSION_KEY = 'djolar_read_primary_until'
+
+
+def mark_read_primary(request, seconds=5):
+    '''
+    Make the searches of this request, and of the session for `seconds`,
+    read from the primary database
+    :param  request, The request that wrote
+    :param  seconds, How long the session reads the primary, covering the
+            replication lag
+    '''
+    request.djolar_read_primary = True
+    session = getattr(request, 'session', None)
+    if session is not None and seconds:
+        session[READ_PRIMARY_SESSION_KEY] = time.time() + seconds
+
+
+def should_read_primary(request):
+    '''
+    Whether the request is marked to read from the primary database
+    '''
+    if getattr(request, 'djolar_read_primary', False):
+        return True
+    session = getattr(request, 'session', None)
+    if session is None:
+        return False
+    return session.get(READ_PRIMARY_SESSION_KEY, 0) > time.time()
+
+
+async def ashould_read_primary(request):
+    '''
+    Async version of `should_read_primary`, a database backed session is
+    loaded in a thread
+    '''
+    if getattr(request, 'djolar_read_primary', False):
+        return True
+    session = getattr(request, 'session', None)
+    if session is None:
+        return False
+    until = await sync_to_async(session.get)(READ_PRIMARY_SESSION_KEY, 0)
+    return until > time.time()
+
+
+class ReplicaSelector(object):
+    '''
+    Base class of the replica selectors, shared by the views of a process
+    :param  aliases, The database aliases of the replicas
+    '''
+    def __init__(self, aliases):
+        assert aliases, 'aliases should not be empty'
+        self.aliases = tuple(aliases)
+        self._lock = threading.Lock()
+
+    def select(self):
+        '''
+        Return the database alias for a search
+        '''
+        raise NotImplementedError
+
+    @contextmanager
+    def track(self, alias):
+        '''
+        Wrap the queries of a search on the selected alias
+        '''
+        yield
+
+
+class RoundRobinReplicas(ReplicaSelector):
+    '''
+    Use the replicas in turn
+    '''
+    def __init__(self, aliases):
+        super(RoundRobinReplicas, self).__init__(aliases)
+        self._cycle = itertools.cycle(self.aliases)
+
+    def select(self):
+        with self._lock:
+            return next(self._cycle)
+
+
+class LeastLoadedReplicas(ReplicaSelector):
+    '''
+    Use the replica running the fewest searches of this process, the first
+    one on ties
+    '''
+    def __init__(self, aliases):
+        super(LeastLoadedReplicas, self).__init__(aliases)
+        self.running = dict((alias, 0) for alias in self.aliases)
+
+    def select(self):
+        with self._lock:
+            return min(self.aliases, key=lambda alias: self.running[alias])
+
+    @contextmanager
+    def track(self, alias):
+        if alias not in self.running:
+            # The primary
+            yield
+            return
+        with self._lock:
+            self.running[alias] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.running[alias] -= 1
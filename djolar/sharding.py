@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar sharded search
+
+A table split across database aliases is searched on every alias with the
+same queryset. Each shard returns its first `offset + limit` rows in the
+search order, the global page is read from their k-way merge.
+"""
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+
+import heapq
+import itertools
+
+from django.db import connections
+
+from .pagination import get_ordering_values
+
+
+class _Descending(object):
+    '''
+    Invert the order of a sort key
+    '''
+    __slots__ = ('key', )
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def get_merge_key(orderBy, nullsLargest=False):
+    '''
+    Get the sort key of the rows of a search
+    :param  orderBy, The order by fields, `-field` descending
+    :param  nullsLargest, Whether the database sorts NULL after the values,
+            see `connection.features.nulls_order_largest`
+    :return Function of a row returning its sort key
+    '''
+    descending = [field.startswith('-') for field in orderBy]
+
+    def key(row):
+        values = []
+        for value, desc in zip(get_ordering_values(row, orderBy), descending):
+            # NULL compares through its rank only
+            fieldKey = (int((value is None) == nullsLargest), value)
+            values.append(_Descending(fieldKey) if desc else fieldKey)
+        return tuple(values)
+
+    return key
+
+
+def merge_pages(pages, orderBy, offset=0, limit=None, nullsLargest=False):
+    '''
+    Merge the sorted rows of the shards and slice the global page
+    :param  pages, The rows of every shard, each in the search order
+    :param  orderBy, The order by fields
+    :param  offset, The index of the first row
+    :param  limit, The maximum number of rows, by default every row
+    :return List of rows
+    '''
+    merged = heapq.merge(
+        *pages, key=get_merge_key(orderBy, nullsLargest)
+    )
+    end = None if limit is None else offset + limit
+    return list(itertools.islice(merged, offset, end))
+
+
+def search_shards(search, aliases, workers=None):
+    '''
+    Run a search function on every shard concurrently, in a thread pool.
+    The connections opened by the threads are closed.
+    :param  search, Function of the database alias
+    :param  aliases, The database aliases of the shards
+    :param  workers, The number of threads, one by shard by default
+    :return List of the results, in the order of the aliases
+    '''
+    def run(alias):
+        try:
+            return search(alias)
+        finally:
+            connections[alias].close()
+
+    with ThreadPoolExecutor(max_workers=workers or len(aliases)) as pool:
+        return list(pool.map(run, aliases))
@@ -0,0 +1,479 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar SQL templates
+
+Searches of the same shape, the same query keys, operators, ordering and
+`in` list sizes rounded up to a power of two, only differ by their values.
+`SQLTemplateCache` builds the queryset of a shape once; later searches of
+the shape clone it and rebind the values of its WHERE lookups, skipping
+the lookup and join resolution of `filter()`. The compiled SQL of the
+template queries is cached too: a later query only compiles its WHERE
+lookups to get the new parameters, shorter `in` lists repeat their last
+value to fill the parameters of the template.
+
+Shapes the template can not be matched with, eg. lookups traversing
+multi-valued relations, are built and compiled by Django as usual.
+
+Templates rely on Django internals, the WHERE tree of `Query`, the compiler
+attributes read by the result iterators and `QuerySet._chain()`. They are
+only used with the Django versions in `SUPPORTED_DJANGO_VERSIONS`, the
+versions djolar is tested with; other versions build every search.
+"""
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+from functools import partial
+
+import threading
+
+import django
+
+# `FullResultSet` is new in Django 4.2, the minimum version of djolar
+from django.core.exceptions import EmptyResultSet, FullResultSet
+from django.db.models import Q
+from django.db.models.sql.query import Query
+from django.db.models.sql.where import WhereNode
+
+
+# Compiled SQL variants kept by template, eg. the page and count queries
+MAX_STATEMENTS = 8
+
+# First and last Django feature releases the templates are tested with
+SUPPORTED_DJANGO_VERSIONS = ((4, 2), (5, 2))
+
+# Marks the shapes the template can not be matched with
+_UNSUPPORTED = object()
+
+
+def is_supported_django():
+    '''
+    Whether the running Django version is in `SUPPORTED_DJANGO_VERSIONS`
+    '''
+    first, last = SUPPORTED_DJANGO_VERSIONS
+    return first <= tuple(django.VERSION[:2]) <= last
+
+
+def get_arity_bucket(size):
+    '''
+    Round a list size up to a power of two
+    '''
+    return 1 << (size - 1).bit_length()
+
+
+def get_q_shape(queryObj, values):
+    '''
+    Get the shape of a Q object, its structure without the values
+    :param  queryObj, The search Q object
+    :param  values, List the leaf values are appended to, in order
+    :return Hashable shape, or None if a value can not be rebound, eg. an
+            expression or None
+    '''
+    children = []
+    for child in queryObj.children:
+        if isinstance(child, Q):
+            shape = get_q_shape(child, values)
+            if shape is None:
+                return None
+        elif isinstance(child, tuple):
+            lookup, value = child
+            if isinstance(value, (list, tuple)):
+                if not value or any(
+                        hasattr(item, 'resolve_expression') for item in value):
+                    return None
+                shape = (lookup, list, get_arity_bucket(len(value)))
+            elif value is None or value == '' or \
+                    hasattr(value, 'resolve_expression'):
+                return None
+            else:
+                shape = (lookup, type(value))
+            values.append(value)
+        else:
+            return None
+        children.append(shape)
+    return (queryObj.connector, queryObj.negated, tuple(children))
+
+
+def _iter_leaves(node, path=()):
+    for idx, child in enumerate(node.children):
+        if isinstance(child, WhereNode):
+            for leaf in _iter_leaves(child, path + (idx, )):
+                yield leaf
+        else:
+            yield path + (idx, ), child
+
+
+def _get_leaf(node, path):
+    for idx in path:
+        node = node.children[idx]
+    return node
+
+
+def _get_where_shape(node):
+    return (node.connector, node.negated, tuple(
+        _get_where_shape(child) if isinstance(child, WhereNode)
+        else type(child) for child in node.children
+    ))
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _freeze(item)) for key, item in value.items()
+        ))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def get_query_state(query):
+    '''
+    Get the state of a query besides its WHERE values, the compiled SQL of
+    a template is reused for queries in the same state
+    '''
+    return (
+        query.low_mark, query.high_mark, query.order_by,
+        query.extra_order_by, query.default_ordering, query.default_cols,
+        query.select, _freeze(query.annotation_select),
+        _freeze(query.extra_select),
+        query.values_select, query.distinct, query.distinct_fields,
+        _freeze(query.select_related), _freeze(query.deferred_loading),
+        _freeze(query.group_by), query.combinator, query.select_for_update,
+        query.select_for_update_of, query.subquery, query.explain_info,
+        tuple(query.alias_map), _get_where_shape(query.where),
+    )
+
+
+def get_base_state(queryset):
+    '''
+    Get the key of a base search queryset, including the values of its
+    filters, eg. a queryset filtered by user gets a template by user
+    :return Hashable key, or None if the queryset can not be templated
+    '''
+    query = queryset.query
+    leaves = []
+    for path, leaf in _iter_leaves(query.where):
+        rhs = getattr(leaf, 'rhs', None)
+        if hasattr(rhs, 'resolve_expression') or not hasattr(leaf, 'lhs'):
+            return None
+        if isinstance(rhs, list):
+            rhs = tuple(rhs)
+        leaves.append((type(leaf), leaf.lhs, rhs))
+    try:
+        state = (
+            queryset.db, queryset.model, queryset._iterable_class,
+            tuple(leaves), get_query_state(query),
+            tuple(queryset._prefetch_related_lookups),
+        )
+        hash(state)
+    except TypeError:
+        return None
+    return state
+
+
+class _Statement(object):
+    '''
+    Compiled SQL of a template query, with the position of the WHERE
+    parameters and the compiler state read back by the result iterators
+    '''
+    def __init__(self, compiler, sql, params, leaves, start):
+        self.sql = sql
+        self.leaves = leaves
+        self.prefix = tuple(params[:start])
+        self.suffix = tuple(params[start + sum(
+            count for path, leafSql, count in leaves
+        ):])
+        self.select = compiler.select
+        self.klass_info = compiler.klass_info
+        self.annotation_col_map = compiler.annotation_col_map
+        self.col_count = compiler.col_count
+        self.has_extra_select = compiler.has_extra_select
+
+    @classmethod
+    def create(cls, compiler, sql, params):
+        '''
+        Locate the WHERE parameters in the compiled parameters
+        :return `_Statement`, or None if they can not be located
+        '''
+        if compiler.where is None:
+            return None
+        leaves = []
+        whereParams = []
+        try:
+            for path, leaf in _iter_leaves(compiler.query.where):
+                leafSql, leafParams = compiler.compile(leaf)
+                leaves.append((path, leafSql, len(leafParams)))
+                whereParams.extend(leafParams)
+            if compiler.compile(compiler.where)[1] != whereParams:
+                return None
+        except (EmptyResultSet, FullResultSet):
+            return None
+
+        params = list(params)
+        size = len(whereParams)
+        starts = [
+            start for start in range(len(params) - size + 1)
+            if params[start:start + size] == whereParams
+        ] if size else [len(params)]
+        if len(starts) != 1:
+            return None
+        return cls(compiler, sql, params, leaves, starts[0])
+
+    def bind(self, compiler):
+        '''
+        Get the parameters of a query for this SQL
+        :return List of parameters, or None if a lookup compiles into
+                another SQL
+        '''
+        params = list(self.prefix)
+        for path, leafSql, count in self.leaves:
+            leaf = _get_leaf(compiler.query.where, path)
+            try:
+                sql, leafParams = compiler.compile(leaf)
+            except (EmptyResultSet, FullResultSet):
+                return None
+            if sql != leafSql:
+                # Shorter `in` lists fill the template placeholders
+                if getattr(leaf, 'lookup_name', None) != 'in' or \
+                        not 0 < len(leafParams) < count:
+                    return None
+                leafParams = list(leafParams)
+                leafParams += leafParams[-1:] * (count - len(leafParams))
+            elif len(leafParams) != count:
+                return None
+            params.extend(leafParams)
+        params.extend(self.suffix)
+
+        compiler.select = self.select
+        compiler.klass_info = self.klass_info
+        compiler.annotation_col_map = self.annotation_col_map
+        compiler.col_count = self.col_count
+        compiler.has_extra_select = self.has_extra_select
+        return params
+
+
+class SQLTemplate(object):
+    '''
+    The search queryset of a shape, with the paths of the WHERE lookups
+    matching the Q object values, and its compiled SQL statements
+    '''
+    def __init__(self, queryset, paths, cache):
+        self.queryset = queryset
+        self.paths = paths
+        self.cache = cache
+        self.statements = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, queryset, base, queryObj, cache):
+        '''
+        Match the WHERE lookups of the search queryset with the Q object
+        :return `SQLTemplate`, or None if they do not match
+        '''
+        lookups = []
+        cls._get_lookups(queryObj, lookups)
+        skip = len(list(_iter_leaves(base.query.where)))
+
+        paths = []
+        for path, leaf in list(_iter_leaves(queryset.query.where))[skip:]:
+            if not lookups:
+                return None
+            lookupName = getattr(leaf, 'lookup_name', None)
+            expected = lookups[0].split('__')
+            if expected[-1] == lookupName and len(expected) > 1:
+                expected.pop()
+            elif lookupName != 'exact':
+                # `exclude()` on nullable fields adds an `isnull` lookup
+                if lookupName == 'isnull':
+                    continue
+                return None
+            target = getattr(getattr(leaf, 'lhs', None), 'target', None)
+            if target is None or target.name != expected[-1] or \
+                    hasattr(leaf.rhs, 'resolve_expression'):
+                return None
+            lookups.pop(0)
+            paths.append(path)
+        if lookups:
+            return None
+
+        # The template keeps a clone, the rows of the returned queryset
+        # are not shared
+        template = cls(queryset._chain(), tuple(paths), cache)
+        for query in (queryset.query, template.queryset.query):
+            query.__class__ = TemplateQuery
+            query.sql_template = template
+        return template
+
+    @classmethod
+    def _get_lookups(cls, queryObj, lookups):
+        for child in queryObj.children:
+            if isinstance(child, Q):
+                cls._get_lookups(child, lookups)
+            else:
+                lookups.append(child[0])
+
+    def bind(self, values):
+        '''
+        Clone the template queryset with other values
+        :param  values, The Q object values, in order
+        :return QuerySet
+        '''
+        queryset = self.queryset._chain()
+        where = queryset.query.where
+        for path, value in zip(self.paths, values):
+            parent = _get_leaf(where, path[:-1])
+            leaf = parent.children[path[-1]]
+            parent.children[path[-1]] = type(leaf)(leaf.lhs, value)
+        return queryset
+
+    def as_sql(self, compiler, compile, with_limits=True,
+               with_col_aliases=False):
+        '''
+        Replace `as_sql` of the compilers of the template queries
+        '''
+        try:
+            key = (
+                with_limits, with_col_aliases, compiler.connection.alias,
+                compiler.elide_empty, get_query_state(compiler.query),
+            )
+            hash(key)
+        except TypeError:
+            return compile(
+                with_limits=with_limits, with_col_aliases=with_col_aliases
+            )
+
+        statement = self.statements.get(key)
+        if statement is not None:
+            params = statement.bind(compiler)
+            if params is not None:
+                self.cache._count('statement_hits')
+                return statement.sql, tuple(params)
+
+        sql, params = compile(
+            with_limits=with_limits, with_col_aliases=with_col_aliases
+        )
+        statement = _Statement.create(compiler, sql, params)
+        if statement is not None:
+            with self._lock:
+                self.statements[key] = statement
+                while len(self.statements) > MAX_STATEMENTS:
+                    self.statements.popitem(last=False)
+        return sql, params
+
+
+class TemplateQuery(Query):
+    '''
+    Query of a template queryset, its compilers reuse the compiled SQL
+    '''
+    sql_template = None
+
+    def get_compiler(self, using=None, connection=None, elide_empty=True):
+        compiler = super(TemplateQuery, self).get_compiler(
+            using, connection, elide_empty
+        )
+        if self.sql_template is not None:
+            compiler.as_sql = partial(
+                self.sql_template.as_sql, compiler, compiler.as_sql
+            )
+        return compiler
+
+
+class SQLTemplateCache(object):
+    '''
+    Bounded LRU cache of the SQL templates by query shape, safe to share
+    between threads. Set it on `DjangoSearchMixin.sql_templates`.
+    '''
+    def __init__(self, maxsize=256):
+        assert isinstance(maxsize, int) and maxsize > 0, \
+            'maxsize should be a positive integer'
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.statement_hits = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _get(self, key):
+        with self._lock:
+            template = self._data.get(key)
+            if template is not None:
+                self._data.move_to_end(key)
+            return template
+
+    def _set(self, key, template):
+        with self._lock:
+            self._data[key] = template
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_queryset(self, base, queryObj, key, build, state=None):
+        '''
+        Get the search queryset from the template of its shape
+        :param  base, The queryset searched
+        :param  queryObj, The search Q object
+        :param  key, Hashable key of the other settings of the queryset,
+                eg. the ordering
+        :param  build, Function building the search queryset
+        :param  state, The `get_base_state` of the base queryset, computed
+                if None
+        :return QuerySet
+        '''
+        if not is_supported_django():
+            self._count('fallbacks')
+            return build()
+
+        values = []
+        shape = get_q_shape(queryObj, values)
+        if state is None:
+            state = get_base_state(base)
+        if shape is None or state is None:
+            self._count('fallbacks')
+            return build()
+
+        cacheKey = (state, shape, key)
+        template = self._get(cacheKey)
+        if template is _UNSUPPORTED:
+            self._count('fallbacks')
+            return build()
+        if template is not None:
+            self._count('hits')
+            return template.bind(values)
+
+        self._count('misses')
+        queryset = build()
+        template = SQLTemplate.create(queryset, base, queryObj, self)
+        self._set(cacheKey, _UNSUPPORTED if template is None else template)
+        return queryset
+
+    def clear(self):
+        '''
+        Remove all templates and reset the counters
+        '''
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.fallbacks = 0
+            self.statement_hits = 0
+
+    def stats(self):
+        '''
+        Return the cache counters
+        '''
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'fallbacks': self.fallbacks,
+                'statement_hits': self.statement_hits,
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar search time budgets
+
+A `SearchDeadline` bounds the whole search, parse, count and fetch, and
+`statement_timeout` makes the database stop a query once the budget is
+spent instead of running it to the end:
+
+* PostgreSQL, `statement_timeout` set for the transaction of the query
+* SQLite, a progress handler interrupting the statement
+* other databases, the deadline is only checked between the steps
+"""
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+
+import time
+
+from django.db import OperationalError, connections, transaction
+
+from .exceptions import SearchTimeout
+
+
+# SQLite virtual machine instructions between two checks of the clock
+SQLITE_PROGRESS_STEPS = 1000
+
+# SQLSTATE of `query_canceled`, raised when `statement_timeout` is reached
+_QUERY_CANCELED = '57014'
+
+
+class SearchDeadline(object):
+    '''
+    The time budget of a search, started when it is created
+    '''
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        '''
+        Return the seconds left, 0 once expired
+        '''
+        return max(self.expires - time.monotonic(), 0.0)
+
+    def check(self, phase):
+        '''
+        Raise `SearchTimeout` if the budget is spent
+        :param  phase, The step of the search about to run, or which ran
+        '''
+        if self.remaining() <= 0:
+            raise SearchTimeout(
+                'The search is too expensive',
+                timeout=self.seconds, phase=phase
+            )
+
+
+def is_timeout_error(connection, error):
+    '''
+    Whether a database error is a query stopped by `statement_timeout`
+    '''
+    if connection.vendor == 'postgresql':
+        cause = error.__cause__
+        # psycopg2 `pgcode`, psycopg 3 `sqlstate`
+        code = getattr(cause, 'pgcode', None) or \
+            getattr(cause, 'sqlstate', None)
+        return code == _QUERY_CANCELED
+    if connection.vendor == 'sqlite':
+        return str(error) == 'interrupted'
+    return False
+
+
+@contextmanager
+def _postgresql_timeout(connection, alias, seconds):
+    # `set_config(..., true)` lasts until the end of the transaction, the
+    # previous value is restored when the block runs in an outer one
+    outer = connection.in_atomic_block
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        if outer:
+            cursor.execute("SELECT current_setting('statement_timeout')")
+            previous = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT set_config('statement_timeout', %s, true)",
+            ['{}ms'.format(max(int(seconds * 1000), 1))]
+        )
+        yield
+        if outer:
+            cursor.execute(
+                "SELECT set_config('statement_timeout', %s, true)",
+                [previous]
+            )
+
+
+@contextmanager
+def _sqlite_timeout(connection, seconds):
+    expires = time.monotonic() + seconds
+    connection.ensure_connection()
+    database = connection.connection
+    # A true result interrupts the running statement
+    database.set_progress_handler(
+        lambda: time.monotonic() > expires, SQLITE_PROGRESS_STEPS
+    )
+    try:
+        yield
+    finally:
+        database.set_progress_handler(None, SQLITE_PROGRESS_STEPS)
+
+
+@contextmanager
+def statement_timeout(alias, seconds, phase):
+    '''
+    Stop the queries of the block running on a database alias after some
+    seconds, and raise `SearchTimeout` instead of the database error
+    :param  alias, The database alias of the queries
+    :param  seconds, The time the block may spend in the database
+    :param  phase, The step of the search, reported by `SearchTimeout`
+    '''
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        limit = _postgresql_timeout(connection, alias, seconds)
+    elif connection.vendor == 'sqlite':
+        limit = _sqlite_timeout(connection, seconds)
+    else:
+        yield
+        return
+
+    try:
+        with limit:
+            yield
+    except OperationalError as error:
+        if not is_timeout_error(connection, error):
+            raise
+        raise SearchTimeout(
+            'The search is too expensive', timeout=seconds, phase=phase
+        ) from error
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Djolar query clause tokenizer
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+
+import re
+
+
+Operator = namedtuple(
+    'Operator', ['name', 'lookup', 'ilookup', 'is_list', 'negated']
+)
+
+# Operator table, `lookup` is the format used to build the Q field name,
+# `ilookup` is used instead when the searcher ignores case.
+OPERATORS = {
+    'co': Operator('co', '{}__contains', '{}__icontains', False, False),
+    'lt': Operator('lt', '{}__lt', '{}__lt', False, False),
+    'gt': Operator('gt', '{}__gt', '{}__gt', False, False),
+    'lte': Operator('lte', '{}__lte', '{}__lte', False, False),
+    'gte': Operator('gte', '{}__gte', '{}__gte', False, False),
+    'eq': Operator('eq', '{}', '{}', False, False),
+    'in': Operator('in', '{}__in', '{}__in', True, False),
+    'ni': Operator('ni', '{}__in', '{}__in', True, True),
+    'fts': Operator('fts', '{}__fts', '{}__fts', False, False),
+}
+
+# When a clause contains more than one operator token, the first operator
+# in this order wins.
+OPERATOR_PRIORITY = (
+    'co', 'lt', 'gt', 'lte', 'gte', 'eq', 'in', 'ni', 'fts'
+)
+
+# The greedy key makes this match the right most operator token
+_CLAUSE_RE = re.compile(r'(\w+)__(co|lte|lt|gte|gt|eq|in|ni|fts)__(\S*)')
+_WORD_RE = re.compile(r'\w+')
+_OPERATOR_RE = re.compile(r'(?=__(co|lte|lt|gte|gt|eq|in|ni|fts)__)')
+_VALUE_RE = re.compile(r'\S*')
+
+
+def _read_value(operator, value):
+    '''
+    Extract the operator value from the non blank text following the operator
+    :param  operator, The operator
+    :param  value, The text right after the operator token up to a blank
+    :return The raw value, or None if the operator can not take this value
+    '''
+    if not operator.is_list:
+        return value or None
+    if not value.startswith('['):
+        return None
+    close = value.rfind(']')
+    if close < 2:
+        return None
+    return value[1:close]
+
+
+def _split_value(operator, value):
+    if operator.is_list:
+        return [i.strip() for i in value.split(',')]
+    return value
+
+
+def _tokenize_ambiguous(clause):
+    '''
+    Tokenize a clause whose key may contain other operator tokens, the first
+    valid operator in `OPERATOR_PRIORITY` wins
+    '''
+    word = _WORD_RE.match(clause).group()
+
+    # Keep the right most valid position for each operator, the key is the
+    # longest prefix followed by the operator token
+    found = {}
+    for match in _OPERATOR_RE.finditer(word, 1):
+        operator = OPERATORS[match.group(1)]
+        end = match.start() + len(operator.name) + 4
+        value = _read_value(operator, _VALUE_RE.match(clause, end).group())
+        if value is not None:
+            found[operator.name] = (match.start(), value)
+
+    for name in OPERATOR_PRIORITY:
+        if name in found:
+            start, value = found[name]
+            operator = OPERATORS[name]
+            return word[:start], operator, _split_value(operator, value)
+
+
+def tokenize(clause):
+    '''
+    Split a single clause into key, operator and value in one pass
+    :param  clause, The clause string, eg. `key__co__value`
+    :return (key, Operator, value) tuple, or None if the clause is invalid.
+            The value of `in`/`ni` operators is a list of stripped strings.
+    '''
+    match = _CLAUSE_RE.match(clause)
+    if not match:
+        return None
+
+    key, name, value = match.groups()
+    if '__' in key or key.endswith('_'):
+        # Another operator token may hide in the key
+        return _tokenize_ambiguous(clause)
+
+    operator = OPERATORS[name]
+    if not operator.is_list:
+        return (key, operator, value) if value else None
+    value = _read_value(operator, value)
+    if value is None:
+        return None
+    return key, operator, _split_value(operator, value)
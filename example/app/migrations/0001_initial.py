@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Author',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='name of the author')),
+                ('age', models.IntegerField(verbose_name='age')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Book',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='name of the book')),
+                ('publish_at', models.DateTimeField(verbose_name='publish date')),
+                ('status', models.CharField(max_length=10, verbose_name='status of the book')),
+                ('createDate', models.DateTimeField(auto_now=True, verbose_name='create at')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.author')),
+            ],
+        ),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+
+# Full text index of `Book.name` for the djolar `fts` operator: a GIN
+# expression index on PostgreSQL, an FTS5 external content table kept in
+# sync by triggers on SQLite
+POSTGRESQL_FORWARD = [
+    "CREATE INDEX app_book_name_fts ON app_book "
+    "USING GIN (to_tsvector('english', name))",
+]
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX IF EXISTS app_book_name_fts',
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE app_book_fts USING fts5("
+    "name, content='app_book', content_rowid='id', "
+    "tokenize='porter unicode61')",
+    "CREATE TRIGGER app_book_fts_insert AFTER INSERT ON app_book BEGIN "
+    "INSERT INTO app_book_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER app_book_fts_delete AFTER DELETE ON app_book BEGIN "
+    "INSERT INTO app_book_fts(app_book_fts, rowid, name) "
+    "VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER app_book_fts_update AFTER UPDATE ON app_book BEGIN "
+    "INSERT INTO app_book_fts(app_book_fts, rowid, name) "
+    "VALUES ('delete', old.id, old.name); "
+    "INSERT INTO app_book_fts(rowid, name) VALUES (new.id, new.name); END",
+    "INSERT INTO app_book_fts(app_book_fts) VALUES ('rebuild')",
+]
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS app_book_fts_insert',
+    'DROP TRIGGER IF EXISTS app_book_fts_delete',
+    'DROP TRIGGER IF EXISTS app_book_fts_update',
+    'DROP TABLE IF EXISTS app_book_fts',
+]
+
+
+def run_statements(postgresql, sqlite):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        statements = {'postgresql': postgresql, 'sqlite': sqlite}
+        for sql in statements.get(vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements(POSTGRESQL_FORWARD, SQLITE_FORWARD),
+            run_statements(POSTGRESQL_BACKWARD, SQLITE_BACKWARD),
+        ),
+    ]
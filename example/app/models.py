@@ -8,7 +8,7 @@ class Author(models.Model):
 class Book(models.Model):
     name = models.CharField('name of the book', max_length=100)
     publish_at = models.DateTimeField('publish date')
-    author = models.ForeignKey(Author)
+    author = models.ForeignKey(Author, on_delete=models.CASCADE)
     status = models.CharField('status of the book', max_length=10)
     createDate = models.DateTimeField('create at', auto_now=True)
 
@@ -1,7 +1,54 @@
-from djolar.parser import DjangoSearchParser
-from django.test import TestCase
+import datetime
+import json
+import time
+
+from urllib.parse import urlencode
+
+from unittest import mock, skipUnless
+
+from djolar.cache import SearchCache
+from djolar.counting import CachedCount, EstimatedCount, HasNextCount
+from djolar.exceptions import (
+    InvalidCursor,
+    InvalidSearchExpression,
+    InvalidSearchValue,
+    SearchRejected,
+    SearchTimeout,
+)
+from djolar.fulltext import FullText, FullTextQuery
+from djolar.guard import parse_postgresql_explain
+from djolar import inlist, memory, templates
+from djolar.expression import FALSE, TRUE
+from djolar.instrumentation import (
+    SearchCollector,
+    SignalCollector,
+    SlowSearchLog,
+    search_completed,
+)
+from djolar.mixins import AsyncDjangoSearchMixin, DjangoSearchMixin
+from djolar.pagination import encode_cursor
+from djolar.parser import ClassFactory, DjangoSearchParser
+from djolar.refinement import RefinementCache
+from djolar.relations import get_related_models, infer_related_lookups
+from djolar.results import ResultCache
+from djolar.templates import SQLTemplateCache
+from djolar.routing import (
+    READ_PRIMARY_SESSION_KEY,
+    LeastLoadedReplicas,
+    RoundRobinReplicas,
+    mark_read_primary,
+)
+from djolar.sharding import merge_pages
+from djolar.timeouts import statement_timeout
+from djolar.tokenizer import tokenize
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Case, F, Q, When
+from django.test import RequestFactory, TestCase, TransactionTestCase
 from django.http.request import QueryDict
 
+from .models import Author, Book
+
 
 class TestDjangoSearchParser(TestCase):
 
@@ -230,3 +277,1599 @@ class TestDjangoSearchParserSorting(TestCase):
             QueryDict('q=st__lt__submitted&s=')
         )
         self.assertEqual(set(s), set(['pk']))
+
+
+class TestTokenizer(TestCase):
+
+    def testTokenize(self):
+        k, operator, v = tokenize('st__co__sub__eq__mitted')
+        self.assertEqual(
+            (k, operator.name, v), ('st', 'co', 'sub__eq__mitted')
+        )
+
+        # The operator with higher priority wins, the key is greedy
+        k, operator, v = tokenize('a__eq__b__co__c')
+        self.assertEqual((k, operator.name, v), ('a__eq__b', 'co', 'c'))
+
+        k, operator, v = tokenize('st__in__[v1,v2] [v3]')
+        self.assertEqual((k, operator.name, v), ('st', 'in', ['v1', 'v2']))
+
+        k, operator, v = tokenize('st__ni__[v1,v2]]x')
+        self.assertEqual((k, operator.name, v), ('st', 'ni', ['v1', 'v2]']))
+
+        self.assertIsNone(tokenize(''))
+        self.assertIsNone(tokenize('st:'))
+        self.assertIsNone(tokenize('st__eq__'))
+        self.assertIsNone(tokenize('st__in__[]'))
+        self.assertIsNone(tokenize('st__in__[ v1]'))
+        self.assertIsNone(tokenize('s-t__eq__v'))
+
+
+class TestSearchPlan(TestCase):
+
+    def testInvalidSearcherFailsOnClassCreation(self):
+        with self.assertRaises(ValueError):
+            class InvalidMappingSearcher(DjangoSearchParser):
+                query_mapping = {'st': 1}
+
+        with self.assertRaises(AssertionError):
+            class InvalidDefaultSearcher(DjangoSearchParser):
+                query_mapping = {'st': 'status'}
+                default_search = ['status']
+
+    def testPlanLookups(self):
+        class CustomSearcher(DjangoSearchParser):
+            query_mapping = {'st': ['product_status', 'status']}
+            ignore_case = False
+
+        plan = CustomSearcher._search_plan
+        self.assertEqual(
+            plan.lookups['st']['co'],
+            ('product_status__contains', 'status__contains')
+        )
+        self.assertEqual(
+            plan.lookups['st']['ni'], ('product_status__in', 'status__in')
+        )
+        self.assertIs(CustomSearcher().get_search_plan(), plan)
+
+    def testClassFactorySearcher(self):
+        Searcher = ClassFactory('BookClass', ['query_mapping'])
+        searcher = Searcher(query_mapping={'st': 'status'})
+        q = searcher.get_query_fields(QueryDict('q=st__co__aaa'))
+        self.assertEqual(q, Q(status__icontains='aaa'))
+
+
+class TestSearchCache(TestCase):
+
+    class CachedSearcher(DjangoSearchParser):
+        query_mapping = {
+            'st': 'status',
+            'n': 'name',
+        }
+        default_search = {
+            'name__eq': 'abc'
+        }
+        cache_size = 4
+
+    def setUp(self):
+        self.CachedSearcher.get_search_cache().clear()
+        self.searcher = self.CachedSearcher()
+
+    def testQueryCache(self):
+        cache = self.CachedSearcher.get_search_cache()
+        q1 = self.searcher.get_query_fields(QueryDict('q=st__co__aaa'))
+        q2 = self.CachedSearcher().get_query_fields(
+            QueryDict('q=st__co__aaa|')
+        )
+        self.assertIs(q1, q2)
+        self.assertEqual(q1, Q(status__icontains='aaa'))
+
+        # Default search is never cached
+        self.searcher.get_query_fields(QueryDict(''))
+        stats = cache.stats()
+        # The raw and canonical entries are missed once, the raw one hit
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+
+        # An equivalent query is parsed once, then shares the Q object
+        with mock.patch.object(
+            self.CachedSearcher, 'get_clauses', wraps=self.searcher.get_clauses
+        ) as parse:
+            q3 = self.searcher.get_query_fields(
+                QueryDict('q=st__co__aaa|st__co__aaa')
+            )
+            self.searcher.get_query_fields(
+                QueryDict('q=st__co__aaa|st__co__aaa')
+            )
+        self.assertIs(q3, q1)
+        self.assertEqual(parse.call_count, 1)
+
+        self.searcher.get_query_fields(QueryDict('q=st__eq__a'))
+        self.searcher.get_query_fields(QueryDict('q=st__eq__b'))
+        self.assertEqual(cache.stats()['evictions'], 3)
+        self.assertEqual(len(cache), 4)
+
+    def testOrderCache(self):
+        s = self.searcher.get_order_fields(QueryDict('s=-n,st'))
+        s.append('pk')
+        s = self.searcher.get_order_fields(QueryDict('s=-n,st'))
+        self.assertEqual(s, ['-name', 'status'])
+        self.assertEqual(self.CachedSearcher.get_search_cache().hits, 1)
+
+    def testCacheTTL(self):
+        cache = SearchCache(10, ttl=0.01)
+        cache.set('k', 'v')
+        self.assertEqual(cache.get('k'), 'v')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('k'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def testCacheDisabled(self):
+        self.assertIsNone(
+            TestDjangoSearchParser.CustomDjangoSearchParser.get_search_cache()
+        )
+
+
+class BookSearcher(DjangoSearchParser):
+    query_mapping = {
+        'name': 'name',
+        'st': 'status',
+        'author': 'author__name',
+        'age': 'author__age',
+        'date': 'publish_at',
+        'from': 'publish_at__gte',
+        'to': 'publish_at__lte',
+    }
+
+
+class SearchTestMixin(object):
+
+    def createBooks(self):
+        self.authors = [
+            Author.objects.create(name='author%d' % i, age=20 + i)
+            for i in range(3)
+        ]
+        publishAt = datetime.datetime(2016, 1, 1, tzinfo=datetime.timezone.utc)
+        self.books = [
+            Book.objects.create(
+                name='book%02d' % i,
+                publish_at=publishAt + datetime.timedelta(days=i % 4),
+                author=self.authors[i % 3],
+                status='published' if i % 2 else 'draft',
+            )
+            for i in range(10)
+        ]
+
+    def getView(self, query='', viewClass=None, **attrs):
+        class BookView(DjangoSearchMixin):
+            searcher_class = BookSearcher
+            queryset = Book.objects.all()
+
+        viewClass = viewClass or BookView
+        view = type(str('View'), (viewClass, ), attrs)()
+        view.request = RequestFactory().get('/?' + query)
+        return view
+
+
+class TestCursorPagination(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+
+    def walk(self, query, **attrs):
+        pages, cursor = [], None
+        while True:
+            view = self.getView(
+                query + ('&cursor=' + cursor if cursor else ''),
+                cursor_pagination=True, cursor_page_size=3, **attrs
+            )
+            rows, cursor = view.get_cursor_page()
+            pages.append([book.pk for book in rows])
+            if cursor is None:
+                return pages
+
+    def testWalkPages(self):
+        pages = self.walk('s=-date,author')
+        expected = list(
+            Book.objects.order_by('-publish_at', 'author__name', 'pk')
+            .values_list('pk', flat=True)
+        )
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        pages = self.walk('q=st__eq__published&s=author')
+        expected = list(
+            Book.objects.filter(status='published')
+            .order_by('author__name', 'pk').values_list('pk', flat=True)
+        )
+        self.assertEqual(sum(pages, []), expected)
+
+    def testNullSortKey(self):
+        class Searcher(BookSearcher):
+            query_mapping = {'st': 'status', 'rank': 'rank'}
+
+        # NULL for the published books
+        queryset = Book.objects.annotate(
+            rank=Case(When(status='draft', then=F('author__age')))
+        )
+
+        class View(DjangoSearchMixin):
+            searcher_class = Searcher
+
+            def get_search_queryset(self):
+                return queryset
+
+        for order in (['rank'], ['-rank']):
+            pages = self.walk('s=' + order[0], viewClass=View)
+            expected = list(
+                queryset.order_by(*order + ['pk']).values_list('pk', flat=True)
+            )
+            self.assertEqual(sum(pages, []), expected)
+
+    def testInvalidCursor(self):
+        view = self.getView('cursor=abc', cursor_pagination=True)
+        self.assertRaises(InvalidCursor, view.get_queryset)
+
+        cursor = encode_cursor(['-pk'], [1])
+        view = self.getView('cursor=' + cursor, cursor_pagination=True)
+        with self.assertRaises(InvalidCursor) as ctx:
+            view.get_queryset()
+        self.assertEqual(ctx.exception.as_dict()['code'], 'invalid_cursor')
+
+
+class TestRelatedLookups(SearchTestMixin, TestCase):
+
+    def testInferRelatedLookups(self):
+        self.assertEqual(
+            BookSearcher().get_related_lookups(Book), (('author', ), ())
+        )
+        self.assertEqual(
+            infer_related_lookups(Author, ('book__name', 'name')),
+            ((), ('book_set', ))
+        )
+        self.assertEqual(
+            infer_related_lookups(Book, ('author__book__status', 'status')),
+            (('author', ), ('author__book_set', ))
+        )
+
+    def testOverrideRelatedLookups(self):
+        class Searcher(BookSearcher):
+            select_related = ()
+
+        self.assertEqual(Searcher().get_related_lookups(Book), ((), ()))
+
+    def testConstantQueries(self):
+        self.createBooks()
+        view = self.getView('q=age__gt__20')
+        with self.assertNumQueries(1):
+            names = [book.author.name for book in view.get_queryset()]
+        self.assertEqual(len(names), 6)
+
+
+class TestExport(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+
+    def testExportCSV(self):
+        view = self.getView('q=st__eq__draft&s=name')
+        response = view.get_export_response(filename='books.csv')
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename="books.csv"'
+        )
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'name,st,author,age,date')
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(
+            lines[1].startswith('book00,draft,author0,20,2016-01-01')
+        )
+
+    def testExportJSONLines(self):
+        view = self.getView('q=age__eq__21', export_fields=['age', 'name'])
+        response = view.get_export_response('jsonl')
+        rows = [
+            json.loads(line) for line in
+            b''.join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(rows, [
+            {'age': 21, 'name': 'book01'},
+            {'age': 21, 'name': 'book04'},
+            {'age': 21, 'name': 'book07'},
+        ])
+        self.assertRaises(ValueError, view.get_export_response, 'xml')
+
+        # Keys that are not mapped, or not single valued fields, leave
+        # nothing to export
+        view = self.getView('q=age__eq__21', export_fields=['unknown'])
+        self.assertRaises(ValueError, view.get_export_response)
+
+
+class TestCostGuard(SearchTestMixin, TestCase):
+
+    class LimitedSearcher(DjangoSearchParser):
+        query_mapping = {
+            'st': 'status',
+        }
+        max_clauses = 3
+        max_in_values = 2
+        min_contains_length = 3
+
+    def setUp(self):
+        self.searcher = self.LimitedSearcher()
+
+    def assertRejected(self, query, reason):
+        with self.assertRaises(SearchRejected) as ctx:
+            self.searcher.get_query_fields(QueryDict(query))
+        error = ctx.exception.as_dict()
+        self.assertEqual(error['code'], 'search_rejected')
+        self.assertEqual(error['reason'], reason)
+        return error
+
+    def testStaticLimits(self):
+        error = self.assertRejected(
+            'q=st__eq__a|st__eq__b|st__eq__c|st__eq__d', 'max_clauses'
+        )
+        self.assertEqual((error['limit'], error['value']), (3, 4))
+        self.assertRejected('q=st__in__[a,b,c]', 'max_in_values')
+        self.assertRejected('q=st__ni__[a,b,c]', 'max_in_values')
+        self.assertRejected('q=st__co__ab', 'min_contains_length')
+
+        q = self.searcher.get_query_fields(
+            QueryDict('q=st__co__abc|st__in__[a,b]|x__co__a')
+        )
+        self.assertEqual(len(q.children), 2)
+
+    def testParseExplain(self):
+        output = json.dumps([{'Plan': {
+            'Node Type': 'Seq Scan', 'Total Cost': 1834.5, 'Plan Rows': 98000
+        }}])
+        self.assertEqual(parse_postgresql_explain(output), (1834.5, 98000))
+
+    def testQueryCostWithoutEstimate(self):
+        self.createBooks()
+        view = self.getView('q=st__eq__draft', max_query_rows=1)
+        self.assertEqual(view.get_queryset().count(), 5)
+
+    @mock.patch('djolar.mixins.estimate_query_cost', return_value=(500.0, 5))
+    def testQueryCostEstimate(self, estimate):
+        self.createBooks()
+        view = self.getView('q=st__eq__draft&s=-name', max_query_cost=100)
+        with self.assertRaises(SearchRejected) as ctx:
+            view.get_queryset()
+        self.assertEqual(ctx.exception.detail['reason'], 'max_query_cost')
+
+        view = self.getView(
+            'q=st__eq__draft&s=-name',
+            max_query_rows=2, query_cost_action='downgrade'
+        )
+        self.assertEqual(
+            [book.name for book in view.get_queryset()], ['book08', 'book06']
+        )
+
+
+class TestAsyncSearch(SearchTestMixin, TestCase):
+
+    class AsyncBookView(AsyncDjangoSearchMixin):
+        searcher_class = BookSearcher
+        queryset = Book.objects.all()
+
+    def setUp(self):
+        self.createBooks()
+
+    async def testSearchResults(self):
+        view = self.getView('q=st__eq__draft&s=-name', self.AsyncBookView)
+        count, rows = await view.aget_search_results(offset=1, limit=2)
+        self.assertEqual(count, (5, True, None))
+        self.assertEqual([book.name for book in rows], ['book06', 'book04'])
+        # Relations are joined, no lazy query in the event loop
+        self.assertEqual(rows[0].author.name, 'author0')
+
+    async def testCursorPage(self):
+        view = self.getView(
+            's=name', self.AsyncBookView,
+            cursor_pagination=True, cursor_page_size=4
+        )
+        rows, cursor = await view.aget_cursor_page()
+        self.assertEqual(
+            [book.name for book in rows],
+            ['book00', 'book01', 'book02', 'book03']
+        )
+
+        view = self.getView(
+            's=name&cursor=' + cursor, self.AsyncBookView,
+            cursor_pagination=True, cursor_page_size=4
+        )
+        rows, cursor = await view.aget_cursor_page()
+        self.assertEqual(
+            [book.name for book in rows],
+            ['book04', 'book05', 'book06', 'book07']
+        )
+
+
+class TestCountStrategy(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+        caches['default'].clear()
+
+    def getCountView(self, query, strategy):
+        class Searcher(BookSearcher):
+            count_strategy = strategy
+
+        return self.getView(query, searcher_class=Searcher)
+
+    def testExactCount(self):
+        view = self.getView('q=st__eq__draft')
+        count = view.get_search_count()
+        self.assertEqual(count, (5, True, None))
+        self.assertEqual(count.as_dict(), {'count': 5, 'count_exact': True})
+
+    def testCachedCount(self):
+        view = self.getCountView('q=st__eq__draft', CachedCount(timeout=10))
+        self.assertEqual(view.get_search_count(), (5, True, None))
+        with self.assertNumQueries(0):
+            self.assertEqual(view.get_search_count(), (5, False, None))
+
+        view = self.getCountView(
+            'q=st__eq__published', CachedCount(timeout=10)
+        )
+        self.assertEqual(view.get_search_count(), (5, True, None))
+
+    def testEstimatedCountFallback(self):
+        view = self.getCountView('q=age__gt__20', EstimatedCount())
+        self.assertEqual(view.get_search_count(), (6, True, None))
+
+    def testHasNextCount(self):
+        view = self.getCountView('q=st__eq__draft', HasNextCount())
+        self.assertEqual(view.get_search_count(limit=2), (2, False, True))
+        self.assertEqual(
+            view.get_search_count(offset=4, limit=2), (5, True, False)
+        )
+        self.assertEqual(
+            view.get_search_count(offset=6, limit=2), (6, False, False)
+        )
+
+        # The page query fetches the extra row, no other query runs
+        pages = (
+            (0, (2, False, True), ['book00', 'book02']),
+            (4, (5, True, False), ['book08']),
+        )
+        for offset, count, names in pages:
+            with self.assertNumQueries(1):
+                page = view.get_search_results(offset, 2)
+            self.assertEqual(page[0], count)
+            self.assertEqual([book.name for book in page[1]], names)
+
+    async def testAsyncCount(self):
+        class AsyncBookView(AsyncDjangoSearchMixin):
+            searcher_class = BookSearcher
+            queryset = Book.objects.all()
+
+        view = self.getView('q=st__eq__draft', AsyncBookView)
+        view.searcher_class = type(
+            str('Searcher'), (BookSearcher, ),
+            {'count_strategy': HasNextCount()}
+        )
+        count, rows = await view.aget_search_results(offset=0, limit=3)
+        self.assertEqual(count, (3, False, True))
+        self.assertEqual(len(rows), 3)
+
+
+class TestCanonicalQuery(TestCase):
+
+    class CanonicalSearcher(DjangoSearchParser):
+        query_mapping = {
+            'st': 'status',
+            'n': 'name',
+            'date': 'publish_at',
+            'any': ['name', 'status'],
+        }
+
+    def setUp(self):
+        self.searcher = self.CanonicalSearcher()
+
+    def canonical(self, query):
+        return self.searcher.get_canonical_query(QueryDict(query))
+
+    def testCanonicalQuery(self):
+        self.assertEqual(
+            self.canonical('q=st__eq__a|n__co__b|st__eq__a|x__eq__c'),
+            self.canonical('q=n__co__b|st__eq__a')
+        )
+        self.assertEqual(
+            self.canonical('q=n__co__b|st__eq__a'), 'n__co__b|st__eq__a'
+        )
+        # Lists are intersected or merged, `eq` implies `in`
+        self.assertEqual(
+            self.canonical(
+                'q=st__in__[c,a,b]|st__in__[b,c,d]|st__ni__[x]|st__ni__[y,x]'
+            ),
+            'st__in__[b,c]|st__ni__[x,y]'
+        )
+        self.assertEqual(
+            self.canonical('q=st__in__[a,b]|st__eq__a'), 'st__eq__a'
+        )
+        self.assertEqual(
+            self.canonical('q=any__in__[a]|any__in__[b]'),
+            'any__in__[a]|any__in__[b]'
+        )
+        # The longer term implies the shorter one
+        self.assertEqual(
+            self.canonical('q=n__co__py|n__co__python'), 'n__co__python'
+        )
+        # Bounds on strings are only merged when equal
+        self.assertEqual(
+            self.canonical('q=st__gte__a|st__gt__a|st__lt__c|st__lt__b'),
+            'st__lt__b|st__lt__c|st__gt__a'
+        )
+        self.assertEqual(self.canonical(''), '')
+
+    def testRange(self):
+        q = self.searcher.get_query_fields(
+            QueryDict('q=date__lte__2016-12-31|date__gte__2016-01-01')
+        )
+        self.assertEqual(q, Q(publish_at__range=('2016-01-01', '2016-12-31')))
+        self.assertEqual(
+            self.canonical('q=date__lte__2016-12-31|date__gte__2016-01-01'),
+            'date__gte__2016-01-01|date__lte__2016-12-31'
+        )
+
+        # A fan out mapping is not merged into a range
+        q = self.searcher.get_query_fields(
+            QueryDict('q=any__lte__b|any__gte__a')
+        )
+        self.assertEqual(len(q.children), 2)
+
+    def testCanonicalizeDisabled(self):
+        class Searcher(self.CanonicalSearcher):
+            canonicalize_query = False
+
+        q = Searcher().get_query_fields(
+            QueryDict('q=st__eq__b|n__eq__a|st__eq__b')
+        )
+        self.assertEqual(
+            q.children, [('status', 'b'), ('name', 'a'), ('status', 'b')]
+        )
+
+
+class TestValueCoercion(SearchTestMixin, TestCase):
+
+    class TypedSearcher(BookSearcher):
+        model = Book
+        query_mapping = dict(BookSearcher.query_mapping, author_id='author')
+
+    def setUp(self):
+        self.searcher = self.TypedSearcher()
+
+    def testCoerceValues(self):
+        q = self.searcher.get_query_fields(
+            QueryDict('q=age__lt__18|author_id__in__[2,1]|st__eq__1')
+        )
+        self.assertEqual(
+            q, Q(author__age__lt=18) & Q(author__in=[1, 2]) & Q(status='1')
+        )
+
+        q = self.searcher.get_query_fields(
+            QueryDict('q=from__eq__2016-01-02|name__co__12')
+        )
+        self.assertEqual(q, Q(publish_at__gte=datetime.datetime(
+            2016, 1, 2, tzinfo=datetime.timezone.utc
+        )) & Q(name__icontains='12'))
+
+    def testTypedBoundsAreMerged(self):
+        self.assertEqual(
+            self.searcher.get_canonical_query(
+                QueryDict('q=age__gt__1|age__gt__5|age__lte__9|age__lt__7')
+            ),
+            'age__lt__7|age__gt__5'
+        )
+
+    def testInvalidValue(self):
+        with self.assertRaises(InvalidSearchValue) as ctx:
+            self.searcher.get_query_fields(QueryDict('q=age__in__[1,x]'))
+        error = ctx.exception.as_dict()
+        self.assertEqual(error['code'], 'invalid_value')
+        self.assertEqual((error['key'], error['value']), ('age', ['1', 'x']))
+
+    def testMixinBindsModel(self):
+        self.createBooks()
+        view = self.getView('q=age__gte__21')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(view.get_queryset()), 6)
+        self.assertRaises(
+            InvalidSearchValue, self.getView('q=date__gt__x').get_queryset
+        )
+
+
+class TestFullTextSearch(SearchTestMixin, TestCase):
+
+    class FullTextSearcher(BookSearcher):
+        fulltext_search = {
+            'name': FullText('english', sqlite_table='app_book_fts'),
+            'st': FullText(),
+        }
+
+    def setUp(self):
+        author = Author.objects.create(name='author', age=30)
+        publishAt = datetime.datetime(2016, 1, 1, tzinfo=datetime.timezone.utc)
+        self.books = dict(
+            (name, Book.objects.create(
+                name=name, publish_at=publishAt, author=author, status='draft'
+            ))
+            for name in (
+                'Python Programming',
+                'Programming Python, Python and more Python',
+                'The C Programming Language',
+                'Cooking',
+            )
+        )
+
+    def search(self, query, **attrs):
+        view = self.getView(
+            query, searcher_class=self.FullTextSearcher, **attrs
+        )
+        return [book.name for book in view.get_queryset()]
+
+    def testTokenize(self):
+        self.assertEqual(tokenize('name__fts__a,b')[1].name, 'fts')
+        self.assertEqual(tokenize('name__co__x__fts__y')[1].name, 'co')
+
+    def testClauses(self):
+        searcher = self.FullTextSearcher()
+        fulltext = searcher.get_search_plan().fulltext_search['name']
+        q = searcher.get_query_fields(
+            QueryDict('q=name__fts__python,,programming|author__fts__x')
+        )
+        self.assertEqual(
+            q, Q(name__fts=FullTextQuery(('programming', 'python'), fulltext))
+        )
+        self.assertEqual(
+            searcher.get_canonical_query(
+                QueryDict('q=name__fts__b,a|name__fts__a,b|name__fts__,')
+            ),
+            'name__fts__a,b'
+        )
+
+    def testMatchAndRank(self):
+        self.assertEqual(self.search('q=name__fts__python'), [
+            'Programming Python, Python and more Python', 'Python Programming',
+        ])
+        # Every term must match, the porter stemmer matches `program`
+        self.assertEqual(
+            sorted(self.search('q=name__fts__programs,language')),
+            ['The C Programming Language']
+        )
+        # The client order wins over the rank
+        self.assertEqual(self.search('q=name__fts__python&s=name'), [
+            'Programming Python, Python and more Python', 'Python Programming',
+        ])
+        # Cursors seek on the rank
+        view = self.getView(
+            'q=name__fts__programming', searcher_class=self.FullTextSearcher,
+            cursor_pagination=True, cursor_page_size=2
+        )
+        rows, cursor = view.get_cursor_page()
+        view.request = RequestFactory().get(
+            '/?q=name__fts__programming&cursor=' + cursor
+        )
+        self.assertEqual(
+            [book.name for book in rows + view.get_cursor_page()[0]],
+            self.search('q=name__fts__programming')
+        )
+        # Terms are never read as FTS5 syntax
+        self.assertEqual(self.search('q=name__fts__python)OR(*'), [])
+
+    def testFallbackWithoutIndex(self):
+        self.assertEqual(len(self.search('q=st__fts__DRAFT')), 4)
+        q = Q(name__fts='cook')
+        self.assertEqual(
+            list(Book.objects.filter(q).values_list('name', flat=True)),
+            ['Cooking']
+        )
+
+
+class TestResultCache(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+        caches['default'].clear()
+        self.resultCache = ResultCache(timeout=60, key_prefix='test:results')
+
+    def getPage(self, query='q=st__eq__draft&s=-name'):
+        view = self.getView(query, result_cache=self.resultCache)
+        count, rows = view.get_search_results(offset=1, limit=2)
+        return count, [book.name for book in rows]
+
+    def testRelatedModels(self):
+        self.assertEqual(
+            get_related_models(
+                Book, BookSearcher().get_search_plan().field_paths
+            ),
+            frozenset([Book, Author])
+        )
+
+    def testCachedPage(self):
+        expected = ((5, True, None), ['book06', 'book04'])
+        self.assertEqual(self.getPage(), expected)
+        # The rows are fetched by primary key, the count is cached
+        with self.assertNumQueries(1):
+            self.assertEqual(self.getPage(), expected)
+        self.assertEqual(
+            self.getPage('q=st__eq__draft&s=name')[1], ['book02', 'book04']
+        )
+        stats = self.resultCache.stats()
+        self.assertEqual(
+            (stats['hits'], stats['misses'], stats['invalidations']), (1, 2, 0)
+        )
+
+    def testInvalidation(self):
+        self.getPage()
+        Book.objects.filter(name='book06').delete()
+        self.assertEqual(
+            self.getPage(), ((4, True, None), ['book04', 'book02'])
+        )
+
+        # Related models invalidate the pages too
+        self.getPage('q=author__eq__author0&s=name')
+        author = self.authors[0]
+        author.name = 'renamed'
+        author.save()
+        self.assertEqual(
+            self.getPage('q=author__eq__author0&s=name'), ((0, True, None), [])
+        )
+        self.assertEqual(self.resultCache.stats()['misses'], 4)
+        self.assertGreaterEqual(self.resultCache.stats()['invalidations'], 2)
+
+    def testWatchedModels(self):
+        # A process writing before any search still invalidates the pages
+        resultCache = ResultCache(key_prefix='test:results',
+                                  models=[Book, Author])
+        generations = resultCache.get_generations([Book])
+        Book.objects.get(name='book06').save()
+        self.assertNotEqual(resultCache.get_generations([Book]), generations)
+        self.assertEqual(resultCache.stats()['invalidations'], 1)
+
+
+class TestInstrumentation(SearchTestMixin, TestCase):
+
+    class ListCollector(SearchCollector):
+        def __init__(self):
+            self.stats = []
+
+        def record(self, stats):
+            self.stats.append(stats)
+
+    def setUp(self):
+        self.createBooks()
+        self.collector = self.ListCollector()
+
+    def testSearchStats(self):
+        view = self.getView(
+            'q=st__eq__draft|age__gt__20|st__eq__draft|name__co__book&s=-date',
+            search_collectors=[self.collector]
+        )
+        count, rows = view.get_search_results(offset=0, limit=2)
+        view.get_search_results(offset=0, limit=2)
+
+        self.assertEqual(len(self.collector.stats), 1)
+        stats = self.collector.stats[0].as_dict()
+        self.assertEqual(
+            stats['query'], 'age__gt__20|name__co__book|st__eq__draft'
+        )
+        self.assertEqual(stats['clause_count'], 3)
+        self.assertEqual(stats['operators'], {'co': 1, 'eq': 1, 'gt': 1})
+        self.assertEqual(stats['order_by'], ['-publish_at'])
+        self.assertEqual((stats['rows'], stats['sql_count']), (2, 2))
+        self.assertEqual(
+            sorted(stats['timings']),
+            ['build', 'fetch', 'order', 'parse', 'sql']
+        )
+        self.assertGreaterEqual(stats['duration'], stats['timings']['fetch'])
+
+    def testSlowSearchLog(self):
+        view = self.getView(
+            'q=st__eq__draft', cursor_pagination=True,
+            search_collectors=[
+                SlowSearchLog(threshold=0), SlowSearchLog(threshold=60)
+            ]
+        )
+        with self.assertLogs('djolar.search') as logs:
+            view.get_cursor_page()
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('q=st__eq__draft', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def testSignal(self):
+        received = []
+
+        def receiver(sender, stats, **kwargs):
+            received.append(stats.rows)
+
+        search_completed.connect(receiver)
+        try:
+            view = self.getView(
+                'q=st__eq__draft', search_collectors=[SignalCollector()]
+            )
+            view.get_search_results(limit=3)
+        finally:
+            search_completed.disconnect(receiver)
+        self.assertEqual(received, [3])
+
+    def testDisabled(self):
+        view = self.getView('q=st__eq__draft')
+        view.get_search_results(limit=3)
+        self.assertIsNone(view.get_search_stats())
+        self.assertIsNone(BookSearcher.search_stats)
+
+
+class TestLargeLists(SearchTestMixin, TestCase):
+
+    class ListSearcher(BookSearcher):
+        query_mapping = dict(
+            BookSearcher.query_mapping, id='pk', author_id='author'
+        )
+        large_list_threshold = 3
+
+    class PlainSearcher(ListSearcher):
+        large_list_threshold = None
+
+    def setUp(self):
+        self.createBooks()
+
+    def search(self, query, searcherClass=ListSearcher):
+        view = self.getView(query, searcher_class=searcherClass)
+        return sorted(view.get_queryset().values_list('name', flat=True))
+
+    def testLargeListLookup(self):
+        searcher = self.ListSearcher()
+        q = searcher.get_query_fields(
+            QueryDict('q=st__in__[b,a,c,a,d]|name__in__[x,y]')
+        )
+        self.assertEqual(
+            q,
+            Q(name__in=['x', 'y']) & Q(status__large_in=['a', 'b', 'c', 'd'])
+        )
+
+        q = self.PlainSearcher().get_query_fields(
+            QueryDict('q=st__in__[b,a,c,a,d]')
+        )
+        self.assertEqual(q, Q(status__in=['a', 'b', 'c', 'd']))
+
+    def testSameRows(self):
+        pks = ','.join(str(book.pk) for book in self.books[:6]) + ',1000000'
+        for query in (
+                'q=id__in__[{}]', 'q=id__ni__[{}]',
+                'q=author_id__in__[{},{}]', 'q=st__ni__[draft,x,y,z]'):
+            query = query.format(pks, self.authors[0].pk)
+            expected = self.search(query, self.PlainSearcher)
+            self.assertTrue(expected)
+            self.assertEqual(self.search(query), expected)
+            # Other databases, chunked IN lists
+            with mock.patch.object(
+                    connection.features, 'supports_json_field', False), \
+                    mock.patch.object(inlist, 'CHUNK_SIZE', 2):
+                self.assertEqual(self.search(query), expected)
+
+    def testOverParameterLimit(self):
+        view = self.getView(
+            'q=id__in__[{}]'.format(','.join(str(i) for i in range(100000))),
+            searcher_class=self.ListSearcher
+        )
+        sql = str(view.get_queryset().query)
+        self.assertIn('json_each', sql)
+        self.assertEqual(view.get_queryset().count(), 10)
+
+
+class TestFacets(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+
+    def testFacetCounts(self):
+        view = self.getView(
+            'q=st__eq__draft|author__in__[author0,author1]',
+            facet_keys=['st', 'author']
+        )
+        with self.assertNumQueries(2):
+            facets = view.get_facet_counts()
+        # The own clauses of a key do not filter its counts
+        self.assertEqual(facets, {
+            'st': [('published', 4), ('draft', 3)],
+            'author': [('author0', 2), ('author2', 2), ('author1', 1)],
+        })
+        self.assertEqual(
+            view.get_facet_counts(['age'], size=1), {'age': [(20, 2)]}
+        )
+
+    def testFacetedResults(self):
+        view = self.getView('q=st__eq__draft&s=name', facet_keys=['st'])
+        count, rows, facets = view.get_faceted_results(0, 2)
+        self.assertEqual(count.count, 5)
+        self.assertEqual([book.name for book in rows], ['book00', 'book02'])
+        self.assertEqual(facets, {'st': [('draft', 5), ('published', 5)]})
+
+    def testFacetKeyMappedToFields(self):
+        class Searcher(BookSearcher):
+            query_mapping = dict(
+                BookSearcher.query_mapping, any=('name', 'status')
+            )
+
+        view = self.getView('', searcher_class=Searcher)
+        self.assertRaises(AssertionError, view.get_facet_counts, ['any'])
+
+
+class TestProjection(SearchTestMixin, TestCase):
+
+    class ProjectionSearcher(BookSearcher):
+        projection_keys = ['name', 'author', 'date']
+
+    def setUp(self):
+        self.createBooks()
+
+    def getProjectionView(self, query, **attrs):
+        return self.getView(
+            query, searcher_class=self.ProjectionSearcher, **attrs
+        )
+
+    def testProjectionFields(self):
+        searcher = self.ProjectionSearcher()
+        self.assertEqual(
+            searcher.get_projection_fields(
+                QueryDict('f=author,st,name,author')
+            ),
+            ['author__name', 'name']
+        )
+        self.assertIsNone(searcher.get_projection_fields(QueryDict('f=st')))
+        self.assertIsNone(
+            BookSearcher().get_projection_fields(QueryDict('f=name'))
+        )
+
+        with self.assertRaises(AssertionError):
+            class Searcher(DjangoSearchParser):
+                query_mapping = {'any': ('name', 'status')}
+                projection_keys = ['any']
+
+    def testOnly(self):
+        view = self.getProjectionView(
+            'q=st__eq__draft&f=name,author&s=-date,-name'
+        )
+        with self.assertNumQueries(1):
+            rows = list(view.get_queryset())
+            self.assertEqual(
+                [(book.name, book.author.name) for book in rows[:2]],
+                [('book06', 'author0'), ('book02', 'author2')]
+            )
+        self.assertEqual(
+            rows[0].get_deferred_fields(), set(['status', 'createDate'])
+        )
+
+    def testValues(self):
+        view = self.getProjectionView(
+            'q=st__eq__draft&f=name,author&s=-date,-name',
+            projection_mode='values'
+        )
+        self.assertEqual(list(view.get_queryset())[0], {
+            'pk': self.books[6].pk, 'name': 'book06',
+            'author__name': 'author0', 'publish_at': self.books[6].publish_at,
+        })
+
+    def testValuesCursor(self):
+        pages, cursor = [], None
+        while True:
+            view = self.getProjectionView(
+                'f=name&s=-date' + ('&cursor=' + cursor if cursor else ''),
+                projection_mode='values', cursor_pagination=True,
+                cursor_page_size=4
+            )
+            rows, cursor = view.get_cursor_page()
+            pages.extend(row['pk'] for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(pages, list(
+            Book.objects.order_by('-publish_at', 'pk').values_list(
+                'pk', flat=True
+            )
+        ))
+
+
+class TestReplicaRouting(SearchTestMixin, TestCase):
+    databases = {'default', 'replica1', 'replica2'}
+
+    def setUp(self):
+        self.createBooks()
+        # The replica has its own rows
+        Book.objects.using('replica1').create(
+            name='replica', status='draft',
+            publish_at=self.books[0].publish_at,
+            author=Author.objects.using('replica1').create(
+                name='replica', age=1
+            )
+        )
+
+    def testRoundRobin(self):
+        replicas = RoundRobinReplicas(['replica1', 'replica2'])
+        databases = []
+        for _ in range(3):
+            view = self.getView(
+                'q=st__eq__draft', search_replicas=replicas, facet_keys=['st']
+            )
+            with self.assertNumQueries(3, using=view.get_queryset().db):
+                count, rows, facets = view.get_faceted_results(0, 10)
+            databases.append(view.get_queryset().db)
+        self.assertEqual(databases, ['replica1', 'replica2', 'replica1'])
+        self.assertEqual(count.count, 1)
+        self.assertEqual(facets, {'st': [('draft', 1)]})
+
+    def testReadYourWrites(self):
+        view = self.getView(
+            'q=st__eq__draft', search_replicas=RoundRobinReplicas(['replica1'])
+        )
+        mark_read_primary(view.request)
+        self.assertEqual(view.get_queryset().db, 'default')
+        self.assertEqual(view.get_search_results()[0].count, 5)
+
+        # The session keeps reading the primary for a while
+        request = RequestFactory().get('/')
+        request.session = {}
+        mark_read_primary(request, seconds=60)
+        view = self.getView(
+            '', search_replicas=RoundRobinReplicas(['replica1'])
+        )
+        view.request.session = request.session
+        self.assertEqual(view.get_queryset().db, 'default')
+
+    async def testAsyncSession(self):
+        class Session(dict):
+            # A database backed session loads on first access
+            def get(self, key, default=None):
+                Book.objects.exists()
+                return super(Session, self).get(key, default)
+
+        class View(AsyncDjangoSearchMixin):
+            searcher_class = BookSearcher
+            queryset = Book.objects.all()
+            search_replicas = RoundRobinReplicas(['replica1'])
+
+        readPrimary = {READ_PRIMARY_SESSION_KEY: time.time() + 60}
+        for session, database, count in (({}, 'replica1', 1),
+                                         (readPrimary, 'default', 5)):
+            view = View()
+            view.request = RequestFactory().get('/?q=st__eq__draft')
+            view.request.session = Session(session)
+            self.assertEqual(
+                (await view.aget_search_results())[0].count, count
+            )
+            self.assertEqual(view.get_search_database(Book), database)
+
+    def testLeastLoaded(self):
+        replicas = LeastLoadedReplicas(['replica1', 'replica2'])
+        self.assertEqual(replicas.select(), 'replica1')
+        with replicas.track('replica1'):
+            self.assertEqual(replicas.select(), 'replica2')
+            with replicas.track('replica2'), replicas.track('replica2'):
+                self.assertEqual(replicas.select(), 'replica1')
+        self.assertEqual(replicas.running, {'replica1': 0, 'replica2': 0})
+
+
+class TestBooleanExpression(SearchTestMixin, TestCase):
+
+    class TypedSearcher(BookSearcher):
+        model = Book
+
+    def setUp(self):
+        self.createBooks()
+        self.searcher = self.TypedSearcher()
+
+    def canonical(self, query):
+        return self.searcher.get_canonical_query(
+            QueryDict(urlencode({'q': query}))
+        )
+
+    def search(self, query):
+        view = self.getView(
+            urlencode({'q': query}), searcher_class=self.TypedSearcher
+        )
+        return sorted(book.name for book in view.get_queryset())
+
+    def testExpression(self):
+        self.assertEqual(
+            self.search('(age__eq__20 OR age__eq__21) AND NOT st__eq__draft'),
+            ['book01', 'book03', 'book07', 'book09']
+        )
+        self.assertEqual(
+            self.search('name__eq__book00 OR st__eq__published|age__eq__22'),
+            ['book00', 'book05']
+        )
+        # The flat syntax is unchanged
+        self.assertEqual(
+            self.search('st__eq__draft|age__eq__20'), ['book00', 'book06']
+        )
+
+    def testOptimize(self):
+        # Nested connectors are flattened, `eq` on one key become `in`
+        self.assertEqual(
+            self.canonical(
+                '(st__eq__b OR (st__eq__a OR name__co__x)) '
+                'AND NOT NOT age__gt__1'
+            ),
+            'age__gt__1 AND (name__co__x OR st__in__[a,b])'
+        )
+        self.assertEqual(
+            self.canonical('st__eq__a OR st__in__[a]'), 'st__eq__a'
+        )
+        q = self.searcher.get_query_fields(
+            QueryDict(urlencode({'q': 'st__eq__a OR st__eq__b'}))
+        )
+        self.assertEqual(q, Q(status__in=['a', 'b']))
+        # Parentheses are read at the edges of a clause
+        self.assertEqual(
+            self.canonical('(name__eq__f(x)) OR name__co__y)'),
+            'name__co__y) OR name__eq__f(x)'
+        )
+
+    def testContradiction(self):
+        for query in ['age__lt__1 AND age__gt__5',
+                      'age__gte__3 AND age__lt__3', 'st__eq__a AND st__eq__b',
+                      'st__in__[a,b] AND st__ni__[a,b]',
+                      'age__eq__5 AND (age__gt__6 OR st__eq__a st__eq__b)']:
+            self.assertEqual(self.canonical(query), 'FALSE', query)
+
+        # The empty result runs no SQL
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search(
+                '(age__lt__1 AND age__gt__5) OR name__eq__x '
+                'AND NOT name__eq__x'
+            ), [])
+        self.assertEqual(self.canonical('NOT (age__lt__1 AND age__gt__5)'), '')
+        self.assertEqual(
+            self.searcher.get_expression('NOT name__eq__x AND name__eq__x'),
+            FALSE
+        )
+        self.assertEqual(
+            self.searcher.get_expression('x__eq__a OR (st__xx__b)'), TRUE
+        )
+
+    def testInvalidClause(self):
+        # Ignored like in flat queries, not replaced by a constant
+        self.assertEqual(
+            self.search('age__eq__20 OR bogus__eq__x'),
+            ['book00', 'book03', 'book06', 'book09']
+        )
+        self.assertEqual(self.search('NOT bogus__eq__x'), self.search(''))
+        self.assertEqual(
+            self.search('st__eq__draft AND NOT (bogus__eq__x OR st__xx__y)'),
+            self.search('st__eq__draft')
+        )
+        self.assertEqual(
+            self.canonical('NOT bogus__eq__x OR (st__xx__y) OR age__eq__20'),
+            'age__eq__20'
+        )
+
+    def testLookupMapping(self):
+        class Searcher(self.TypedSearcher):
+            query_mapping = {'from': 'publish_at__gte', 'st': 'status'}
+
+        self.TypedSearcher = Searcher
+        self.searcher = Searcher()
+        # Both lower bounds can hold, the `eq` clauses are not merged
+        query = 'from__eq__2016-01-02T00:00:00Z ' \
+            'AND from__eq__2016-01-03T00:00:00Z'
+        self.assertNotEqual(self.canonical(query), 'FALSE')
+        self.assertEqual(
+            self.search(query), ['book02', 'book03', 'book06', 'book07']
+        )
+        query = 'from__eq__2016-01-04T00:00:00Z ' \
+            'OR from__eq__2016-01-03T00:00:00Z OR st__eq__x'
+        self.assertEqual(
+            self.search(query), ['book02', 'book03', 'book06', 'book07']
+        )
+
+    def testInvalidExpression(self):
+        for query in ['(st__eq__a', 'st__eq__a OR',
+                      'st__eq__a) AND (name__co__b', 'NOT', '()']:
+            with self.assertRaises(InvalidSearchExpression):
+                self.canonical(query)
+
+        class Searcher(BookSearcher):
+            max_clauses = 2
+
+        with self.assertRaises(SearchRejected):
+            Searcher().get_clauses('st__eq__a OR (st__eq__b AND st__eq__c)')
+
+    def testFacet(self):
+        view = self.getView(
+            urlencode(
+                {'q': '(st__eq__draft OR name__eq__book01) AND age__eq__20'}
+            ),
+            searcher_class=self.TypedSearcher, facet_keys=['st']
+        )
+        self.assertEqual(
+            view.get_facet_counts()['st'], [('draft', 2), ('published', 2)]
+        )
+
+    def testNegatedFacet(self):
+        # The negated clause on the facet key does not filter its counts
+        query = QueryDict(
+            urlencode({'q': 'NOT st__eq__draft AND age__eq__20'})
+        )
+        self.assertEqual(
+            self.searcher.get_facet_query(query, 'st'), Q(author__age=20)
+        )
+        view = self.getView(
+            urlencode({'q': 'NOT st__eq__draft AND age__eq__20'}),
+            searcher_class=self.TypedSearcher, facet_keys=['st']
+        )
+        self.assertEqual(
+            view.get_facet_counts()['st'], [('draft', 2), ('published', 2)]
+        )
+
+
+class TestSQLTemplates(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+        self.templates = SQLTemplateCache()
+
+    def results(self, view):
+        count, rows = view.get_search_results(0, 4)
+        return count.count, [(book.name, book.author.name) for book in rows]
+
+    def assertSearch(self, query, **attrs):
+        self.assertEqual(
+            self.results(
+                self.getView(query, sql_templates=self.templates, **attrs)
+            ),
+            self.results(self.getView(query, **attrs))
+        )
+
+    def testSameShape(self):
+        self.assertSearch('q=name__co__book|age__gt__20&s=-date,name')
+        self.assertSearch('q=name__co__0|age__gt__19&s=-date,name')
+        self.assertEqual(self.templates.stats()['hits'], 1)
+        self.assertEqual(self.templates.stats()['misses'], 1)
+        # The page and count statements of the first search are reused
+        self.assertEqual(self.templates.stats()['statement_hits'], 2)
+
+        # Another ordering is another shape
+        self.assertSearch('q=name__co__0|age__gt__19&s=name')
+        self.assertEqual(len(self.templates), 2)
+
+    def testListArity(self):
+        for values in ['draft,x,y', 'draft,published,x,y', 'published,x,y',
+                       'x,draft,y,z']:
+            self.assertSearch(
+                'q=st__in__[{}]|st__ni__[x]&s=name'.format(values)
+            )
+        self.assertEqual(len(self.templates), 1)
+        self.assertEqual(self.templates.stats()['hits'], 3)
+
+    def testQueryset(self):
+        self.assertSearch('q=age__eq__20&s=name')
+        queryset = self.getView(
+            'q=age__eq__21&s=name', sql_templates=self.templates
+        ).get_queryset()
+        self.assertEqual(self.templates.stats()['hits'], 1)
+        self.assertEqual(queryset.filter(name='book04').count(), 1)
+        self.assertEqual(
+            list(queryset.values_list('name', flat=True)[:2]),
+            ['book01', 'book04']
+        )
+        self.assertTrue(queryset.exists())
+
+    def testProjection(self):
+        class Searcher(BookSearcher):
+            projection_keys = ['name', 'author']
+
+        for query in ['q=age__gt__20&f=name,author&s=name',
+                      'q=age__gt__19&f=name,author&s=name']:
+            self.assertSearch(query, searcher_class=Searcher)
+        self.assertEqual(self.templates.stats()['hits'], 1)
+
+        rows = self.getView(
+            'q=age__gt__21&f=name&s=name', searcher_class=Searcher,
+            sql_templates=self.templates, projection_mode='values'
+        ).get_queryset()
+        self.assertEqual(
+            list(rows)[0], {'pk': self.books[2].pk, 'name': 'book02'}
+        )
+
+    def testFallback(self):
+        class View(DjangoSearchMixin):
+            searcher_class = BookSearcher
+            queryset = Book.objects.filter(author__age__gt=F('pk'))
+
+        for query in ['q=st__eq__draft&s=name', 'q=st__eq__published&s=name']:
+            self.assertSearch(query, viewClass=View)
+        self.assertEqual(self.templates.stats()['fallbacks'], 2)
+        self.assertEqual(len(self.templates), 0)
+
+    def testTemplateClone(self):
+        view = self.getView('q=age__eq__20&s=name',
+                            sql_templates=self.templates)
+        queryset = view.get_queryset()
+        list(queryset)
+        # The template keeps a clone without the rows of the first search
+        template, = self.templates._data.values()
+        self.assertIsNot(template.queryset, queryset)
+        self.assertIsNone(template.queryset._result_cache)
+
+    def testUnsupportedDjango(self):
+        with mock.patch.object(
+                templates, 'SUPPORTED_DJANGO_VERSIONS', ((1, 0), (1, 11))):
+            for query in ['q=age__eq__20&s=name', 'q=age__eq__21&s=name']:
+                self.assertSearch(query)
+        self.assertEqual(self.templates.stats()['fallbacks'], 2)
+        self.assertEqual(len(self.templates), 0)
+
+
+@skipUnless(memory.np is not None, 'NumPy is not installed')
+class TestMemorySearch(SearchTestMixin, TestCase):
+
+    QUERIES = [
+        '', 's=-date,name', 'q=name__co__BOOK0&s=name',
+        'q=st__eq__draft&s=-age,-name',
+        'q=age__gt__20|age__lte__21&s=date,-name',
+        'q=age__in__[20,22]|st__ni__[draft]',
+        'q=date__gte__2016-01-02|date__lt__2016-01-04&s=-date,-name',
+        'q=from__eq__2016-01-03&s=author,name',
+        'q=name__lt__book05|name__gte__book02&s=-name',
+        'q=(st__eq__draft OR age__eq__21) AND NOT name__co__3&s=-date,name',
+        'q=author__co__r1 OR age__lt__20', 'q=age__lt__1 AND age__gt__5',
+    ]
+
+    def setUp(self):
+        self.createBooks()
+        self.search = memory.MemorySearch(BookSearcher, Book.objects.all())
+
+    def testDifferential(self):
+        for query in self.QUERIES:
+            view = self.getView(query)
+            expected = list(view.get_queryset().values_list('pk', flat=True))
+            count, rows = self.search.search(QueryDict(query))
+            self.assertEqual([row['pk'] for row in rows], expected, query)
+            self.assertEqual(count, len(expected))
+
+        count, rows = self.search.search(
+            QueryDict('s=name'), offset=2, limit=3
+        )
+        self.assertEqual(count, 10)
+        self.assertEqual(
+            [row['name'] for row in rows], ['book02', 'book03', 'book04']
+        )
+
+    def testRefresh(self):
+        self.search.watch()
+        query = QueryDict('q=st__eq__draft')
+        self.assertEqual(self.search.search(query)[0], 5)
+        Book.objects.filter(pk=self.books[1].pk).update(status='draft')
+        self.assertEqual(self.search.search(query)[0], 5)
+        self.search.refresh()
+        self.assertEqual(self.search.search(query)[0], 6)
+
+        self.books[3].status = 'draft'
+        self.books[3].save()
+        self.assertEqual(self.search.search(query)[0], 7)
+
+    def testRows(self):
+        publishAt = self.books[0].publish_at
+        rows = [
+            {'pk': 1, 'name': 'b', 'status': None, 'author__name': 'x',
+             'author__age': None, 'publish_at': publishAt},
+            {'pk': 2, 'name': 'a', 'status': 'draft', 'author__name': 'y',
+             'author__age': 30, 'publish_at': None},
+        ]
+        search = memory.MemorySearch(BookSearcher, lambda: rows, model=Book)
+        self.assertEqual(
+            search.get_indices(QueryDict('q=st__ni__[draft]')).tolist(), [0]
+        )
+        self.assertEqual(
+            search.get_indices(QueryDict('q=age__lt__40')).tolist(), [1]
+        )
+        # NULL is the smallest value
+        self.assertEqual(
+            search.get_indices(QueryDict('s=-age')).tolist(), [1, 0]
+        )
+        self.assertEqual(
+            search.get_indices(QueryDict('s=date')).tolist(), [1, 0]
+        )
+
+        class Searcher(BookSearcher):
+            query_mapping = {'year': 'publish_at__year'}
+
+        with self.assertRaises(ValueError):
+            memory.MemorySearch(Searcher, Book.objects.all())
+
+
+class TestShardedSearch(SearchTestMixin, TransactionTestCase):
+    databases = {'default', 'shard1', 'shard2'}
+
+    def setUp(self):
+        publishAt = datetime.datetime(2016, 1, 1, tzinfo=datetime.timezone.utc)
+        self.books = []
+        for shard, alias in enumerate(['default', 'shard1', 'shard2']):
+            author = Author.objects.using(alias).create(
+                name='author%d' % shard, age=20 + shard
+            )
+            for i in range(5):
+                days = (i * 3 + shard) % 7
+                self.books.append(Book.objects.using(alias).create(
+                    name='book%d%d' % (i, shard),
+                    publish_at=publishAt + datetime.timedelta(days=days),
+                    author=author,
+                    status='published' if i % 2 else 'draft',
+                ))
+
+    def getShardedView(self, query):
+        return self.getView(
+            query, search_shards=['default', 'shard1', 'shard2']
+        )
+
+    def testMergedPage(self):
+        view = self.getShardedView('s=-date,name')
+        count, rows = view.get_sharded_results(2, 5)
+        expected = sorted(self.books, key=lambda book: book.name)
+        expected = sorted(
+            expected, key=lambda book: book.publish_at, reverse=True
+        )
+        self.assertEqual(count.as_dict(), {'count': 15, 'count_exact': True})
+        self.assertEqual(
+            [book.name for book in rows], [book.name for book in expected[2:7]]
+        )
+
+        count, rows = self.getShardedView(
+            'q=st__eq__published&s=name'
+        ).get_sharded_results()
+        self.assertEqual(count.count, 6)
+        self.assertEqual([book.name for book in rows], sorted(
+            book.name for book in self.books if book.status == 'published'
+        ))
+
+    def testMergeNulls(self):
+        class Row(object):
+            def __init__(self, pk, age):
+                self.pk, self.age = pk, age
+
+        pages = [[Row(1, None), Row(2, 5)], [Row(3, None), Row(4, 3)]]
+        rows = merge_pages(pages, ['-age', 'pk'], nullsLargest=True)
+        self.assertEqual([row.pk for row in rows], [1, 3, 2, 4])
+
+
+# Counts to a billion, long enough to be interrupted
+SLOW_SQL = (
+    'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) '
+    'SELECT count(*) FROM (SELECT x FROM c LIMIT 1000000000)'
+)
+
+
+class SlowCount(object):
+
+    def get_count(self, queryset, offset=0, limit=None):
+        with connection.cursor() as cursor:
+            cursor.execute(SLOW_SQL)
+        return queryset.count()
+
+
+class TestSearchTimeout(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+
+    def testStatementTimeout(self):
+        start = time.monotonic()
+        with self.assertRaises(SearchTimeout) as context:
+            with statement_timeout('default', 0.05, 'fetch'), \
+                    connection.cursor() as cursor:
+                cursor.execute(SLOW_SQL)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(context.exception.as_dict(), {
+            'code': 'search_timeout', 'message': 'The search is too expensive',
+            'timeout': 0.05, 'phase': 'fetch',
+        })
+        # The connection is usable again
+        self.assertEqual(Book.objects.count(), 10)
+
+    def testDeadline(self):
+        class Searcher(BookSearcher):
+            search_timeout = 0
+
+        view = self.getView('q=st__eq__draft', searcher_class=Searcher)
+        with self.assertRaises(SearchTimeout) as context:
+            view.get_search_results(0, 5)
+        self.assertEqual(context.exception.detail['phase'], 'parse')
+
+        class Searcher(BookSearcher):
+            search_timeout = 0.1
+            count_strategy = SlowCount()
+
+        # The database stops the count once the budget is spent
+        view = self.getView('q=st__eq__draft', searcher_class=Searcher)
+        with self.assertRaises(SearchTimeout) as context:
+            view.get_search_results(0, 5)
+        self.assertEqual(context.exception.detail['phase'], 'count')
+
+    def testCountFallback(self):
+        class Searcher(BookSearcher):
+            count_timeout = 0.05
+            count_strategy = SlowCount()
+
+        count, rows = self.getView(
+            'q=st__eq__draft', searcher_class=Searcher
+        ).get_search_results(0, 3)
+        self.assertEqual(count.as_dict(), {'count': 3, 'count_exact': False})
+        self.assertEqual(count.has_next, True)
+        self.assertEqual(len(rows), 3)
+
+
+class TestRefinementSearch(SearchTestMixin, TestCase):
+
+    def setUp(self):
+        self.createBooks()
+        self.cache = RefinementCache()
+
+    def search(self, query):
+        view = self.getView(query, refinement_cache=self.cache)
+        queryset = view.get_queryset()
+        count, rows = view.get_search_results(0, 20, queryset)
+        return str(queryset.query), count.count, [book.pk for book in rows]
+
+    def testRefine(self):
+        self.search('q=st__eq__draft&s=name')
+        draft = Book.objects.filter(status='draft', author__age__gt=20)
+        for query, expected in (
+                ('q=st__eq__draft|age__gt__20&s=name', draft),
+                ('q=age__gt__20|st__eq__draft|name__co__0&s=name',
+                 draft.filter(name__contains='0'))):
+            sql, count, pks = self.search(query)
+            self.assertIn('json_each', sql)
+            self.assertEqual(
+                pks,
+                list(expected.order_by('name').values_list('pk', flat=True))
+            )
+            self.assertEqual(count, len(pks))
+
+        stats = self.cache.stats()
+        self.assertEqual(
+            (stats['hits'], stats['misses'], stats['stores']), (2, 1, 3)
+        )
+
+        # Other clauses are not refinements
+        sql, _, _ = self.search('q=st__eq__published|age__gt__20')
+        self.assertNotIn('json_each', sql)
+
+        # The query is parsed once, with or without an ordering
+        for query in ('q=st__eq__draft|name__co__book&s=name',
+                      'q=st__eq__draft|name__co__books'):
+            with mock.patch.object(
+                    BookSearcher, 'get_clauses', autospec=True,
+                    side_effect=BookSearcher.get_clauses) as parse:
+                self.search(query)
+            self.assertEqual(parse.call_count, 1)
+
+    def testRepeat(self):
+        def page(offset):
+            view = self.getView(
+                'q=st__eq__draft&s=name', refinement_cache=self.cache
+            )
+            rows = view.get_search_results(offset, 2)[1]
+            return [book.name for book in rows]
+
+        # The count, the page and the keys of the whole result
+        with self.assertNumQueries(3):
+            self.assertEqual(page(0), ['book00', 'book02'])
+        # Next pages and repeats are read from the keys, nothing is stored
+        for offset, names in ((2, ['book04', 'book06']),
+                              (0, ['book00', 'book02'])):
+            with self.assertNumQueries(2):
+                self.assertEqual(page(offset), names)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['stores']), (2, 1))
+
+    def testLimits(self):
+        self.cache = RefinementCache(max_pks=3)
+        self.search('q=st__eq__draft')
+        self.assertEqual(len(self.cache), 0)
+
+        self.cache = RefinementCache()
+        self.search('q=st__eq__draft')
+        self.books[0].save()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)